@@ -0,0 +1,114 @@
+# _legacy.py
+
+"""Reference copy of the original row-by-row preprocess_ais_data loop.
+
+Kept only so the benchmarks can compare the vectorized feature engine
+against the implementation it replaced.
+"""
+
+def legacy_preprocess_ais_data(df):
+    """Preprocess AIS data to extract features for each vessel."""
+    import pandas as pd
+    import numpy as np
+    from datetime import datetime
+
+    # Convert timestamp to datetime if it's not already
+    if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+    # Group by MMSI (vessel identifier)
+    vessel_features = []
+
+    for mmsi, vessel_data in df.groupby('mmsi'):
+        if len(vessel_data) < 5:  # Skip vessels with too few data points
+            continue
+
+        vessel_data = vessel_data.sort_values('timestamp')
+
+        # Basic statistics
+        features = {
+            'mmsi': mmsi,
+            'lat_mean': vessel_data['lat'].mean(),
+            'lon_mean': vessel_data['lon'].mean(),
+            'sog_mean': vessel_data['sog'].mean(),
+            'cog_mean': vessel_data['cog'].mean(),
+            'heading_mean': vessel_data['heading'].mean(),
+            'lat_std': vessel_data['lat'].std(),
+            'lon_std': vessel_data['lon'].std(),
+            'sog_std': vessel_data['sog'].std(),
+            'cog_std': vessel_data['cog'].std(),
+            'heading_std': vessel_data['heading'].std(),
+            'lat_min': vessel_data['lat'].min(),
+            'lon_min': vessel_data['lon'].min(),
+            'sog_min': vessel_data['sog'].min(),
+            'cog_min': vessel_data['cog'].min(),
+            'heading_min': vessel_data['heading'].min(),
+            'lat_max': vessel_data['lat'].max(),
+            'lon_max': vessel_data['lon'].max(),
+            'sog_max': vessel_data['sog'].max(),
+            'cog_max': vessel_data['cog'].max(),
+            'heading_max': vessel_data['heading'].max(),
+        }
+
+        # Ranges
+        features.update({
+            'lat_range': features['lat_max'] - features['lat_min'],
+            'lon_range': features['lon_max'] - features['lon_min'],
+            'sog_range': features['sog_max'] - features['sog_min'],
+            'cog_range': features['cog_max'] - features['cog_min'],
+            'heading_range': features['heading_max'] - features['heading_min'],
+        })
+
+        # Time-based features
+        time_span = (vessel_data['timestamp'].max() - vessel_data['timestamp'].min()).total_seconds()
+        features.update({
+            'time_span_hours': time_span / 3600,
+            'num_points': len(vessel_data),
+            'avg_time_between_points': time_span / max(len(vessel_data) - 1, 1),
+        })
+
+        # Movement features
+        distances = []
+        for i in range(1, len(vessel_data)):
+            prev_row = vessel_data.iloc[i-1]
+            curr_row = vessel_data.iloc[i]
+            # Simplified distance calculation (Haversine would be more accurate)
+            lat_diff = curr_row['lat'] - prev_row['lat']
+            lon_diff = curr_row['lon'] - prev_row['lon']
+            distance = np.sqrt(lat_diff**2 + lon_diff**2) * 111  # Rough km conversion
+            distances.append(distance)
+
+        total_distance = sum(distances) if distances else 0
+        features.update({
+            'total_distance': total_distance,
+            'avg_speed': total_distance / max(features['time_span_hours'], 0.001),
+            'max_speed': features['sog_max'],
+        })
+
+        # Add remaining features with default values
+        remaining_features = {
+            'speed_changes': len([d for d in distances if d > 0.1]),
+            'direction_changes': 0,  # Simplified
+            'stops_count': len(vessel_data[vessel_data['sog'] < 0.5]),
+            'moving_time_ratio': len(vessel_data[vessel_data['sog'] >= 0.5]) / len(vessel_data),
+            'stationary_time_ratio': len(vessel_data[vessel_data['sog'] < 0.5]) / len(vessel_data),
+            'acceleration_mean': 0,  # Would need time-series calculation
+            'acceleration_std': 0,
+            'turn_rate_mean': 0,
+            'turn_rate_std': 0,
+            'distance_from_shore_mean': 10,  # Default assumption
+            'distance_from_shore_min': 5,
+            'in_port_ratio': 0.1,  # Default assumption
+            'night_activity_ratio': 0.3,  # Default assumption
+            'weekend_activity_ratio': 0.3,  # Default assumption
+            'speed_consistency': 1 - (features['sog_std'] / max(features['sog_mean'], 0.001)),
+            'course_consistency': 1 - (features['cog_std'] / 360),
+            'zigzag_factor': features['total_distance'] / max(np.sqrt(features['lat_range']**2 + features['lon_range']**2) * 111, 0.001),
+            'circular_variance': 0,  # Simplified
+            'linearity_index': 0.5,  # Default
+        }
+
+        features.update(remaining_features)
+        vessel_features.append(features)
+
+    return pd.DataFrame(vessel_features)
@@ -0,0 +1,110 @@
+# bench_downsample.py
+
+"""Featurization speedup and feature drift of track downsampling.
+
+Builds dense class-like tracks (``--interval`` seconds between reports) and
+featurizes them at full rate and after each downsampling setting of
+``downsample.downsample_tracks``: time bucketing, Douglas-Peucker and both.
+For every setting the report gives the points kept, the time of
+downsampling plus featurization against full-rate featurization, and how
+far the features drift from the full-rate run: the median and 95th
+percentile relative difference over all features and vessels, and the
+features that drift most. A model (the deployed one, else the benchmark
+forest of ``bench_pipeline``) classifies both feature sets; the agreement
+with the full-rate predictions and the accuracy against the generated
+classes show whether the drift matters.
+
+Usage:
+    python benchmarks/bench_downsample.py [--vessels 2000] [--points-per-vessel 2000] [--interval 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from bench_pipeline import load_model  # noqa: E402
+from downsample import downsample_tracks  # noqa: E402
+from features import compute_vessel_features  # noqa: E402
+from inference import classify, feature_matrix  # noqa: E402
+from results_store import CLASS_NAMES  # noqa: E402
+from synthetic import make_class_tracks  # noqa: E402
+
+# (label, bucket_seconds, tolerance_m)
+SETTINGS = [
+    ('bucket 30s', 30, None),
+    ('bucket 60s', 60, None),
+    ('dp 10m', None, 10),
+    ('dp 50m', None, 50),
+    ('bucket 30s + dp 10m', 30, 10),
+]
+
+# Features listed individually in the drift table
+SHOWN_FEATURES = 8
+
+
+def relative_drift(full, sampled):
+    """|sampled - full| / max(|sampled|, |full|) per feature (0 where both are 0), vessels aligned by mmsi."""
+    sampled = sampled.set_index('mmsi').reindex(full['mmsi'])
+    columns = [col for col in full.columns if col != 'mmsi']
+    full_values = full[columns].to_numpy(dtype=np.float64)
+    sampled_values = sampled[columns].to_numpy(dtype=np.float64)
+    scale = np.maximum(np.abs(full_values), np.abs(sampled_values))
+    difference = np.abs(sampled_values - full_values)
+    return columns, np.divide(difference, scale, out=np.zeros_like(difference), where=scale > 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vessels', type=int, default=2000)
+    parser.add_argument('--points-per-vessel', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    frame, labels = make_class_tracks(args.vessels, args.points_per_vessel, args.interval, seed=args.seed)
+    model, feature_columns = load_model(args.seed)
+    truth = labels.map({name: i for i, name in enumerate(CLASS_NAMES)})
+
+    start = time.perf_counter()
+    full = compute_vessel_features(frame)
+    full_seconds = time.perf_counter() - start
+    full_predictions, _ = classify(model, feature_matrix(full, feature_columns))
+    full_accuracy = (truth.reindex(full['mmsi']).to_numpy() == full_predictions).mean()
+
+    print(f'{len(frame)} rows, {args.vessels} vessels, one report every {args.interval:g}s')
+    print(f'full rate: featurize {full_seconds:.2f}s, accuracy {full_accuracy:.3f}')
+    print(f"{'setting':>20} {'kept':>7} {'downsample':>11} {'featurize':>10} {'speedup':>8} "
+          f"{'drift p50':>10} {'drift p95':>10} {'agree':>6} {'accuracy':>9}")
+
+    worst = {}
+    for label, bucket_seconds, tolerance_m in SETTINGS:
+        start = time.perf_counter()
+        sampled_rows = downsample_tracks(frame, bucket_seconds, tolerance_m)
+        downsample_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        sampled = compute_vessel_features(sampled_rows)
+        featurize_seconds = time.perf_counter() - start
+
+        columns, drift = relative_drift(full, sampled)
+        worst[label] = dict(zip(columns, np.nanmedian(drift, axis=0)))
+        predictions, _ = classify(model, feature_matrix(sampled.set_index('mmsi').reindex(full['mmsi'])
+                                                        .reset_index(), feature_columns))
+        agreement = (predictions == full_predictions).mean()
+        accuracy = (truth.reindex(full['mmsi']).to_numpy() == predictions).mean()
+        print(f'{label:>20} {len(sampled_rows) / len(frame):7.1%} {downsample_seconds:10.2f}s '
+              f'{featurize_seconds:9.2f}s {full_seconds / (downsample_seconds + featurize_seconds):7.1f}x '
+              f'{np.nanmedian(drift):10.3f} {np.nanpercentile(drift, 95):10.3f} {agreement:6.3f} {accuracy:9.3f}')
+
+    print(f'\nMedian relative drift of the {SHOWN_FEATURES} most affected features per setting:')
+    for label, per_feature in worst.items():
+        ranked = sorted(per_feature.items(), key=lambda item: -item[1])[:SHOWN_FEATURES]
+        print(f'{label:>20}: ' + ', '.join(f'{name} {value:.2f}' for name, value in ranked))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# bench_fanout.py
+
+"""Compare chunk policies for the process-chunk fan-out against the Pub/Sub emulator.
+
+For each policy the benchmark:
+
+  measures   the local process_chunk steps (decode, prepare, predict,
+             resultEncode) on one full batched message of the policy's
+             chunks, best of ``--repeats``; Storage and Firestore round trips
+             are not included
+  publishes  the policy's batched messages through the batched publisher and
+             drains them again through a pull subscription, timing both
+  models     the processing wall time as waves of ``--concurrency``
+             invocations, each charged ``--cold-start`` plus the measured
+             message time. This column is an estimate, not a measurement.
+
+``--no-emulator`` only measures the chunk steps.
+
+Usage:
+    gcloud beta emulators pubsub start --host-port=localhost:8085 &
+    python benchmarks/bench_fanout.py [--vessels 200000] [--concurrency 100] [--no-emulator]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from bench_pipeline import load_model  # noqa: E402
+from chunk_io import CHUNK_EXTENSIONS, CHUNK_FORMAT, decode_chunk, encode_chunk  # noqa: E402
+from fanout import (  # noqa: E402
+    PER_VESSEL_SECONDS,
+    PUBLISH_BATCH_MAX_BYTES,
+    PUBLISH_BATCH_MAX_LATENCY,
+    PUBLISH_BATCH_MAX_MESSAGES,
+    choose_chunk_size,
+    publish_json,
+    wait_for_publishes,
+)
+from features import compute_vessel_features  # noqa: E402
+from inference import classify, feature_matrix, inference_batch_vessels  # noqa: E402
+from results_store import encode_result_docs  # noqa: E402
+from synthetic import make_class_tracks  # noqa: E402
+
+POLICIES = {
+    'fixed-100': {'chunkSize': 100},
+    'adaptive-5s': {'targetChunkSeconds': 5.0},
+    'adaptive-20s': {},
+    'adaptive-60s': {'targetChunkSeconds': 60.0},
+}
+
+
+def make_chunk(features, chunk_size, seed):
+    """A chunk of ``chunk_size`` vessels resampled from ``features``, with distinct MMSIs."""
+    rng = np.random.default_rng(seed)
+    chunk = features.iloc[rng.integers(0, len(features), chunk_size)].reset_index(drop=True)
+    chunk['mmsi'] = np.arange(100000000, 100000000 + chunk_size)
+    return chunk
+
+
+def measure_message(chunk, model, feature_columns, repeats):
+    """Best-of-``repeats`` seconds of the local process_chunk steps on the stacked vessels of one message."""
+    payload = encode_chunk(chunk, CHUNK_FORMAT)
+    path = f'chunks/bench/0{CHUNK_EXTENSIONS[CHUNK_FORMAT]}'
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        data = decode_chunk(payload, path)
+        predictions, probabilities = classify(model, feature_matrix(data, feature_columns))
+        encode_result_docs(data['mmsi'].to_numpy(), predictions, probabilities)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def drain_policy(name, message_count, args, publisher, subscriber):
+    """Publish and pull ``message_count`` chunk messages; returns ``(publish_seconds, drain_seconds)``."""
+    from google.api_core.exceptions import AlreadyExists
+
+    topic_path = publisher.topic_path(args.project, f'bench-fanout-{name}')
+    subscription_path = subscriber.subscription_path(args.project, f'bench-fanout-{name}')
+    try:
+        publisher.create_topic(request={'name': topic_path})
+    except AlreadyExists:
+        pass
+    try:
+        subscriber.create_subscription(request={'name': subscription_path, 'topic': topic_path})
+    except AlreadyExists:
+        pass
+
+    start = time.perf_counter()
+    futures = [
+        publish_json(publisher, topic_path, {'jobId': 'bench', 'chunks': [{'chunkId': i, 'chunkPath': f'chunks/bench/{i}.parquet'}]})
+        for i in range(message_count)
+    ]
+    wait_for_publishes(futures)
+    publish_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    received = 0
+    while received < message_count:
+        response = subscriber.pull(request={'subscription': subscription_path, 'max_messages': 1000}, timeout=30)
+        ack_ids = [m.ack_id for m in response.received_messages]
+        if ack_ids:
+            subscriber.acknowledge(request={'subscription': subscription_path, 'ack_ids': ack_ids})
+        received += len(ack_ids)
+    drain_seconds = time.perf_counter() - start
+
+    subscriber.delete_subscription(request={'subscription': subscription_path})
+    publisher.delete_topic(request={'topic': topic_path})
+    return publish_seconds, drain_seconds
+
+
+def run_policy(name, settings, args, features, model, feature_columns, publisher, subscriber):
+    chunk_size = choose_chunk_size(args.vessels, settings)
+    chunk_count = math.ceil(args.vessels / chunk_size)
+    chunks_per_message = max(1, inference_batch_vessels(chunk_size, settings) // chunk_size)
+    message_count = math.ceil(chunk_count / chunks_per_message)
+    message_vessels = min(chunks_per_message * chunk_size, args.vessels)
+
+    message = make_chunk(features, message_vessels, args.seed)
+    message_seconds = measure_message(message, model, feature_columns, args.repeats)
+    if publisher is not None:
+        publish_seconds, drain_seconds = drain_policy(name, message_count, args, publisher, subscriber)
+        publish_col, drain_col = f'{publish_seconds:>10.2f}', f'{drain_seconds:>8.2f}'
+    else:
+        publish_col, drain_col = f"{'-':>10}", f"{'-':>8}"
+
+    waves = math.ceil(message_count / args.concurrency)
+    modeled_seconds = waves * (args.cold_start + message_seconds)
+    print(f'{name:>14} {chunk_size:>10} {message_vessels:>9} {message_count:>11} {message_seconds:>9.3f} '
+          f'{message_seconds / message_vessels * 1e6:>10.1f} {message_vessels * PER_VESSEL_SECONDS:>12.1f} '
+          f'{publish_col} {drain_col} {modeled_seconds:>12.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vessels', type=int, default=200000)
+    parser.add_argument('--project', default='demo-project')
+    parser.add_argument('--emulator-host', default='localhost:8085')
+    parser.add_argument('--concurrency', type=int, default=100, help='max concurrent function instances')
+    parser.add_argument('--cold-start', type=float, default=3.0, help='seconds of cold start and model load per invocation')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-emulator', action='store_true', help='only measure the chunk steps')
+    args = parser.parse_args()
+
+    model, feature_columns = load_model(args.seed)
+    frame, _ = make_class_tracks(2000, seed=args.seed)
+    features = compute_vessel_features(frame)
+
+    publisher = subscriber = None
+    if not args.no_emulator:
+        os.environ.setdefault('PUBSUB_EMULATOR_HOST', args.emulator_host)
+        from google.cloud import pubsub_v1
+
+        publisher = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+                max_bytes=PUBLISH_BATCH_MAX_BYTES,
+                max_latency=PUBLISH_BATCH_MAX_LATENCY,
+            )
+        )
+        subscriber = pubsub_v1.SubscriberClient()
+
+    print(f"{'policy':>14} {'chunk size':>10} {'message':>9} {'invocations':>11} {'message s':>9} {'us/vessel':>10} "
+          f"{'PER_VESSEL s':>12} {'publish s':>10} {'drain s':>8} {'modeled s':>12}")
+    for name, settings in POLICIES.items():
+        run_policy(name, settings, args, features, model, feature_columns, publisher, subscriber)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# bench_features.py
+
+"""Compare the vectorized feature engine with the original row-by-row loop.
+
+Usage:
+    python benchmarks/bench_features.py [--sizes 100000 1000000 10000000]
+                                        [--legacy-max-rows N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from features import FEATURE_COLUMNS, compute_vessel_features  # noqa: E402
+from _legacy import legacy_preprocess_ais_data  # noqa: E402
+from synthetic import make_ais_frame  # noqa: E402
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+# Features whose definition changed after the legacy loop (haversine
+# distances and real kinematics instead of constants)
+REDEFINED_FEATURES = {
+    'total_distance', 'avg_speed', 'speed_changes', 'zigzag_factor',
+    'direction_changes', 'acceleration_mean', 'acceleration_std',
+    'turn_rate_mean', 'turn_rate_std', 'circular_variance', 'linearity_index',
+}
+
+
+def check_compatible(new, old, skip=REDEFINED_FEATURES):
+    """Assert the two feature frames agree column for column."""
+    assert list(new.columns) == list(old.columns) == FEATURE_COLUMNS
+    assert len(new) == len(old)
+    for col in FEATURE_COLUMNS:
+        if col in skip:
+            continue
+        np.testing.assert_allclose(
+            new[col].to_numpy(dtype=float), old[col].to_numpy(dtype=float),
+            rtol=1e-9, atol=1e-9, err_msg=col,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**5, 10**6, 10**7])
+    parser.add_argument('--legacy-max-rows', type=int, default=10**5,
+                        help='skip the legacy per-vessel loop above this many rows (it takes hours at 10**7)')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'vessels':>8} {'vectorized s':>13} {'legacy s':>10} {'speedup':>8}")
+    for size in args.sizes:
+        df = make_ais_frame(size)
+        new, new_time = timed(compute_vessel_features, df)
+
+        if size <= args.legacy_max_rows:
+            old, old_time = timed(legacy_preprocess_ais_data, df.copy())
+            check_compatible(new, old)
+            legacy_col = f'{old_time:10.2f}'
+            speedup = f'{old_time / new_time:7.1f}x'
+        else:
+            legacy_col, speedup = f"{'-':>10}", f"{'-':>8}"
+
+        print(f'{size:>10} {len(new):>8} {new_time:13.3f} {legacy_col} {speedup}')
+
+
+if __name__ == '__main__':
+    main()
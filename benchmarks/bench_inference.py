@@ -0,0 +1,117 @@
+# bench_inference.py
+
+"""Vessels/sec of per-chunk inference vs. batched inference.
+
+Both paths classify the same feature rows and pack the results into result
+documents:
+  per-chunk  one 100-vessel chunk at a time: the original column-by-column
+             feature preparation, ``predict`` and a separate ``predict_proba``
+  batched    chunks coalesced up to ``--batch`` vessels: vectorized
+             ``inference.feature_matrix``, one ``predict_proba`` and argmax,
+             results split back per chunk
+
+The model is the deployed artifact if present, else a random forest fitted
+on the synthetic features. Predictions of both paths are checked to match.
+
+Usage:
+    python benchmarks/bench_inference.py [--vessels 100000] [--batch 10000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from inference import chunk_bounds, classify, feature_matrix  # noqa: E402
+from model_store import EXPECTED_FEATURES, MODEL_PATH, ModelCache  # noqa: E402
+from results_store import encode_result_docs  # noqa: E402
+
+CHUNK_VESSELS = 100
+
+
+def make_features(vessels, seed=0):
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.normal(size=(vessels, len(EXPECTED_FEATURES))), columns=EXPECTED_FEATURES)
+    features.insert(0, 'mmsi', 200000000 + np.arange(vessels))
+    return features
+
+
+def load_model(features):
+    if os.path.exists(MODEL_PATH):
+        model, feature_columns, _ = ModelCache().get()
+        return model, feature_columns
+    from sklearn.ensemble import RandomForestClassifier
+
+    labels = np.digitize(features[EXPECTED_FEATURES[0]], [-0.7, 0, 0.7])
+    model = RandomForestClassifier(n_estimators=100, n_jobs=1, random_state=0)
+    model.fit(features[EXPECTED_FEATURES].iloc[:20000], labels[:20000])
+    return model, EXPECTED_FEATURES
+
+
+def legacy_prepare(data, feature_columns):
+    model_features = [col for col in feature_columns if col != 'mmsi' and col in data.columns]
+    X = data[model_features].copy().fillna(0)
+    for col in X.columns:
+        X[col] = pd.to_numeric(X[col], errors='coerce').fillna(0)
+    return X, data['mmsi'].tolist()
+
+
+def per_chunk(features, model, feature_columns):
+    predictions = []
+    for start in range(0, len(features), CHUNK_VESSELS):
+        chunk = features.iloc[start:start + CHUNK_VESSELS]
+        X, vessel_ids = legacy_prepare(chunk, feature_columns)
+        chunk_predictions = model.predict(X)
+        probabilities = model.predict_proba(X)
+        encode_result_docs(vessel_ids, chunk_predictions, probabilities)
+        predictions.append(chunk_predictions)
+    return np.concatenate(predictions)
+
+
+def batched(features, model, feature_columns, batch_vessels):
+    predictions = []
+    chunks_per_batch = max(1, batch_vessels // CHUNK_VESSELS)
+    for batch_start in range(0, len(features), chunks_per_batch * CHUNK_VESSELS):
+        batch = features.iloc[batch_start:batch_start + chunks_per_batch * CHUNK_VESSELS]
+        X = feature_matrix(batch, feature_columns)
+        batch_predictions, probabilities = classify(model, X)
+        vessel_ids = batch['mmsi'].to_numpy()
+        sizes = [min(CHUNK_VESSELS, len(batch) - start) for start in range(0, len(batch), CHUNK_VESSELS)]
+        for start, end in chunk_bounds(sizes):
+            encode_result_docs(vessel_ids[start:end], batch_predictions[start:end], probabilities[start:end])
+        predictions.append(batch_predictions)
+    return np.concatenate(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vessels', type=int, default=100_000)
+    parser.add_argument('--batch', type=int, default=10_000)
+    args = parser.parse_args()
+
+    features = make_features(args.vessels)
+    model, feature_columns = load_model(features)
+
+    timings = {}
+    results = {}
+    for name, run in (('per-chunk', lambda: per_chunk(features, model, feature_columns)),
+                      ('batched', lambda: batched(features, model, feature_columns, args.batch))):
+        start = time.perf_counter()
+        results[name] = run()
+        timings[name] = time.perf_counter() - start
+    np.testing.assert_array_equal(results['per-chunk'], results['batched'])
+
+    print(f'{args.vessels} vessels, {CHUNK_VESSELS}-vessel chunks, batches of {args.batch}')
+    print(f"{'path':>10} {'seconds':>9} {'vessels/s':>11}")
+    for name, seconds in timings.items():
+        print(f'{name:>10} {seconds:9.2f} {args.vessels / seconds:11.0f}')
+    print(f"speedup {timings['per-chunk'] / timings['batched']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# bench_kinematics.py
+
+"""Throughput of the haversine kinematics against the flat distance approximation.
+
+Reports rows/sec for:
+  legacy-loop    the original per-vessel iloc loop (flat distance only)
+  flat-steps     vectorized flat sqrt(dlat^2 + dlon^2) * 111 step distances
+  kinematics     vectorized haversine distance, acceleration, turn rate,
+                 direction changes and circular sums
+  features       the full compute_vessel_features pipeline
+
+Usage:
+    python benchmarks/bench_kinematics.py [--rows 1000000] [--legacy-rows 100000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from features import compute_vessel_features, timestamps_to_ns  # noqa: E402
+from kinematics import circular_sums, group_moments, step_kinematics  # noqa: E402
+from _legacy import legacy_preprocess_ais_data  # noqa: E402
+from synthetic import make_ais_frame  # noqa: E402
+
+
+def sorted_arrays(df):
+    mmsi = df['mmsi'].to_numpy()
+    ts = timestamps_to_ns(df['timestamp'])
+    order = np.lexsort((ts, mmsi))
+    mmsi = mmsi[order]
+    codes = np.cumsum(np.r_[False, mmsi[1:] != mmsi[:-1]])
+    arrays = {col: df[col].to_numpy(dtype=np.float64)[order] for col in ('lat', 'lon', 'sog', 'cog')}
+    return ts[order], codes, arrays
+
+
+def flat_steps(ts, codes, a):
+    same_vessel = codes[1:] == codes[:-1]
+    steps = np.hypot(np.diff(a['lat']), np.diff(a['lon']))[same_vessel] * 111
+    return np.bincount(codes[1:][same_vessel], weights=steps)
+
+
+def kinematic_steps(ts, codes, a):
+    n_groups = codes[-1] + 1
+    same_vessel = codes[1:] == codes[:-1]
+    step_codes = codes[1:][same_vessel]
+    steps = step_kinematics(ts, a['lat'], a['lon'], a['sog'], a['cog'], same_vessel)
+    np.bincount(step_codes, weights=steps['distance'], minlength=n_groups)
+    np.bincount(step_codes[steps['course_change'] > 45], minlength=n_groups)
+    group_moments(steps['acceleration'], step_codes, n_groups)
+    group_moments(steps['turn_rate'], step_codes, n_groups)
+    circular_sums(a['cog'], codes, n_groups)
+
+
+def rate(fn, rows, *args, repeat=3):
+    best = min(_timed(fn, *args) for _ in range(repeat))
+    return rows / best
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10**6)
+    parser.add_argument('--legacy-rows', type=int, default=10**5)
+    args = parser.parse_args()
+
+    df = make_ais_frame(args.rows)
+    ts, codes, arrays = sorted_arrays(df)
+    legacy_df = df.iloc[:args.legacy_rows].copy()
+
+    results = {
+        'legacy-loop': rate(legacy_preprocess_ais_data, len(legacy_df), legacy_df, repeat=1),
+        'flat-steps': rate(flat_steps, args.rows, ts, codes, arrays),
+        'kinematics': rate(kinematic_steps, args.rows, ts, codes, arrays),
+        'features': rate(compute_vessel_features, args.rows, df),
+    }
+    for name, rows_per_sec in results.items():
+        print(f'{name:>12} {rows_per_sec:>14,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# bench_memory.py
+
+"""Memory per AIS row with inferred dtypes vs. the compact AIS schema.
+
+For the bundled sample and a synthetic CSV, each reader runs in a fresh
+subprocess and reports:
+  frame B/row    DataFrame.memory_usage(deep=True) per row after reading
+  peak B/row     growth of the process's peak RSS while reading, per row
+
+Readers:
+  inferred   pd.read_csv with inferred dtypes, then pd.to_datetime (original)
+  compact    ingest.read_ais_csv (pyarrow, fixed ISO timestamp parsing)
+             followed by validation into uint32/float32/UInt16 columns
+
+Usage:
+    python benchmarks/bench_memory.py [--rows 1000000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'functions')
+sys.path.insert(0, FUNCTIONS_DIR)
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), '..', 'sample-ais-data.csv')
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(reader, path):
+    """Child process: read ``path`` with ``reader`` and print the measurements as JSON."""
+    import pandas as pd
+
+    from ingest import read_ais_csv
+    from validation import RowValidator
+
+    before = _peak_rss_bytes()
+    if reader == 'inferred':
+        df = pd.read_csv(path)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    else:
+        df = RowValidator()(read_ais_csv(path))
+    peak = _peak_rss_bytes() - before
+
+    print(json.dumps({
+        'rows': len(df),
+        'frame_bytes': int(df.memory_usage(deep=True).sum()),
+        'peak_bytes': peak,
+        'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }))
+
+
+def run(reader, path):
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', reader, path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10**6)
+    parser.add_argument('--child', nargs=2, metavar=('READER', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(*args.child)
+        return
+
+    sys.path.insert(0, os.path.dirname(__file__))
+    from synthetic import make_ais_frame
+
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_path = os.path.join(directory, 'synthetic.csv')
+        make_ais_frame(args.rows).to_csv(synthetic_path, index=False)
+
+        print(f"{'file':>10} {'reader':>9} {'rows':>9} {'frame B/row':>12} {'peak B/row':>11}")
+        for name, path in (('sample', SAMPLE_PATH), ('synthetic', synthetic_path)):
+            for reader in ('inferred', 'compact'):
+                result = run(reader, path)
+                rows = max(result['rows'], 1)
+                print(f"{name:>10} {reader:>9} {result['rows']:>9} "
+                      f"{result['frame_bytes'] / rows:12.1f} {result['peak_bytes'] / rows:11.1f}")
+
+
+if __name__ == '__main__':
+    main()
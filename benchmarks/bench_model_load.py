@@ -0,0 +1,95 @@
+# bench_model_load.py
+
+"""Cold-start benchmark for model loading.
+
+Each measurement runs in a fresh interpreter and reports, separately, the
+time to import the ML stack, load the artifact (with and without
+``mmap_mode``) and run the first and a second prediction.
+
+Usage:
+    python benchmarks/bench_model_load.py [--model PATH] [--runs 3]
+
+Without ``--model`` a synthetic random forest with the production feature
+count is trained and saved both compressed and uncompressed.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+COLD_START_SCRIPT = '''
+import json, sys, time
+sys.path.insert(0, {functions_dir!r})
+t0 = time.perf_counter()
+import numpy as np
+import joblib
+import sklearn.ensemble
+from model_store import ModelCache
+t1 = time.perf_counter()
+cache = ModelCache({path!r}, mmap_mode={mmap_mode!r})
+model, features, version = cache.get()
+t2 = time.perf_counter()
+X = np.random.default_rng(0).random((100, len(features)))
+model.predict_proba(X)
+t3 = time.perf_counter()
+model.predict_proba(X)
+t4 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'load': t2 - t1, 'first_predict': t3 - t2,
+                   'second_predict': t4 - t3, 'version': version[:12]}}))
+'''
+
+
+def build_synthetic_models(directory):
+    import joblib
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+
+    sys.path.insert(0, FUNCTIONS_DIR)
+    from model_store import EXPECTED_FEATURES
+
+    rng = np.random.default_rng(0)
+    X = rng.random((5000, len(EXPECTED_FEATURES)))
+    y = rng.integers(0, 4, size=len(X))
+    model = RandomForestClassifier(n_estimators=200, n_jobs=1, random_state=0).fit(X, y)
+
+    artifact = {'model': model, 'feature_columns': EXPECTED_FEATURES}
+    compressed = os.path.join(directory, 'model_compressed.joblib')
+    uncompressed = os.path.join(directory, 'model_uncompressed.joblib')
+    joblib.dump(artifact, compressed, compress=3)
+    joblib.dump(artifact, uncompressed, compress=0)
+    return [compressed, uncompressed]
+
+
+def cold_start(path, mmap):
+    script = COLD_START_SCRIPT.format(functions_dir=FUNCTIONS_DIR, path=path, mmap_mode='r' if mmap else None)
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', help='model artifact to benchmark (default: synthetic)')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [args.model] if args.model else build_synthetic_models(directory)
+
+        print(f"{'artifact':>36} {'mmap':>5} {'import s':>9} {'load s':>8} {'1st predict s':>14} {'2nd predict s':>14}")
+        for path in paths:
+            size_mb = os.path.getsize(path) / 1e6
+            for mmap in (False, True):
+                runs = [cold_start(path, mmap) for _ in range(args.runs)]
+                best = {key: min(run[key] for run in runs) for key in ('import', 'load', 'first_predict', 'second_predict')}
+                label = f'{os.path.basename(path)} ({size_mb:.0f} MB)'
+                print(f"{label:>36} {str(mmap):>5} {best['import']:9.3f} {best['load']:8.3f} "
+                      f"{best['first_predict']:14.4f} {best['second_predict']:14.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# bench_parallel.py
+
+"""Scaling of process-pool feature extraction with the worker count.
+
+Featurizes one synthetic frame with 1, 2, 4 and 8 workers (the shared-memory
+shards of ``parallel.parallel_vessel_features``), checks every run against
+the single-process result and reports wall time and speedup. Worker counts
+above the available CPUs are still run but marked, since they cannot scale.
+
+Usage:
+    python benchmarks/bench_parallel.py [--rows 10000000] [--workers 1 2 4 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from features import compute_vessel_features  # noqa: E402
+from parallel import _get_pool, available_cpus, parallel_vessel_features  # noqa: E402
+from synthetic import make_ais_frame  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10**7)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    df = make_ais_frame(args.rows)
+    cpus = available_cpus()
+    print(f'{args.rows} rows, {cpus} CPUs available')
+
+    start = time.perf_counter()
+    expected = compute_vessel_features(df).reset_index(drop=True)
+    baseline = time.perf_counter() - start
+
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+    for workers in args.workers:
+        if workers > 1:
+            # Start the pool outside the timed region, as a warm instance would have it
+            _get_pool(workers).submit(int).result()
+        start = time.perf_counter()
+        result = parallel_vessel_features(df, workers)
+        elapsed = time.perf_counter() - start
+        pd.testing.assert_frame_equal(result, expected)
+        note = '  (more workers than CPUs)' if workers > cpus else ''
+        print(f'{workers:>8} {elapsed:9.2f} {baseline / elapsed:7.2f}x{note}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# bench_pipeline.py
+
+"""End-to-end throughput of the upload and chunk pipelines on synthetic AIS data.
+
+Writes a class-like synthetic CSV (``synthetic.write_ais_csv``), then runs
+the same steps as on_file_upload and process_chunk with in-memory stand-ins
+for Storage and Firestore:
+
+  upload  readCsv -> validate -> featurize -> encodeChunk -> chunkUpload
+          (``--mode streaming`` replaces the first three with ``ingest``)
+  chunk   download -> decode -> prepare -> predict -> resultEncode -> resultWrite
+
+Each stage is timed with ``instrumentation.StageTimer``. The report gives
+seconds and rows/sec per stage, overall rows/sec and the process's peak RSS.
+``--output`` saves the report as JSON. ``--baseline`` compares against a
+saved report and exits non-zero if a stage got slower by more than
+``--tolerance``.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--rows 1000000] [--mode in-memory|streaming]
+        [--csv existing.csv] [--output report.json] [--baseline report.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from chunk_io import CHUNK_EXTENSIONS, CHUNK_FORMAT, decode_chunk, encode_chunk  # noqa: E402
+from fanout import choose_chunk_size  # noqa: E402
+from features import compute_vessel_features  # noqa: E402
+from inference import classify, feature_matrix  # noqa: E402
+from ingest import read_ais_csv, stream_vessel_features  # noqa: E402
+from instrumentation import StageTimer  # noqa: E402
+from model_store import EXPECTED_FEATURES, MODEL_PATH, ModelCache  # noqa: E402
+from parallel import available_cpus, parallel_vessel_features  # noqa: E402
+from results_store import CLASS_NAMES, encode_result_docs  # noqa: E402
+from synthetic import make_class_tracks, write_ais_csv  # noqa: E402
+from validation import RowValidator  # noqa: E402
+
+
+class MemoryBucket:
+    """Storage stand-in keeping blobs in a dict."""
+
+    def __init__(self):
+        self.blobs = {}
+
+    def upload(self, name, data):
+        self.blobs[name] = bytes(data)
+
+    def download(self, name):
+        return self.blobs[name]
+
+
+class MemoryCollection:
+    """Firestore collection stand-in keeping documents in a dict."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def set(self, doc_id, doc):
+        self.docs[doc_id] = dict(doc)
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_model(seed):
+    """The deployed model if present, else a forest fitted on separately generated tracks."""
+    if os.path.exists(MODEL_PATH):
+        model, feature_columns, _ = ModelCache().get()
+        return model, feature_columns
+    from sklearn.ensemble import RandomForestClassifier
+
+    frame, labels = make_class_tracks(2000, seed=seed + 1000)
+    features = compute_vessel_features(frame)
+    y = labels.reindex(features['mmsi']).map({name: i for i, name in enumerate(CLASS_NAMES)}).to_numpy()
+    model = RandomForestClassifier(n_estimators=100, random_state=0)
+    model.fit(feature_matrix(features, EXPECTED_FEATURES), y)
+    return model, EXPECTED_FEATURES
+
+
+def run_upload(path, mode, workers, timer):
+    file_size = os.path.getsize(path)
+    validator = RowValidator()
+    if mode == 'streaming':
+        with timer.stage('ingest', nbytes=file_size) as span:
+            features, rows, _ = stream_vessel_features(lambda: open(path, 'rb'), validate=validator)
+            span.rows = rows
+        return features, rows
+
+    with timer.stage('readCsv', nbytes=file_size) as span:
+        raw = read_ais_csv(path)
+        span.rows = len(raw)
+    with timer.stage('validate', rows=len(raw)):
+        raw = validator(raw)
+    with timer.stage('featurize', rows=len(raw)):
+        features = parallel_vessel_features(raw, workers)
+    return features, len(raw)
+
+
+def run_chunks(features, bucket, results, model, feature_columns, timer):
+    chunk_size = choose_chunk_size(len(features))
+    paths = []
+    for chunk_id, start in enumerate(range(0, len(features), chunk_size)):
+        chunk = features.iloc[start:start + chunk_size]
+        with timer.stage('encodeChunk', rows=len(chunk)):
+            payload = encode_chunk(chunk, CHUNK_FORMAT)
+        path = f'chunks/bench/{chunk_id}{CHUNK_EXTENSIONS[CHUNK_FORMAT]}'
+        with timer.stage('chunkUpload', rows=len(chunk), nbytes=len(payload)):
+            bucket.upload(path, payload)
+        paths.append(path)
+
+    predictions = []
+    for chunk_id, path in enumerate(paths):
+        with timer.stage('download') as span:
+            payload = bucket.download(path)
+            span.bytes = len(payload)
+        with timer.stage('decode', nbytes=len(payload)) as span:
+            data = decode_chunk(payload, path)
+            span.rows = len(data)
+        with timer.stage('prepare', rows=len(data)):
+            X = feature_matrix(data, feature_columns)
+        with timer.stage('predict', rows=len(data)):
+            chunk_predictions, probabilities = classify(model, X)
+        with timer.stage('resultEncode', rows=len(data)):
+            docs = encode_result_docs(data['mmsi'].to_numpy(), chunk_predictions, probabilities)
+        with timer.stage('resultWrite', rows=len(data)):
+            for doc in docs:
+                results.set(f"{chunk_id}-{doc['part']}", doc)
+        predictions.append(pd.Series(chunk_predictions, index=data['mmsi'].to_numpy()))
+    return pd.concat(predictions) if predictions else pd.Series(dtype=np.int64)
+
+
+def compare(report, baseline, tolerance, min_seconds):
+    """Stages slower than ``baseline`` by more than ``tolerance`` (per row where both have rows).
+
+    Stages shorter than ``min_seconds`` in both runs are too noisy to compare.
+    """
+    regressions = []
+    for name, stage in report['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if not before or max(before['seconds'], stage['seconds']) < min_seconds:
+            continue
+        now = stage['seconds'] / stage.get('rows', 1) if stage.get('rows') else stage['seconds']
+        then = before['seconds'] / before.get('rows', 1) if before.get('rows') else before['seconds']
+        if then > 0 and now > then * (1 + tolerance):
+            regressions.append((name, then, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10**6)
+    parser.add_argument('--points-per-vessel', type=int, default=200)
+    parser.add_argument('--mode', choices=['in-memory', 'streaming'], default='in-memory')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='Use this CSV instead of generating one')
+    parser.add_argument('--output', help='Write the report as JSON')
+    parser.add_argument('--baseline', help='Report JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--min-seconds', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        labels = None
+        path = args.csv
+        if path is None:
+            path = os.path.join(directory, 'synthetic.csv')
+            start = time.perf_counter()
+            labels = write_ais_csv(path, args.rows, args.points_per_vessel, seed=args.seed)
+            print(f'Generated {os.path.getsize(path) / 1e6:.0f} MB in {time.perf_counter() - start:.1f}s')
+
+        model, feature_columns = load_model(args.seed)
+        timer = StageTimer('bench', 'pipeline')
+        rss_before = _peak_rss_bytes()
+        start = time.perf_counter()
+        features, rows = run_upload(path, args.mode, args.workers or available_cpus(), timer)
+        predictions = run_chunks(features, MemoryBucket(), MemoryCollection(), model, feature_columns, timer)
+        elapsed = time.perf_counter() - start
+
+    report = {
+        'rows': rows,
+        'vessels': len(features),
+        'mode': args.mode,
+        'seconds': elapsed,
+        'rowsPerSecond': rows / elapsed,
+        'peakRssBytes': _peak_rss_bytes(),
+        'peakRssGrowthBytes': _peak_rss_bytes() - rss_before,
+        'stages': timer.summary(),
+    }
+
+    print(f"{rows} rows, {len(features)} vessels, {args.mode}: {elapsed:.2f}s, {report['rowsPerSecond']:.0f} rows/s, "
+          f"peak RSS {report['peakRssBytes'] / 2**20:.0f} MiB")
+    if labels is not None and len(predictions):
+        truth = labels.reindex(predictions.index).map({name: i for i, name in enumerate(CLASS_NAMES)})
+        print(f'Accuracy against generated classes: {(truth.to_numpy() == predictions.to_numpy()).mean():.3f}')
+    print(f"{'stage':>14} {'calls':>6} {'seconds':>9} {'rows/s':>12}")
+    for name, stage in report['stages'].items():
+        rate = f"{stage['rows'] / stage['seconds']:12.0f}" if stage.get('rows') and stage['seconds'] > 0 else f"{'':>12}"
+        print(f"{name:>14} {stage['calls']:>6} {stage['seconds']:9.3f} {rate}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_seconds)
+        for name, then, now in regressions:
+            print(f'REGRESSION {name}: {then:.3g} -> {now:.3g} s/row ({now / then - 1:+.0%})')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# bench_spatial.py
+
+"""Query throughput of the shore/port spatial index.
+
+Builds an index from the given coastline and port GeoJSON files (or from a
+synthetic archipelago when none are given), saves it, loads it memory-mapped
+and reports queries/sec for nearest-shore distance and point-in-port over
+random AIS-like points.
+
+Usage:
+    python benchmarks/bench_spatial.py [--points 1000000]
+                                       [--coastline FILE --ports FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from spatial import SpatialIndex, build_spatial_index  # noqa: E402
+
+
+def write_synthetic_geojson(directory, islands=2000, vertices_per_island=400, ports=5000, seed=0):
+    """Write a synthetic coastline (circular islands) and port points."""
+    rng = np.random.default_rng(seed)
+    centers = np.column_stack([rng.uniform(-170, 170, islands), rng.uniform(-60, 60, islands)])
+    radii = rng.uniform(0.05, 1.0, islands)
+    angles = np.linspace(0, 2 * np.pi, vertices_per_island)
+    coastline = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': np.column_stack([
+            cx + r * np.cos(angles), cy + r * np.sin(angles)]).tolist()}}
+        for (cx, cy), r in zip(centers, radii)
+    ]}
+
+    island = rng.integers(0, islands, ports)
+    theta = rng.uniform(0, 2 * np.pi, ports)
+    port_points = centers[island] + radii[island, None] * np.column_stack([np.cos(theta), np.sin(theta)])
+    port_collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': point.tolist()}}
+        for point in port_points
+    ]}
+
+    coastline_path = os.path.join(directory, 'coastline.geojson')
+    ports_path = os.path.join(directory, 'ports.geojson')
+    with open(coastline_path, 'w') as f:
+        json.dump(coastline, f)
+    with open(ports_path, 'w') as f:
+        json.dump(port_collection, f)
+    return coastline_path, ports_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=10**6)
+    parser.add_argument('--coastline')
+    parser.add_argument('--ports')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.coastline and args.ports:
+            coastline_path, ports_path = args.coastline, args.ports
+        else:
+            coastline_path, ports_path = write_synthetic_geojson(directory)
+
+        start = time.perf_counter()
+        index_path = os.path.join(directory, 'spatial_index.joblib')
+        build_spatial_index(coastline_path, ports_path).save(index_path)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = SpatialIndex.load(index_path, mmap_mode='r')
+        load_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(1)
+        lat = rng.uniform(-60, 60, args.points)
+        lon = rng.uniform(-170, 170, args.points)
+
+        start = time.perf_counter()
+        index.distance_to_shore_km(lat, lon)
+        shore_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        in_port = index.in_port(lat, lon)
+        port_seconds = time.perf_counter() - start
+
+        print(f'build {build_seconds:.2f}s, mmap load {load_seconds:.3f}s')
+        print(f'distance to shore: {args.points / shore_seconds:>12,.0f} queries/s')
+        print(f'in port:           {args.points / port_seconds:>12,.0f} queries/s ({in_port.mean():.4%} in port)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# bench_storage_io.py
+
+"""Cloud Storage transfer throughput against a local GCS emulator.
+
+Uploads a synthetic AIS CSV to the emulator and reports MB/s for:
+
+  download  ``download_to_filename``, ``blob.open('rb')`` and
+            ``storage_io.open_ranged`` at several thread counts
+  read      downloading to /tmp and then ``read_ais_csv``, against
+            ``read_ais_csv`` parsing straight from ``open_ranged``
+  upload    feature-chunk sized payloads uploaded one after the other,
+            against ``storage_io.ChunkUploader`` at several thread counts
+
+The client reuses its connections through ``storage_io.pooled_client``. An
+emulator on localhost has almost no per-request latency, so the gains of
+parallel ranges and uploads are a lower bound of those against Cloud
+Storage.
+
+Usage:
+    docker run -d -p 4443:4443 fsouza/fake-gcs-server -scheme http
+    STORAGE_EMULATOR_HOST=http://localhost:4443 python benchmarks/bench_storage_io.py [--rows 2000000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from ingest import read_ais_csv  # noqa: E402
+from storage_io import ChunkUploader, open_ranged, pooled_client  # noqa: E402
+from synthetic import write_ais_csv  # noqa: E402
+
+THREAD_COUNTS = [1, 2, 4, 8, 16]
+
+
+def timed(function):
+    """Seconds taken by ``function()``, and its result."""
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def report(label, nbytes, seconds):
+    print(f'{label:>28} {seconds:>8.2f}s {nbytes / 1e6 / seconds:>9.1f} MB/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--part-mb', type=float, default=4)
+    parser.add_argument('--chunks', type=int, default=64)
+    parser.add_argument('--chunk-kb', type=int, default=512)
+    parser.add_argument('--bucket', default='bench-storage-io')
+    parser.add_argument('--project', default='demo-project')
+    args = parser.parse_args()
+
+    if not os.environ.get('STORAGE_EMULATOR_HOST'):
+        sys.exit('Set STORAGE_EMULATOR_HOST to the GCS emulator address')
+
+    from google.api_core.exceptions import Conflict
+    from google.auth.credentials import AnonymousCredentials
+
+    client = pooled_client(project=args.project, credentials=AnonymousCredentials())
+    try:
+        bucket = client.create_bucket(args.bucket)
+    except Conflict:
+        bucket = client.bucket(args.bucket)
+
+    part_bytes = int(args.part_mb * 1024 ** 2)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.csv')
+        write_ais_csv(path, args.rows)
+        blob = bucket.blob('uploads/synthetic.csv')
+        blob.upload_from_filename(path, content_type='text/csv')
+        blob.reload()
+        size = blob.size
+        print(f'{size / 1e6:.0f} MB CSV, {args.rows} rows, {args.part_mb:g} MB ranges')
+
+        print('\ndownload')
+        target = os.path.join(directory, 'download.csv')
+        report('download_to_filename', size, timed(lambda: blob.download_to_filename(target))[0])
+
+        def read_open():
+            with blob.open('rb', chunk_size=part_bytes) as f:
+                while f.read(part_bytes):
+                    pass
+
+        report('blob.open', size, timed(read_open)[0])
+        for threads in THREAD_COUNTS:
+            def read_ranged():
+                with open_ranged(blob, size, generation=blob.generation, part_bytes=part_bytes, threads=threads) as f:
+                    while f.read(part_bytes):
+                        pass
+
+            report(f'open_ranged x{threads}', size, timed(read_ranged)[0])
+
+        print('\nread')
+
+        def download_then_parse():
+            blob.download_to_filename(target)
+            return read_ais_csv(target)
+
+        seconds, expected = timed(download_then_parse)
+        report('download, then read_ais_csv', size, seconds)
+        seconds, streamed = timed(lambda: read_ais_csv(
+            lambda: open_ranged(blob, size, generation=blob.generation, part_bytes=part_bytes)
+        ))
+        report('read_ais_csv(open_ranged)', size, seconds)
+        if not streamed.equals(expected):
+            sys.exit('FAILED, rows read through open_ranged differ from the downloaded file')
+
+    print('\nupload')
+    payload = os.urandom(args.chunk_kb * 1024)
+    total = args.chunks * len(payload)
+    chunk_blobs = [bucket.blob(f'chunks/bench/{i}.bin') for i in range(args.chunks)]
+
+    def upload_serial():
+        for chunk_blob in chunk_blobs:
+            chunk_blob.upload_from_string(payload, content_type='application/octet-stream')
+
+    report('serial', total, timed(upload_serial)[0])
+    for threads in THREAD_COUNTS:
+        def upload_pooled():
+            with ChunkUploader(threads=threads, max_pending=2 * threads) as uploader:
+                for chunk_blob in chunk_blobs:
+                    uploader.submit(chunk_blob, payload, content_type='application/octet-stream')
+
+        report(f'ChunkUploader x{threads}', total, timed(upload_pooled)[0])
+
+    for chunk_blob in chunk_blobs:
+        chunk_blob.delete()
+    blob.delete()
+
+
+if __name__ == '__main__':
+    main()
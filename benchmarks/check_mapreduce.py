@@ -0,0 +1,116 @@
+# check_mapreduce.py
+
+"""Map-reduce featurization against a single pass, on a synthetic CSV.
+
+Runs the map and reduce steps of ``mapreduce`` locally with an in-memory
+stand-in for the Storage bucket. Every byte range is read and validated
+with ``read_split``/``split_rows`` and partitioned into shard files, then
+each shard is featurized. The union of the shards' features must equal
+``compute_vessel_features`` over the whole validated file; the script exits
+non-zero if it does not. It also reports how the rows spread over the
+shards and the time of each phase.
+
+Usage:
+    python benchmarks/check_mapreduce.py [--rows 2000000] [--split-mb 16] [--shards 8]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+import mapreduce  # noqa: E402
+from features import compute_vessel_features  # noqa: E402
+from ingest import read_ais_csv  # noqa: E402
+from synthetic import write_ais_csv  # noqa: E402
+from validation import RowValidator  # noqa: E402
+
+
+class MemoryBlob:
+    """Blob stand-in supporting the ranged reads and writes the map and reduce steps use."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def download_as_bytes(self, start=0, end=None):
+        return self.bucket.data[self.name][start:None if end is None else end + 1]
+
+    def upload_from_string(self, payload, content_type=None):
+        self.bucket.data[self.name] = bytes(payload)
+
+    def delete(self):
+        del self.bucket.data[self.name]
+
+
+class MemoryBucket:
+    """Storage bucket stand-in keeping blobs in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def blob(self, name):
+        return MemoryBlob(self, name)
+
+    def list_blobs(self, prefix):
+        return [MemoryBlob(self, name) for name in sorted(self.data) if name.startswith(prefix)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--split-mb', type=float, default=16)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.csv')
+        write_ais_csv(path, args.rows, seed=args.seed)
+        bucket = MemoryBucket()
+        with open(path, 'rb') as f:
+            bucket.data['uploads/synthetic.csv'] = f.read()
+        file_size = len(bucket.data['uploads/synthetic.csv'])
+        expected = compute_vessel_features(RowValidator()(read_ais_csv(path)))
+
+    upload = bucket.blob('uploads/synthetic.csv')
+    header = mapreduce.read_header(upload)
+    splits = mapreduce.split_ranges(file_size, int(args.split_mb * 1024 ** 2))
+
+    start = time.perf_counter()
+    mapped_rows = 0
+    for split, (begin, end) in enumerate(splits):
+        validator = RowValidator()
+        rows = mapreduce.split_rows(mapreduce.read_split(upload, begin, end, file_size), header, validator, split == 0)
+        mapped_rows += validator.rows
+        mapreduce.write_shard_files(bucket, 'check', split, mapreduce.partition_rows(rows, args.shards))
+    map_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shard_rows, frames = [], []
+    for shard in range(args.shards):
+        rows = mapreduce.load_shard_rows(bucket, 'check', shard)
+        shard_rows.append(0 if rows is None else len(rows))
+        if rows is not None:
+            frames.append(compute_vessel_features(rows))
+    reduce_seconds = time.perf_counter() - start
+    features = pd.concat(frames, ignore_index=True).sort_values('mmsi', ignore_index=True)
+
+    print(f'{file_size / 1e6:.0f} MB, {mapped_rows} rows in {len(splits)} map tasks and {args.shards} reduce shards')
+    print(f'map {map_seconds:.2f}s ({file_size / 1e6 / map_seconds:.0f} MB/s), reduce {reduce_seconds:.2f}s')
+    print(f'rows per shard: min {min(shard_rows)}, max {max(shard_rows)}')
+    try:
+        pd.testing.assert_frame_equal(features, expected.sort_values('mmsi', ignore_index=True), check_dtype=False)
+    except AssertionError as e:
+        print(f'FAILED, map-reduce features differ from a single pass: {e}')
+        sys.exit(1)
+    print(f'ok, {len(features)} vessels match a single pass')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# synthetic.py
+
+"""Seeded synthetic AIS data for the benchmarks."""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+
+def make_ais_frame(num_rows, points_per_vessel=100, seed=0):
+    """Build a shuffled AIS DataFrame with ``num_rows`` rows.
+
+    Each vessel's points are scattered around a random home position at
+    distinct one-second-spaced timestamps; the frame has roughly
+    ``num_rows / points_per_vessel`` vessels.
+    """
+    rng = np.random.default_rng(seed)
+    num_vessels = max(num_rows // points_per_vessel, 1)
+    vessel = rng.integers(0, num_vessels, size=num_rows)
+    mmsi = 200000000 + vessel
+
+    start = pd.Timestamp('2024-01-01T00:00:00Z').value
+    # Distinct whole-second timestamps, so track order is unambiguous
+    offsets = rng.permutation(num_rows).astype(np.int64) * 10**9
+    timestamp = pd.to_datetime(start + offsets, utc=True)
+
+    base_lat = rng.uniform(-60, 60, size=num_vessels)
+    base_lon = rng.uniform(-170, 170, size=num_vessels)
+
+    return pd.DataFrame({
+        'mmsi': mmsi,
+        'timestamp': timestamp,
+        'lat': base_lat[vessel] + rng.normal(0, 0.05, size=num_rows),
+        'lon': base_lon[vessel] + rng.normal(0, 0.05, size=num_rows),
+        'sog': np.abs(rng.normal(8, 5, size=num_rows)),
+        'cog': rng.uniform(0, 360, size=num_rows),
+        'heading': rng.integers(0, 360, size=num_rows).astype(float),
+    })
+
+
+# Movement profiles: (speed mean, speed std) in knots, course noise per step
+# in degrees, and the zigzag leg length in points (0 for none)
+VESSEL_PROFILES = {
+    'TUG': {'speed': (3.0, 2.0), 'course_noise': 40.0, 'leg_points': 0},
+    'FISHING': {'speed': (4.0, 1.0), 'course_noise': 5.0, 'leg_points': 12},
+    'PLEASURE': {'speed': (10.0, 6.0), 'course_noise': 15.0, 'leg_points': 0},
+    'CARGO': {'speed': (15.0, 1.0), 'course_noise': 1.0, 'leg_points': 0},
+}
+
+NM_PER_DEGREE = 60.0
+
+
+def make_class_tracks(num_vessels, points_per_vessel=200, interval_seconds=60, seed=0,
+                      classes=tuple(VESSEL_PROFILES), first_mmsi=200000000):
+    """Build AIS tracks that move like their vessel class.
+
+    Tugs loiter near a home position, fishing vessels zigzag in short legs,
+    pleasure craft wander at varying speed and cargo ships hold a straight
+    course. Returns ``(frame, labels)``: rows ordered by time across vessels,
+    and a Series of class names indexed by MMSI.
+    """
+    rng = np.random.default_rng(seed)
+    vessel_class = rng.choice(list(classes), size=num_vessels)
+    shape = (num_vessels, points_per_vessel)
+
+    speed_mean = np.array([VESSEL_PROFILES[c]['speed'][0] for c in vessel_class])[:, None]
+    speed_std = np.array([VESSEL_PROFILES[c]['speed'][1] for c in vessel_class])[:, None]
+    course_noise = np.array([VESSEL_PROFILES[c]['course_noise'] for c in vessel_class])[:, None]
+    leg_points = np.array([VESSEL_PROFILES[c]['leg_points'] for c in vessel_class])[:, None]
+
+    sog = np.clip(rng.normal(speed_mean, speed_std, size=shape), 0, None)
+    course = rng.uniform(0, 360, size=(num_vessels, 1)) + np.cumsum(rng.normal(0, course_noise, size=shape), axis=1)
+    step = np.arange(points_per_vessel)[None, :]
+    zigzag = np.where(leg_points > 0, np.where((step // np.maximum(leg_points, 1)) % 2 == 0, 60.0, -60.0), 0.0)
+    cog = np.mod(course + zigzag, 360)
+
+    # Tugs are pulled back towards home so they stay around one spot
+    home_lat = rng.uniform(-60, 60, size=(num_vessels, 1))
+    home_lon = rng.uniform(-170, 170, size=(num_vessels, 1))
+    hours = interval_seconds / 3600
+    dlat = sog * np.cos(np.radians(cog)) * hours / NM_PER_DEGREE
+    dlon = sog * np.sin(np.radians(cog)) * hours / NM_PER_DEGREE / np.cos(np.radians(home_lat))
+    lat = home_lat + np.cumsum(dlat, axis=1)
+    lon = home_lon + np.cumsum(dlon, axis=1)
+    loiter = (vessel_class == 'TUG')[:, None]
+    lat = np.where(loiter, home_lat + (lat - home_lat) * 0.05, lat)
+    lon = np.where(loiter, home_lon + (lon - home_lon) * 0.05, lon)
+    lat = np.clip(lat, -89.9, 89.9)
+    lon = (lon + 180) % 360 - 180
+
+    mmsi = first_mmsi + np.arange(num_vessels)
+    start = pd.Timestamp('2024-01-01T00:00:00Z').value
+    # Staggered starts so vessels interleave without sharing timestamps
+    offsets = rng.integers(0, interval_seconds, size=(num_vessels, 1)) + step * interval_seconds
+    order = np.argsort(offsets, axis=None, kind='stable')
+
+    frame = pd.DataFrame({
+        'mmsi': np.repeat(mmsi, points_per_vessel),
+        'timestamp': pd.to_datetime(start + offsets.ravel().astype(np.int64) * 10**9, utc=True),
+        'lat': lat.ravel(),
+        'lon': lon.ravel(),
+        'sog': sog.ravel(),
+        'cog': cog.ravel(),
+        'heading': np.round(np.mod(cog + rng.normal(0, 3, size=shape), 360)).ravel() % 360,
+    }).iloc[order].reset_index(drop=True)
+    return frame, pd.Series(vessel_class, index=pd.Index(mmsi, name='mmsi'), name='class')
+
+
+def _write_csv_block(f, frame, header):
+    frame = frame.copy()
+    floats = ['lat', 'lon', 'sog', 'cog']
+    frame[floats] = frame[floats].round(6)
+    seconds = frame['timestamp'].dt.tz_convert(None).to_numpy(dtype='datetime64[s]')
+    frame['timestamp'] = np.char.add(np.datetime_as_string(seconds, unit='s'), 'Z')
+    if header:
+        f.write((','.join(frame.columns) + '\n').encode())
+    write_options = pa_csv.WriteOptions(include_header=False, quoting_style='none')
+    pa_csv.write_csv(pa.Table.from_pandas(frame, preserve_index=False), f, write_options=write_options)
+
+
+def write_ais_csv(path, num_rows, points_per_vessel=200, vessels_per_block=10_000, seed=0):
+    """Write a class-like AIS CSV of about ``num_rows`` rows in bounded memory.
+
+    Vessels are generated in blocks of ``vessels_per_block`` and appended, so
+    files of tens of GB need no more memory than one block. Timestamps are
+    written in the ISO 8601 ``Z`` style of the bundled sample. Returns the
+    class labels of all vessels.
+    """
+    total_vessels = max(num_rows // points_per_vessel, 1)
+    labels = []
+    with open(path, 'wb') as f:
+        for block, first in enumerate(range(0, total_vessels, vessels_per_block)):
+            frame, block_labels = make_class_tracks(
+                min(vessels_per_block, total_vessels - first), points_per_vessel,
+                seed=seed + block, first_mmsi=200000000 + first,
+            )
+            _write_csv_block(f, frame, header=block == 0)
+            labels.append(block_labels)
+    return pd.concat(labels)
@@ -0,0 +1,69 @@
+# chunk_io.py
+
+"""Serialization of processed feature chunks.
+
+Chunks are written straight from the in-memory feature frame in a columnar
+format (Parquet by default, Arrow IPC optionally) so ``process_chunk`` can
+load them without text parsing. The reader picks the format from the file
+extension, which keeps older ``.csv`` chunks readable.
+"""
+
+import io
+import os
+
+import pandas as pd
+
+# Format used for newly written chunks
+CHUNK_FORMAT = 'parquet'
+
+CHUNK_EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'csv': '.csv',
+}
+
+CHUNK_CONTENT_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+    'csv': 'text/csv',
+}
+
+
+def chunk_format_for_path(path):
+    """Return the chunk format implied by a file name's extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for chunk_format, known_extension in CHUNK_EXTENSIONS.items():
+        if extension == known_extension:
+            return chunk_format
+    if extension == '.feather':
+        return 'arrow'
+    raise ValueError(f"Unsupported chunk file extension: {path}")
+
+
+def encode_chunk(frame, chunk_format=CHUNK_FORMAT):
+    """Serialize a feature frame to bytes in ``chunk_format``."""
+    if chunk_format == 'parquet':
+        return frame.to_parquet(index=False)
+    if chunk_format == 'arrow':
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if chunk_format == 'csv':
+        return frame.to_csv(index=False).encode('utf-8')
+    raise ValueError(f"Unsupported chunk format: {chunk_format}")
+
+
+def decode_chunk(data, path):
+    """Load a chunk serialized by ``encode_chunk``, picking the format from ``path``."""
+    chunk_format = chunk_format_for_path(path)
+    if chunk_format == 'parquet':
+        return pd.read_parquet(io.BytesIO(data))
+    if chunk_format == 'arrow':
+        import pyarrow as pa
+
+        return pa.ipc.open_file(pa.py_buffer(data)).read_all().to_pandas()
+    return pd.read_csv(io.BytesIO(data))
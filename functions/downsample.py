@@ -0,0 +1,228 @@
+# downsample.py
+
+"""Optional per-vessel track simplification before feature extraction.
+
+Dense tracks (one report every few seconds) cost featurization time without
+adding much information. Two vectorized reductions can run between
+validation and featurization; both work on all vessels at once over rows
+sorted by (mmsi, timestamp), and always keep the first and last point of
+each track:
+
+  time bucketing   keep the first report of each vessel in every
+                   ``downsampleSeconds`` wide time bucket
+  Douglas-Peucker  drop points closer than ``simplifyMeters`` to the
+                   segment between the points kept around them
+
+Bucketing runs first, so Douglas-Peucker only sees the bucketed points.
+Streaming ingest simplifies each chunk on its own, so a track that spans a
+chunk boundary keeps the chunk's end points as well. Features that count
+points or steps (``num_points``, ``speed_changes``, stop ratios, ...) change
+with the sampling; the job settings are part of the result cache's feature
+version so simplified and full-rate results are never mixed.
+"""
+
+import numpy as np
+
+from features import timestamps_to_ns
+from validation import validate_chunk
+
+# Mean Earth radius for the per-track equirectangular projection
+EARTH_RADIUS_M = 6_371_000.0
+
+# Douglas-Peucker refinement passes; segments still unresolved keep all their points
+MAX_SIMPLIFY_PASSES = 64
+
+
+def downsample_settings(settings):
+    """``(bucket_seconds, tolerance_m)`` from the job settings, None for each reduction not asked for."""
+    settings = settings or {}
+    bucket_seconds = float(settings.get('downsampleSeconds') or 0)
+    tolerance_m = float(settings.get('simplifyMeters') or 0)
+    return (bucket_seconds if bucket_seconds > 0 else None,
+            tolerance_m if tolerance_m > 0 else None)
+
+
+def _track_bounds(mmsi):
+    """First and last row index of each track in an mmsi array sorted by vessel."""
+    starts = np.flatnonzero(np.r_[True, mmsi[1:] != mmsi[:-1]])
+    ends = np.r_[starts[1:], len(mmsi)] - 1
+    return starts, ends
+
+
+def bucket_mask(mmsi, ts_ns, bucket_seconds):
+    """Keep the first point of each vessel per time bucket, and each track's last point."""
+    bucket = ts_ns // int(bucket_seconds * 1e9)
+    keep = np.r_[True, (mmsi[1:] != mmsi[:-1]) | (bucket[1:] != bucket[:-1])]
+    keep[_track_bounds(mmsi)[1]] = True
+    return keep
+
+
+def _project_tracks(mmsi, lat, lon):
+    """Planar x/y in meters per track, equirectangular around the track's mean latitude.
+
+    Longitudes are unwrapped along each track, so a track crossing the
+    antimeridian stays continuous.
+    """
+    starts, _ = _track_bounds(mmsi)
+    step = np.diff(lon, prepend=lon[:1])
+    step = (step + 180.0) % 360.0 - 180.0
+    step[starts] = lon[starts]
+    unwrapped = np.cumsum(step)
+    # Undo the running sum across track boundaries
+    unwrapped -= np.repeat(unwrapped[starts] - lon[starts], np.diff(np.r_[starts, len(mmsi)]))
+
+    counts = np.diff(np.r_[starts, len(mmsi)])
+    mean_lat = np.add.reduceat(lat, starts) / counts
+    scale = np.repeat(np.cos(np.radians(mean_lat)), counts)
+    return np.radians(unwrapped) * scale * EARTH_RADIUS_M, np.radians(lat) * EARTH_RADIUS_M
+
+
+def _segment_distance2(px, py, ax, ay, bx, by, inv_length2):
+    """Squared planar distance of points p to the segments from a along (bx, by).
+
+    ``inv_length2`` is 1 / (bx^2 + by^2), or 0 for a zero-length segment.
+    """
+    px = px - ax
+    py = py - ay
+    t = np.clip((px * bx + py * by) * inv_length2, 0.0, 1.0)
+    px -= t * bx
+    py -= t * by
+    return px * px + py * py
+
+
+def simplify_mask(mmsi, lat, lon, tolerance_m, max_passes=MAX_SIMPLIFY_PASSES):
+    """Douglas-Peucker keep-mask over all tracks at once.
+
+    Every pass measures the interior points of all open segments against
+    their segment, splits the segments whose farthest point exceeds
+    ``tolerance_m`` at that point and closes the rest.
+    """
+    keep = np.zeros(len(mmsi), dtype=bool)
+    if not len(mmsi):
+        return keep
+    x, y = _project_tracks(mmsi, lat, lon)
+    starts, ends = _track_bounds(mmsi)
+    keep[starts] = True
+    keep[ends] = True
+    open_segments = ends - starts > 1
+    seg_start, seg_end = starts[open_segments], ends[open_segments]
+
+    for _ in range(max_passes):
+        if not len(seg_start):
+            return keep
+        lengths = seg_end - seg_start - 1
+        offsets = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(seg_start)), lengths)
+        rows = np.repeat(seg_start + 1 - offsets, lengths) + np.arange(lengths.sum())
+
+        # Segment vectors once per segment, then spread over its interior points
+        bx = x[seg_end] - x[seg_start]
+        by = y[seg_end] - y[seg_start]
+        length2 = bx * bx + by * by
+        inv_length2 = np.divide(1.0, length2, out=np.zeros_like(length2), where=length2 > 0)
+        distance = _segment_distance2(
+            x[rows], y[rows],
+            np.repeat(x[seg_start], lengths), np.repeat(y[seg_start], lengths),
+            np.repeat(bx, lengths), np.repeat(by, lengths), np.repeat(inv_length2, lengths)
+        )
+        farthest = np.maximum.reduceat(distance, offsets)
+        at_max = np.flatnonzero(distance == farthest[segment])
+        first_max = at_max[np.r_[True, segment[at_max][1:] != segment[at_max][:-1]]]
+        split = rows[first_max]
+
+        far = farthest > tolerance_m * tolerance_m
+        keep[split[far]] = True
+        seg_start, seg_end = (np.concatenate([seg_start[far], split[far]]),
+                              np.concatenate([split[far], seg_end[far]]))
+        open_segments = seg_end - seg_start > 1
+        seg_start, seg_end = seg_start[open_segments], seg_end[open_segments]
+
+    # Too deep to resolve: keep every remaining interior point
+    lengths = seg_end - seg_start - 1
+    offsets = np.cumsum(lengths) - lengths
+    keep[np.repeat(seg_start + 1 - offsets, lengths) + np.arange(lengths.sum())] = True
+    return keep
+
+
+def downsample_tracks(df, bucket_seconds=None, tolerance_m=None):
+    """Rows of ``df`` kept by time bucketing and/or Douglas-Peucker, in their original order."""
+    if df.empty or (bucket_seconds is None and tolerance_m is None):
+        return df
+    mmsi = df['mmsi'].to_numpy()
+    ts_ns = timestamps_to_ns(df['timestamp'])
+    order = np.lexsort((ts_ns, mmsi))
+    mmsi = mmsi[order]
+
+    keep = np.ones(len(order), dtype=bool)
+    if bucket_seconds is not None:
+        keep = bucket_mask(mmsi, ts_ns[order], bucket_seconds)
+    if tolerance_m is not None:
+        kept = order[keep]
+        simplified = simplify_mask(
+            mmsi[keep],
+            df['lat'].to_numpy(dtype=np.float64)[kept],
+            df['lon'].to_numpy(dtype=np.float64)[kept],
+            tolerance_m
+        )
+        keep[np.flatnonzero(keep)[~simplified]] = False
+
+    keep_rows = np.zeros(len(order), dtype=bool)
+    keep_rows[order[keep]] = True
+    return df[keep_rows]
+
+
+class TrackDownsampler:
+    """Validates chunks with ``validate`` and simplifies the clean rows, counting dropped points.
+
+    Stands in for the validator wherever chunks are validated, so the
+    in-memory, streaming and rolling paths simplify the same way.
+    """
+
+    def __init__(self, validate, bucket_seconds=None, tolerance_m=None):
+        self.validate = validate
+        self.bucket_seconds = bucket_seconds
+        self.tolerance_m = tolerance_m
+        self.rows = 0
+        self.kept_rows = 0
+
+    @property
+    def enabled(self):
+        return self.bucket_seconds is not None or self.tolerance_m is not None
+
+    def reset(self):
+        """Forget everything seen so far, before validating a file again."""
+        if hasattr(self.validate, 'reset'):
+            self.validate.reset()
+        self.rows = 0
+        self.kept_rows = 0
+
+    def __call__(self, chunk):
+        """Validate ``chunk`` and return its clean, simplified rows."""
+        return self.simplify(self.validate(chunk))
+
+    def reread(self, chunk):
+        """Validate and simplify ``chunk`` without counting it, for a second pass over a file."""
+        return downsample_tracks(validate_chunk(chunk)[0], self.bucket_seconds, self.tolerance_m)
+
+    def simplify(self, clean):
+        """Simplify already validated rows."""
+        kept = downsample_tracks(clean, self.bucket_seconds, self.tolerance_m)
+        self.rows += len(clean)
+        self.kept_rows += len(kept)
+        return kept
+
+    def version(self):
+        """Suffix for the feature version, empty when nothing is simplified."""
+        if not self.enabled:
+            return ''
+        return f"-ds{self.bucket_seconds or 0:g}s{self.tolerance_m or 0:g}m"
+
+    def summary(self):
+        """Downsampling stats recorded on the job document."""
+        return {
+            'bucketSeconds': self.bucket_seconds,
+            'toleranceMeters': self.tolerance_m,
+            'rows': self.rows,
+            'keptRows': self.kept_rows,
+            'droppedRows': self.rows - self.kept_rows,
+        }
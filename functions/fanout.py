@@ -0,0 +1,74 @@
+# fanout.py
+
+"""Chunk sizing and Pub/Sub fan-out helpers for on_file_upload."""
+
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Target wall time of one process_chunk invocation, which classifies one batched message
+TARGET_CHUNK_SECONDS = 20.0
+
+# Estimated process_chunk cost per vessel (download, predict, result write)
+PER_VESSEL_SECONDS = 0.002
+
+# Chunks in a full batched message; chunks are sized so such a message meets the target
+CHUNKS_PER_MESSAGE = 4
+
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 20000
+
+# Pub/Sub publisher batching
+PUBLISH_BATCH_MAX_MESSAGES = 100
+PUBLISH_BATCH_MAX_BYTES = 1024 * 1024
+PUBLISH_BATCH_MAX_LATENCY = 0.05
+
+# How long to wait for each publish future before failing the job
+PUBLISH_TIMEOUT_SECONDS = 60
+
+
+def message_vessel_limit(settings=None):
+    """Vessels one process_chunk invocation classifies within ``targetChunkSeconds``."""
+    settings = settings or {}
+    target_seconds = float(settings.get('targetChunkSeconds') or TARGET_CHUNK_SECONDS)
+    return max(MIN_CHUNK_SIZE, int(target_seconds / PER_VESSEL_SECONDS))
+
+
+def choose_chunk_size(vessel_count, settings=None):
+    """Pick the number of vessels per chunk for a job.
+
+    The default policy fits ``CHUNKS_PER_MESSAGE`` chunks into the vessels
+    ``targetChunkSeconds`` allows at ``PER_VESSEL_SECONDS`` each, then evens
+    out the chunks so the last one is not a small remainder. A ``chunkSize``
+    in the job settings overrides the policy.
+    """
+    settings = settings or {}
+    if settings.get('chunkSize'):
+        return max(1, min(int(settings['chunkSize']), MAX_CHUNK_SIZE))
+
+    latency_cap = max(MIN_CHUNK_SIZE, min(message_vessel_limit(settings) // CHUNKS_PER_MESSAGE, MAX_CHUNK_SIZE))
+    chunk_count = max(1, math.ceil(vessel_count / latency_cap))
+    return max(MIN_CHUNK_SIZE, math.ceil(vessel_count / chunk_count))
+
+
+def publish_json(publisher, topic_path, message_data):
+    """Publish a JSON message and return its future."""
+    return publisher.publish(topic_path, json.dumps(message_data).encode('utf-8'))
+
+
+def wait_for_publishes(futures, timeout=PUBLISH_TIMEOUT_SECONDS):
+    """Block until all publish futures resolve; raise if any of them failed."""
+    failures = []
+    for future in futures:
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            failures.append(e)
+
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(futures)} chunk messages failed to publish: {failures[0]}"
+        )
+    logger.info(f"Published {len(futures)} chunk messages")
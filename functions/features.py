@@ -0,0 +1,355 @@
+# features.py
+
+"""Vectorized per-vessel feature extraction for AIS tracks.
+
+Rows are sorted once by (mmsi, timestamp) and reduced to per-vessel partial
+aggregates (counts, means, M2, min/max, sums over consecutive steps and the
+first/last point of the track) with grouped reductions and shifted-array
+diffs. Partials from consecutive slices of a track can be merged, which lets
+a file be featurized chunk by chunk with the same result as a single pass;
+``finalize_features`` turns the merged partials into the model features.
+"""
+
+import numpy as np
+import pandas as pd
+
+from kinematics import (
+    DIRECTION_CHANGE_DEGREES,
+    circular_sums,
+    circular_variance,
+    group_moments,
+    haversine_km,
+    linearity_index,
+    step_kinematics,
+)
+from spatial import get_spatial_index
+
+# Vessels with fewer points than this are skipped
+MIN_POINTS_PER_VESSEL = 5
+
+# SOG (knots) below which a point counts as stationary
+STOP_SPEED_KNOTS = 0.5
+
+# Step distance (km) above which a point-to-point move counts as a speed change
+SPEED_CHANGE_KM = 0.1
+
+KINEMATIC_COLUMNS = ['lat', 'lon', 'sog', 'cog', 'heading']
+
+# Per-step quantities summarized by mean and std
+STEP_MOMENT_COLUMNS = ['acceleration', 'turn_rate']
+
+# Output column order of preprocess_ais_data
+FEATURE_COLUMNS = [
+    'mmsi',
+    'lat_mean', 'lon_mean', 'sog_mean', 'cog_mean', 'heading_mean',
+    'lat_std', 'lon_std', 'sog_std', 'cog_std', 'heading_std',
+    'lat_min', 'lon_min', 'sog_min', 'cog_min', 'heading_min',
+    'lat_max', 'lon_max', 'sog_max', 'cog_max', 'heading_max',
+    'lat_range', 'lon_range', 'sog_range', 'cog_range', 'heading_range',
+    'time_span_hours', 'num_points', 'avg_time_between_points',
+    'total_distance', 'avg_speed', 'max_speed',
+    'speed_changes', 'direction_changes', 'stops_count', 'moving_time_ratio',
+    'stationary_time_ratio', 'acceleration_mean', 'acceleration_std',
+    'turn_rate_mean', 'turn_rate_std', 'distance_from_shore_mean',
+    'distance_from_shore_min', 'in_port_ratio', 'night_activity_ratio',
+    'weekend_activity_ratio', 'speed_consistency', 'course_consistency',
+    'zigzag_factor', 'circular_variance', 'linearity_index',
+]
+
+# Bump when a feature definition changes, so cached features are recomputed
+FEATURE_VERSION = 1
+
+# Features that are not derived from the data yet
+DEFAULT_FEATURE_VALUES = {
+    'night_activity_ratio': 0.3,
+    'weekend_activity_ratio': 0.3,
+}
+
+# Shore/port features used when no spatial index is available
+DEFAULT_SPATIAL_FEATURE_VALUES = {
+    'distance_from_shore_mean': 10,
+    'distance_from_shore_min': 5,
+    'in_port_ratio': 0.1,
+}
+
+# Partial aggregates that merge by addition
+SUM_COLUMNS = [
+    'num_points', 'distance_sum', 'speed_change_count', 'stop_count', 'moving_count',
+    'direction_change_count', 'cog_cos_sum', 'cog_sin_sum',
+    'spatial_count', 'shore_distance_sum', 'in_port_count',
+]
+
+# Partial aggregates that merge by minimum
+MIN_COLUMNS = ['shore_distance_min']
+
+# First point of each track in a slice
+FIRST_POINT_COLUMNS = ['first_ts', 'first_lat', 'first_lon']
+
+# Last point of each track, carried across slices to stitch step features
+LAST_POINT_COLUMNS = ['last_ts'] + [f'last_{col}' for col in KINEMATIC_COLUMNS]
+
+
+def timestamps_to_ns(timestamps):
+    """Return timestamps as an int64 array of UTC nanoseconds."""
+    index = pd.DatetimeIndex(timestamps)
+    return index.as_unit('ns').asi8
+
+
+def feature_version():
+    """Version of the feature definitions, including whether spatial features are live."""
+    return f"{FEATURE_VERSION}-{'spatial' if get_spatial_index() is not None else 'default'}"
+
+
+def column_values(series):
+    """Float values of a numeric column without widening float32 (NA becomes NaN)."""
+    dtype = np.float32 if series.dtype.itemsize <= 4 else np.float64
+    return series.to_numpy(dtype=dtype, na_value=np.nan)
+
+
+def _group_layout(mmsi):
+    """Return (starts, counts, codes) for an mmsi array sorted by vessel."""
+    starts = np.flatnonzero(np.r_[True, mmsi[1:] != mmsi[:-1]])
+    counts = np.diff(np.r_[starts, len(mmsi)])
+    codes = np.repeat(np.arange(len(starts)), counts)
+    return starts, counts, codes
+
+
+def track_partials(df, carry=None):
+    """Reduce AIS rows to per-vessel partial aggregates indexed by mmsi.
+
+    ``carry`` holds the ``LAST_POINT_COLUMNS`` of tracks seen in earlier
+    slices (indexed by mmsi). Its points only contribute the step into the
+    first new point of each vessel, so merging the result into the earlier
+    partials gives the same aggregates as processing both slices together,
+    provided every vessel's points arrive in time order across slices.
+    """
+    mmsi = df['mmsi'].to_numpy()
+    ts = timestamps_to_ns(df['timestamp'])
+    values = {col: column_values(df[col]) for col in KINEMATIC_COLUMNS}
+    is_carry = np.zeros(len(df), dtype=bool)
+
+    if carry is not None and len(carry):
+        carry = carry[carry.index.isin(np.unique(mmsi))]
+        mmsi = np.concatenate([carry.index.to_numpy(dtype=mmsi.dtype), mmsi])
+        ts = np.concatenate([carry['last_ts'].to_numpy(dtype=np.int64), ts])
+        for col in KINEMATIC_COLUMNS:
+            values[col] = np.concatenate([carry[f'last_{col}'].to_numpy(dtype=np.float64), values[col]])
+        is_carry = np.concatenate([np.ones(len(carry), dtype=bool), is_carry])
+
+    # Carried points sort before new points with the same timestamp
+    order = np.lexsort((~is_carry, ts, mmsi))
+    mmsi, ts, is_carry = mmsi[order], ts[order], is_carry[order]
+    # Gather in the compact input dtype, then widen once for the arithmetic
+    values = {col: arr[order].astype(np.float64, copy=False) for col, arr in values.items()}
+
+    starts, counts, codes = _group_layout(mmsi)
+    n_groups = len(starts)
+    real = ~is_carry
+    real_codes = codes[real]
+
+    partials = pd.DataFrame(index=pd.Index(mmsi[starts], name='mmsi'))
+    partials['num_points'] = np.bincount(real_codes, minlength=n_groups)
+
+    frame = pd.DataFrame({col: values[col][real] for col in KINEMATIC_COLUMNS})
+    stats = frame.groupby(real_codes, sort=False).agg(['count', 'mean', 'var', 'min', 'max'])
+    stats = stats.reindex(np.arange(n_groups))
+    for col in KINEMATIC_COLUMNS:
+        count = stats[(col, 'count')].fillna(0).to_numpy()
+        partials[f'{col}_count'] = count
+        partials[f'{col}_mean'] = stats[(col, 'mean')].to_numpy()
+        partials[f'{col}_m2'] = np.nan_to_num(stats[(col, 'var')].to_numpy() * (count - 1))
+        partials[f'{col}_min'] = stats[(col, 'min')].to_numpy()
+        partials[f'{col}_max'] = stats[(col, 'max')].to_numpy()
+
+    # First real point and last point of each vessel in this slice
+    real_rows = np.flatnonzero(real)
+    real_starts = np.flatnonzero(np.r_[True, real_codes[1:] != real_codes[:-1]])
+    first_real = starts.copy()
+    first_real[real_codes[real_starts]] = real_rows[real_starts]
+    ends = starts + counts - 1
+    partials['first_ts'] = ts[first_real]
+    partials['first_lat'] = values['lat'][first_real]
+    partials['first_lon'] = values['lon'][first_real]
+    partials['last_ts'] = ts[ends]
+    for col in KINEMATIC_COLUMNS:
+        partials[f'last_{col}'] = values[col][ends]
+
+    # Step features between consecutive points of the same vessel; each
+    # step is attributed to the vessel of its later point.
+    same_vessel = codes[1:] == codes[:-1]
+    step_codes = codes[1:][same_vessel]
+    steps = step_kinematics(ts, values['lat'], values['lon'], values['sog'], values['cog'], same_vessel)
+    distance = steps['distance']
+    partials['distance_sum'] = np.bincount(step_codes, weights=distance, minlength=n_groups)
+    partials['speed_change_count'] = np.bincount(step_codes[distance > SPEED_CHANGE_KM], minlength=n_groups)
+    partials['direction_change_count'] = np.bincount(
+        step_codes[steps['course_change'] > DIRECTION_CHANGE_DEGREES], minlength=n_groups
+    )
+    for col in STEP_MOMENT_COLUMNS:
+        count, mean, m2 = group_moments(steps[col], step_codes, n_groups)
+        partials[f'{col}_count'] = count
+        partials[f'{col}_mean'] = mean
+        partials[f'{col}_m2'] = m2
+
+    cog_cos_sum, cog_sin_sum = circular_sums(values['cog'][real], real_codes, n_groups)
+    partials['cog_cos_sum'] = cog_cos_sum
+    partials['cog_sin_sum'] = cog_sin_sum
+
+    sog = values['sog'][real]
+    partials['stop_count'] = np.bincount(real_codes[sog < STOP_SPEED_KNOTS], minlength=n_groups)
+    partials['moving_count'] = np.bincount(real_codes[sog >= STOP_SPEED_KNOTS], minlength=n_groups)
+
+    _add_spatial_partials(partials, values['lat'][real], values['lon'][real], real_codes, n_groups)
+    return partials
+
+
+def _add_spatial_partials(partials, lat, lon, codes, n_groups):
+    """Add shore distance and in-port partials from the spatial index, if any."""
+    index = get_spatial_index()
+    if index is None:
+        partials['spatial_count'] = 0
+        partials['shore_distance_sum'] = 0.0
+        partials['shore_distance_min'] = np.nan
+        partials['in_port_count'] = 0
+        return
+
+    shore = index.distance_to_shore_km(lat, lon)
+    valid = ~np.isnan(shore)
+    partials['spatial_count'] = np.bincount(codes[valid], minlength=n_groups)
+    partials['shore_distance_sum'] = np.bincount(codes[valid], weights=shore[valid], minlength=n_groups)
+    shore_min = pd.Series(shore).groupby(codes).min()
+    partials['shore_distance_min'] = shore_min.reindex(np.arange(n_groups)).to_numpy()
+    partials['in_port_count'] = np.bincount(codes[index.in_port(lat, lon)], minlength=n_groups)
+
+
+def merge_partials(earlier, later):
+    """Merge partial aggregates of two consecutive slices of the same tracks."""
+    if earlier is None or len(earlier) == 0:
+        return later
+    if later is None or len(later) == 0:
+        return earlier
+
+    index = earlier.index.union(later.index)
+    a = earlier.reindex(index)
+    b = later.reindex(index)
+    in_a = a['num_points'].notna().to_numpy()
+    in_b = b['num_points'].notna().to_numpy()
+
+    merged = pd.DataFrame(index=index)
+    for col in SUM_COLUMNS:
+        merged[col] = a[col].fillna(0).to_numpy() + b[col].fillna(0).to_numpy()
+
+    # Chan et al. parallel update of count, mean and M2
+    for col in KINEMATIC_COLUMNS + STEP_MOMENT_COLUMNS:
+        n_a = a[f'{col}_count'].fillna(0).to_numpy()
+        n_b = b[f'{col}_count'].fillna(0).to_numpy()
+        n = n_a + n_b
+        mean_a = a[f'{col}_mean'].to_numpy()
+        mean_b = b[f'{col}_mean'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean_b - mean_a
+            mean = np.where(n_a == 0, mean_b, np.where(n_b == 0, mean_a, mean_a + delta * n_b / n))
+            cross = np.where((n_a > 0) & (n_b > 0), delta ** 2 * n_a * n_b / n, 0.0)
+        merged[f'{col}_count'] = n
+        merged[f'{col}_mean'] = mean
+        merged[f'{col}_m2'] = a[f'{col}_m2'].fillna(0).to_numpy() + b[f'{col}_m2'].fillna(0).to_numpy() + cross
+
+    for col in MIN_COLUMNS:
+        merged[col] = np.fmin(a[col].to_numpy(), b[col].to_numpy())
+
+    for col in KINEMATIC_COLUMNS:
+        merged[f'{col}_min'] = np.fmin(a[f'{col}_min'].to_numpy(), b[f'{col}_min'].to_numpy())
+        merged[f'{col}_max'] = np.fmax(a[f'{col}_max'].to_numpy(), b[f'{col}_max'].to_numpy())
+
+    for col in FIRST_POINT_COLUMNS:
+        merged[col] = np.where(in_a, a[col].to_numpy(), b[col].to_numpy())
+    for col in LAST_POINT_COLUMNS:
+        merged[col] = np.where(in_b, b[col].to_numpy(), a[col].to_numpy())
+    merged['first_ts'] = merged['first_ts'].astype(np.int64)
+    merged['last_ts'] = merged['last_ts'].astype(np.int64)
+    return merged
+
+
+def finalize_features(partials, min_points=MIN_POINTS_PER_VESSEL):
+    """Turn merged partial aggregates into one feature row per vessel."""
+    partials = partials[partials['num_points'] >= min_points].sort_index()
+    counts = partials['num_points'].to_numpy(dtype=np.int64)
+
+    features = pd.DataFrame({'mmsi': partials.index.to_numpy()})
+    for col in KINEMATIC_COLUMNS:
+        n = partials[f'{col}_count'].to_numpy()
+        features[f'{col}_mean'] = partials[f'{col}_mean'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features[f'{col}_std'] = np.where(n > 1, np.sqrt(partials[f'{col}_m2'].to_numpy() / (n - 1)), np.nan)
+        features[f'{col}_min'] = partials[f'{col}_min'].to_numpy()
+        features[f'{col}_max'] = partials[f'{col}_max'].to_numpy()
+    for col in KINEMATIC_COLUMNS:
+        features[f'{col}_range'] = features[f'{col}_max'] - features[f'{col}_min']
+
+    # Time-based features
+    time_span = (partials['last_ts'].to_numpy() - partials['first_ts'].to_numpy()) / 1e9
+    features['time_span_hours'] = time_span / 3600
+    features['num_points'] = counts
+    features['avg_time_between_points'] = time_span / np.maximum(counts - 1, 1)
+
+    features['total_distance'] = partials['distance_sum'].to_numpy()
+    features['avg_speed'] = features['total_distance'] / np.maximum(features['time_span_hours'], 0.001)
+    features['max_speed'] = features['sog_max']
+
+    features['speed_changes'] = partials['speed_change_count'].to_numpy(dtype=np.int64)
+    stops = partials['stop_count'].to_numpy(dtype=np.int64)
+    features['stops_count'] = stops
+    features['moving_time_ratio'] = partials['moving_count'].to_numpy() / counts
+    features['stationary_time_ratio'] = stops / counts
+
+    # Kinematics; undefined step statistics (too few timed steps) are 0
+    for col in STEP_MOMENT_COLUMNS:
+        n = partials[f'{col}_count'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features[f'{col}_mean'] = np.where(n > 0, partials[f'{col}_mean'].to_numpy(), 0.0)
+            features[f'{col}_std'] = np.where(n > 1, np.sqrt(partials[f'{col}_m2'].to_numpy() / (n - 1)), 0.0)
+    features['direction_changes'] = partials['direction_change_count'].to_numpy(dtype=np.int64)
+    features['circular_variance'] = circular_variance(
+        partials['cog_cos_sum'].to_numpy(), partials['cog_sin_sum'].to_numpy(), partials['cog_count'].to_numpy()
+    )
+    features['linearity_index'] = linearity_index(
+        partials['first_lat'].to_numpy(), partials['first_lon'].to_numpy(),
+        partials['last_lat'].to_numpy(), partials['last_lon'].to_numpy(),
+        features['total_distance'].to_numpy(),
+    )
+
+    # Shore and port features, falling back per vessel when nothing was indexed
+    spatial_count = partials['spatial_count'].to_numpy()
+    has_spatial = spatial_count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features['distance_from_shore_mean'] = np.where(
+            has_spatial, partials['shore_distance_sum'].to_numpy() / spatial_count,
+            DEFAULT_SPATIAL_FEATURE_VALUES['distance_from_shore_mean'])
+        features['in_port_ratio'] = np.where(
+            has_spatial, partials['in_port_count'].to_numpy() / spatial_count,
+            DEFAULT_SPATIAL_FEATURE_VALUES['in_port_ratio'])
+    features['distance_from_shore_min'] = np.where(
+        has_spatial, partials['shore_distance_min'].to_numpy(),
+        DEFAULT_SPATIAL_FEATURE_VALUES['distance_from_shore_min'])
+
+    for name, value in DEFAULT_FEATURE_VALUES.items():
+        features[name] = value
+
+    features['speed_consistency'] = 1 - features['sog_std'] / np.maximum(features['sog_mean'], 0.001)
+    features['course_consistency'] = 1 - features['cog_std'] / 360
+    features['zigzag_factor'] = features['total_distance'] / np.maximum(
+        haversine_km(features['lat_min'], features['lon_min'], features['lat_max'], features['lon_max']), 0.001
+    )
+
+    return features[FEATURE_COLUMNS]
+
+
+def compute_vessel_features(df, min_points=MIN_POINTS_PER_VESSEL):
+    """Compute one feature row per vessel from raw AIS points.
+
+    ``df`` must contain the required AIS columns with ``timestamp`` already
+    parsed to datetimes. Returns a DataFrame with ``FEATURE_COLUMNS``.
+    """
+    if len(df) == 0:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+    return finalize_features(track_partials(df), min_points)
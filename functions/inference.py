@@ -0,0 +1,131 @@
+# inference.py
+
+"""Batched model inference for process_chunk.
+
+on_file_upload packs consecutive chunks of a job into one Pub/Sub message
+(up to ``fanout.CHUNKS_PER_MESSAGE`` chunks, and no more vessels than one
+invocation classifies within the latency target), so one process_chunk
+invocation classifies several chunks at once. All of a
+message's chunks are stacked into one feature matrix and go through a single
+``predict_proba`` call, and the class predictions are its row-wise argmax
+instead of a second ``predict`` pass. Model labels are mapped to indices into
+``CLASS_NAMES`` through ``model.classes_``. Results are then split back per
+chunk with array slices.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from fanout import CHUNKS_PER_MESSAGE, message_vessel_limit
+from results_store import CLASS_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on chunks per message, to keep messages small
+MAX_CHUNKS_PER_MESSAGE = 100
+
+# Concurrent chunk downloads in one invocation
+CHUNK_DOWNLOAD_THREADS = 8
+
+
+def inference_batch_vessels(chunk_size, settings=None):
+    """Vessels per batched message for chunks of ``chunk_size`` vessels.
+
+    By default a message holds up to ``CHUNKS_PER_MESSAGE`` chunks, capped by
+    ``fanout.message_vessel_limit`` so an invocation stays within the latency
+    target, and always at least one chunk. An ``inferenceBatchVessels`` in the
+    job settings overrides this.
+    """
+    settings = settings or {}
+    if settings.get('inferenceBatchVessels'):
+        return max(1, int(settings['inferenceBatchVessels']))
+    return max(chunk_size, min(chunk_size * CHUNKS_PER_MESSAGE, message_vessel_limit(settings)))
+
+
+def batch_chunk_messages(job_id, chunks, max_vessels, fields=None):
+    """Pack chunk descriptors into batched messages, yielding each as soon as it is full.
+
+    ``chunks`` is an iterable of ``(descriptor, vessel_count)`` pairs in chunk
+    order; each descriptor holds ``chunkId`` and ``chunkPath`` (plus any
+    per-chunk fields). Consecutive chunks share a message until it would
+    exceed ``max_vessels`` vessels. ``fields`` are added to every message.
+    """
+    batch, vessels = [], 0
+    for descriptor, count in chunks:
+        if batch and (vessels + count > max_vessels or len(batch) >= MAX_CHUNKS_PER_MESSAGE):
+            yield {'jobId': job_id, 'chunks': batch, **(fields or {})}
+            batch, vessels = [], 0
+        batch.append(descriptor)
+        vessels += count
+    if batch:
+        yield {'jobId': job_id, 'chunks': batch, **(fields or {})}
+
+
+def message_chunks(message_data):
+    """Chunk descriptors of a batched message, or of an older single-chunk message."""
+    if 'chunks' in message_data:
+        return message_data['chunks']
+    return [{key: value for key, value in message_data.items() if key != 'jobId'}]
+
+
+def feature_matrix(data, feature_columns):
+    """Model input for ``feature_columns`` (mmsi excluded) as a float64 frame.
+
+    Missing columns are filled with 0, non-numeric values and NaN become 0.
+    """
+    model_features = [col for col in feature_columns if col != 'mmsi']
+    missing = [col for col in model_features if col not in data.columns]
+    if missing:
+        logger.warning(f"Missing features: {missing}")
+    X = data.reindex(columns=model_features)
+    non_numeric = [col for col in model_features if not pd.api.types.is_numeric_dtype(X[col])]
+    for col in non_numeric:
+        X[col] = pd.to_numeric(X[col], errors='coerce')
+    return X.astype(np.float64).fillna(0.0)
+
+
+def label_index(label, class_names=CLASS_NAMES):
+    """Index into ``class_names`` of a model label: a class name or an integer index (-1 if unknown)."""
+    if isinstance(label, (str, bytes)):
+        name = label.decode() if isinstance(label, bytes) else label
+        return class_names.index(name) if name in class_names else -1
+    index = int(label)
+    return index if index == label and 0 <= index < len(class_names) else -1
+
+
+def class_indices(model, labels, class_names=CLASS_NAMES):
+    """Map an array of ``model`` labels to indices into ``class_names``."""
+    labels = np.asarray(labels)
+    classes = getattr(model, 'classes_', None)
+    classes = list(np.unique(labels) if classes is None else classes)
+    lookup = {label: label_index(label, class_names) for label in classes}
+    return np.array([lookup.get(label, -1) for label in labels.tolist()], dtype=np.int64)
+
+
+def classify(model, X):
+    """Return ``(predictions, probabilities)`` for the rows of ``X``.
+
+    Predictions are indices into ``CLASS_NAMES``. Uses one ``predict_proba``
+    call and its argmax when the model has probabilities, else ``predict``
+    (probabilities are then None).
+    """
+    if hasattr(model, 'predict_proba'):
+        try:
+            probabilities = model.predict_proba(X)
+        except Exception as e:
+            logger.warning(f"Could not get prediction probabilities: {e}")
+        else:
+            # Column i of the probabilities belongs to the label model.classes_[i]
+            classes = getattr(model, 'classes_', None)
+            columns = np.arange(probabilities.shape[1]) if classes is None else list(classes)
+            column_index = np.array([label_index(label) for label in columns], dtype=np.int64)
+            return column_index[np.argmax(probabilities, axis=1)], probabilities
+    return class_indices(model, model.predict(X)), None
+
+
+def chunk_bounds(sizes):
+    """Row ranges ``[(start, end), ...]`` of consecutive chunks with ``sizes`` rows."""
+    ends = np.cumsum(sizes, dtype=np.int64)
+    return list(zip((ends - np.asarray(sizes, dtype=np.int64)).tolist(), ends.tolist()))
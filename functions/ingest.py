@@ -0,0 +1,335 @@
+# ingest.py
+
+"""Streaming, bounded-memory ingestion of large AIS CSV files.
+
+The upload is read in fixed-size row chunks straight from a file-like stream
+and folded into per-MMSI partial aggregates (see ``features.track_partials``),
+so peak memory depends on the chunk size and the number of vessels rather
+than on the size of the file.
+
+CSVs are read by pyarrow when it is installed. The reader keeps the AIS
+columns as text and each block is cast to the compact ``validation.AIS_DTYPES``
+schema, with timestamps in the ISO 8601 style of the file's first row. A
+column that does not cast in a block (an unparseable number, a timestamp in
+another style) is left as text for that block only; validation coerces it
+and quarantines the bad rows. Only a file whose CSV structure pyarrow cannot
+parse (e.g. a line with too many fields) is read again with the tolerant
+pandas reader.
+"""
+
+import csv
+import io
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from features import (
+    LAST_POINT_COLUMNS,
+    MIN_POINTS_PER_VESSEL,
+    compute_vessel_features,
+    finalize_features,
+    merge_partials,
+    timestamps_to_ns,
+    track_partials,
+)
+from result_cache import merge_track_hashes, track_hashes
+from validation import AIS_DTYPES, AIS_READ_DTYPES, REQUIRED_COLUMNS, check_required_columns, validate_chunk
+
+logger = logging.getLogger(__name__)
+
+# Rows per CSV chunk in streaming mode
+INGEST_CHUNK_ROWS = 500_000
+
+# Estimated CSV bytes per AIS row, used to size pyarrow read blocks
+CSV_ROW_BYTES = 80
+
+# Bytes read from the start of a file to sniff its header and timestamp style
+SNIFF_BYTES = 64 * 1024
+
+_ZONED_TIMESTAMP = re.compile(r'(Z|[+-]\d\d:?\d\d)$')
+
+
+class StreamingFeatureBuilder:
+    """Accumulates per-MMSI partial aggregates over consecutive chunks.
+
+    Step features are stitched across chunk boundaries through the last point
+    of each track. Vessels whose points arrive out of time order across
+    chunks cannot be stitched; they are recorded in ``out_of_order`` so the
+    caller can recompute them. With ``hash_tracks`` the per-vessel hashes of
+    the result cache are accumulated as well.
+
+    ``history`` seeds vessels from earlier data: called with the MMSIs seen
+    for the first time, it returns their stored partials (or None), which
+    are merged in before the chunk so its tracks continue from them.
+    """
+
+    def __init__(self, hash_tracks=False, history=None):
+        self.partials = None
+        self.out_of_order = set()
+        self.rows = 0
+        self.hash_tracks = hash_tracks
+        self.track_hashes = None
+        self.history = history
+        self.strict = None
+
+    def add_chunk(self, chunk):
+        """Fold a chunk of AIS rows (timestamps already parsed) into the state."""
+        if len(chunk) == 0:
+            return
+        if self.history is not None:
+            self._seed_history(chunk['mmsi'].to_numpy())
+        carry = None
+        if self.partials is not None and len(self.partials):
+            carry = self.partials[LAST_POINT_COLUMNS]
+            self._record_out_of_order(chunk, carry)
+        self.partials = merge_partials(self.partials, track_partials(chunk, carry))
+        if self.hash_tracks:
+            self.track_hashes = merge_track_hashes(self.track_hashes, track_hashes(chunk))
+        self.rows += len(chunk)
+
+    def _seed_history(self, mmsi):
+        mmsi = np.unique(mmsi)
+        if self.partials is not None:
+            mmsi = mmsi[~np.isin(mmsi, self.partials.index.to_numpy())]
+        stored = self.history(mmsi) if len(mmsi) else None
+        if stored is not None and len(stored):
+            self.partials = merge_partials(self.partials, stored)
+
+    def _record_out_of_order(self, chunk, carry):
+        first_ts = pd.Series(timestamps_to_ns(chunk['timestamp'])).groupby(chunk['mmsi'].to_numpy()).min()
+        last_ts = carry['last_ts'].reindex(first_ts.index)
+        late = first_ts.index[(first_ts < last_ts).to_numpy()]
+        self.out_of_order.update(late.tolist())
+
+    def features(self, min_points=MIN_POINTS_PER_VESSEL):
+        """Return the feature frame for everything added so far."""
+        if self.partials is None:
+            return compute_vessel_features(pd.DataFrame(columns=['mmsi', 'timestamp']), min_points)
+        return finalize_features(self.partials, min_points)
+
+
+def _pyarrow():
+    """The pyarrow module, or None if it is not installed."""
+    try:
+        import pyarrow
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def strict_read_errors():
+    """Exceptions raised when pyarrow cannot parse a file's CSV structure."""
+    pa = _pyarrow()
+    return (pa.ArrowInvalid,) if pa is not None else ()
+
+
+def arrow_column_types(head):
+    """Target pyarrow types of the AIS columns for a CSV starting with the bytes ``head``.
+
+    Timestamps are typed zone-aware UTC if the first row's timestamp carries
+    a zone designator and naive (localized to UTC later) otherwise.
+    """
+    pa = _pyarrow()
+    rows = csv.reader(io.StringIO(head.decode('utf-8-sig', errors='replace')))
+    header = [col.strip() for col in next(rows, [])]
+    check_required_columns(header)
+    first_row = next(rows, [])
+    timestamp = first_row[header.index('timestamp')].strip() if len(first_row) == len(header) else ''
+
+    column_types = {col: pa.type_for_alias(dtype.lower()) for col, dtype in AIS_DTYPES.items()}
+    # Headings are often written as floats ('189.0'); validation narrows them to UInt16
+    column_types['heading'] = pa.float32()
+    column_types['timestamp'] = pa.timestamp('ns', tz='UTC' if _ZONED_TIMESTAMP.search(timestamp) else None)
+    return column_types
+
+
+def arrow_convert_options(column_types=None):
+    """pyarrow conversion options typing the AIS columns as ``column_types``, or as text if None."""
+    pa = _pyarrow()
+    if column_types is None:
+        return pa.csv.ConvertOptions(
+            column_types=dict.fromkeys(REQUIRED_COLUMNS, pa.string()),
+            include_columns=REQUIRED_COLUMNS,
+            strings_can_be_null=True,
+        )
+    return pa.csv.ConvertOptions(
+        column_types=column_types,
+        include_columns=REQUIRED_COLUMNS,
+        timestamp_parsers=[pa.csv.ISO8601],
+    )
+
+
+def arrow_to_frame(table, column_types=None):
+    """Convert a pyarrow table or record batch to a compact AIS frame.
+
+    With ``column_types`` the table holds text columns, each cast to its
+    type; a column that does not cast stays text for validation to coerce.
+    """
+    pa = _pyarrow()
+    if column_types is not None:
+        def cast(name, values):
+            try:
+                return values.cast(column_types[name])
+            except pa.ArrowInvalid as e:
+                logger.info(f"Column {name} of a {len(values)}-row block left to validation: {e}")
+                return values
+
+        # Casts release the GIL, so the columns convert in parallel
+        with ThreadPoolExecutor(len(table.column_names)) as pool:
+            table = pa.table(list(pool.map(cast, table.column_names, table.columns)), names=table.column_names)
+    nullable = {pa.uint32(): pd.UInt32Dtype()}
+    return table.to_pandas(types_mapper=nullable.get)
+
+
+def read_ais_csv(source):
+    """Read a whole AIS CSV, typed by pyarrow when possible.
+
+    ``source`` is a path or a callable returning a fresh binary stream
+    (e.g. ``storage_io.open_ranged`` over a blob).
+    """
+    open_stream = source if callable(source) else lambda: open(source, 'rb')
+    pa = _pyarrow()
+    if pa is not None:
+        try:
+            frames = list(_arrow_chunks(open_stream, INGEST_CHUNK_ROWS))
+            if frames:
+                return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        except pa.ArrowInvalid as e:
+            logger.warning(f"Malformed CSV, falling back to the tolerant reader: {e}")
+    with open_stream() as f:
+        return pd.read_csv(f, dtype=AIS_READ_DTYPES, usecols=lambda col: col in REQUIRED_COLUMNS)
+
+
+def _line_blocks(stream, block_bytes):
+    """Blocks of about ``block_bytes`` of whole lines from the rest of a binary stream."""
+    tail = b''
+    while True:
+        data = stream.read(block_bytes)
+        if not data:
+            break
+        data = tail + data
+        cut = data.rfind(b'\n') + 1
+        tail = data[cut:]
+        if cut:
+            yield data[:cut]
+    if tail.strip():
+        yield tail
+
+
+def _arrow_block(block, column_names, column_types):
+    """Typed frame of one block of CSV lines.
+
+    A value that does not fit ``column_types`` only re-reads this block, as
+    text; a block whose CSV structure is malformed raises ``ArrowInvalid``.
+    """
+    pa = _pyarrow()
+    read_options = pa.csv.ReadOptions(column_names=column_names)
+    try:
+        return arrow_to_frame(pa.csv.read_csv(
+            pa.BufferReader(block), read_options=read_options, convert_options=arrow_convert_options(column_types)
+        ))
+    except pa.ArrowInvalid as e:
+        logger.info(f"Reading a {len(block)}-byte block as text: {e}")
+    return arrow_to_frame(pa.csv.read_csv(
+        pa.BufferReader(block), read_options=read_options, convert_options=arrow_convert_options()
+    ), column_types)
+
+
+def _arrow_chunks(open_stream, chunk_rows):
+    with open_stream() as stream:
+        header = stream.readline()
+        column_names = [col.strip() for col in next(csv.reader([header.decode('utf-8-sig')]), [])]
+        check_required_columns(column_names)
+        column_types = None
+        for block in _line_blocks(stream, chunk_rows * CSV_ROW_BYTES):
+            if column_types is None:
+                column_types = arrow_column_types(header + block[:SNIFF_BYTES])
+            yield _arrow_block(block, column_names, column_types)
+
+
+def _pandas_chunks(open_stream, chunk_rows):
+    with open_stream() as stream:
+        yield from pd.read_csv(stream, chunksize=chunk_rows, dtype=AIS_READ_DTYPES,
+                               usecols=lambda col: col in REQUIRED_COLUMNS)
+
+
+def clean_chunk(chunk):
+    """Validate a raw chunk and return only its clean rows."""
+    return validate_chunk(chunk)[0]
+
+
+def read_ais_chunks(open_stream, chunk_rows=INGEST_CHUNK_ROWS, validate=clean_chunk, strict=True):
+    """Yield validated AIS chunks from a fresh stream returned by ``open_stream()``.
+
+    ``validate`` takes a raw chunk and returns its clean rows with parsed
+    timestamps (e.g. a ``validation.RowValidator``). With ``strict`` the
+    chunks come from the pyarrow reader, which raises one of
+    ``strict_read_errors()`` on a file whose CSV structure it cannot parse.
+    """
+    if strict and _pyarrow() is not None:
+        chunks = _arrow_chunks(open_stream, chunk_rows)
+    else:
+        chunks = _pandas_chunks(open_stream, chunk_rows)
+    for chunk in chunks:
+        yield validate(chunk)
+
+
+def stream_partials(open_stream, chunk_rows=INGEST_CHUNK_ROWS, validate=clean_chunk, hash_tracks=False,
+                    history=None, on_chunk=None):
+    """Fold a CSV stream into a ``StreamingFeatureBuilder`` and return it.
+
+    ``on_chunk`` is called with the builder after every chunk.
+
+    A file whose CSV structure the strict reader cannot parse is streamed
+    again with the tolerant one; ``builder.strict`` records which reader
+    succeeded. Unparseable values never cause a second pass.
+    """
+    try:
+        return _fold_chunks(open_stream, chunk_rows, validate, hash_tracks, history, on_chunk, strict=True)
+    except strict_read_errors() as e:
+        logger.warning(f"Malformed CSV, streaming again with the tolerant reader: {e}")
+        if hasattr(validate, 'reset'):
+            validate.reset()
+        return _fold_chunks(open_stream, chunk_rows, validate, hash_tracks, history, on_chunk, strict=False)
+
+
+def _fold_chunks(open_stream, chunk_rows, validate, hash_tracks, history, on_chunk, strict):
+    builder = StreamingFeatureBuilder(hash_tracks, history)
+    builder.strict = strict
+    for chunk_number, chunk in enumerate(read_ais_chunks(open_stream, chunk_rows, validate, strict)):
+        builder.add_chunk(chunk)
+        logger.info(f"Streamed chunk {chunk_number}: {builder.rows} rows, "
+                    f"{0 if builder.partials is None else len(builder.partials)} vessels so far")
+        if on_chunk is not None:
+            on_chunk(builder)
+    return builder
+
+
+def stream_vessel_features(open_stream, chunk_rows=INGEST_CHUNK_ROWS, validate=clean_chunk, hash_tracks=False):
+    """Extract vessel features from a CSV stream in bounded memory.
+
+    Returns ``(features, row_count, track_hashes)``, where ``track_hashes``
+    is None unless ``hash_tracks`` is set. Vessels whose rows were not in time
+    order across chunks are recomputed from a second, filtered pass over the
+    stream, so the result matches an in-memory ``compute_vessel_features``.
+    The second pass cleans chunks with ``validate.reread`` when it has one
+    (e.g. a ``downsample.TrackDownsampler``), which leaves its counts alone,
+    else with ``clean_chunk``.
+    """
+    builder = stream_partials(open_stream, chunk_rows, validate, hash_tracks)
+    features = builder.features()
+    if builder.out_of_order:
+        late = np.array(sorted(builder.out_of_order))
+        logger.info(f"Recomputing {len(late)} vessels with out-of-order rows")
+        reread = getattr(validate, 'reread', clean_chunk)
+        rows = [chunk[chunk['mmsi'].isin(late)]
+                for chunk in read_ais_chunks(open_stream, chunk_rows, reread, strict=builder.strict)]
+        recomputed = compute_vessel_features(pd.concat(rows, ignore_index=True))
+        features = pd.concat([features[~features['mmsi'].isin(late)], recomputed], ignore_index=True)
+        features = features.sort_values('mmsi', kind='stable').reset_index(drop=True)
+
+    return features, builder.rows, builder.track_hashes
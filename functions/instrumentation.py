@@ -0,0 +1,141 @@
+# instrumentation.py
+
+"""Per-stage timing of the upload and chunk pipelines.
+
+A ``StageTimer`` times named stages with ``with timer.stage('download'):``
+blocks. Each stage records wall time plus optional row and byte counts and
+emits one structured JSON log line. ``timer.summary()`` is the per-stage
+breakdown written to the job document.
+
+Setting ``profile`` on an upload (``cpu``, ``memory`` or ``all``) also runs
+cProfile and/or tracemalloc around the job's stages. The reports go to
+``profiles/{jobId}/`` in Storage for deep dives; profiling stays off by
+default because it slows the pipeline down.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = {
+    'cpu': ('cpu',),
+    'memory': ('memory',),
+    'all': ('cpu', 'memory'),
+}
+
+# Lines kept from each profiler report
+PROFILE_TOP_ENTRIES = 40
+
+
+class Span:
+    """Counters of one running stage; set ``rows`` and ``bytes`` inside the block."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.bytes = None
+
+
+class StageTimer:
+    """Times the stages of one job's pipeline run."""
+
+    def __init__(self, job_id, pipeline):
+        self.job_id = job_id
+        self.pipeline = pipeline
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, rows=None, nbytes=None):
+        """Time the ``with`` block as stage ``name``; repeated stages accumulate."""
+        span = Span(name)
+        span.rows, span.bytes = rows, nbytes
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self._record(span, time.perf_counter() - start)
+
+    def _record(self, span, seconds):
+        totals = self.stages.setdefault(span.name, {'seconds': 0.0, 'calls': 0})
+        totals['seconds'] += seconds
+        totals['calls'] += 1
+        for key, value in (('rows', span.rows), ('bytes', span.bytes)):
+            if value is not None:
+                totals[key] = totals.get(key, 0) + int(value)
+
+        record = {
+            'event': 'stage',
+            'jobId': self.job_id,
+            'pipeline': self.pipeline,
+            'stage': span.name,
+            'seconds': round(seconds, 6),
+        }
+        if span.rows is not None:
+            record['rows'] = int(span.rows)
+        if span.bytes is not None:
+            record['bytes'] = int(span.bytes)
+        logger.info(json.dumps(record))
+
+    def summary(self):
+        """Per-stage totals, ``{stage: {'seconds', 'calls'[, 'rows', 'bytes']}}``."""
+        return {name: {**totals, 'seconds': round(totals['seconds'], 6)} for name, totals in self.stages.items()}
+
+    def increments(self, prefix, increment):
+        """Job document update adding this run's totals under ``prefix`` with ``increment``.
+
+        Used where many invocations (one per chunk) add to the same totals.
+        """
+        update = {}
+        for name, totals in self.stages.items():
+            for key, value in totals.items():
+                update[f'{prefix}.{name}.{key}'] = increment(value)
+        return update
+
+
+def profile_modes(settings):
+    """Profilers requested by the ``profile`` job setting."""
+    return PROFILE_MODES.get(str((settings or {}).get('profile', '')).lower(), ())
+
+
+@contextmanager
+def profiled(modes, report):
+    """Run the block under the profilers in ``modes``, then call ``report(name, text)`` per profiler."""
+    profiler = cProfile.Profile() if 'cpu' in modes else None
+    trace_memory = 'memory' in modes and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [f'current {current} bytes, peak {peak} bytes']
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]]
+            report('memory', '\n'.join(lines))
+        if profiler is not None:
+            buffer = io.StringIO()
+            pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+            report('cpu', buffer.getvalue())
+
+
+def storage_reporter(bucket, job_id, label):
+    """``report`` callback for ``profiled`` that uploads to ``profiles/{job_id}/{label}-{name}.txt``."""
+    def report(name, text):
+        try:
+            bucket.blob(f'profiles/{job_id}/{label}-{name}.txt').upload_from_string(text, content_type='text/plain')
+        except Exception as e:
+            logger.warning(f"Could not upload {name} profile of job {job_id}: {e}")
+    return report
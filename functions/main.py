@@ -2,9 +2,10 @@
 
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
-from firebase_functions import https_fn, options, storage_fn, pubsub_fn, firestore_fn
+from firebase_functions import https_fn, options, storage_fn, pubsub_fn, firestore_fn, scheduler_fn
 from google.cloud import pubsub_v1
 import google.cloud.firestore
+from google.cloud.firestore_v1.field_path import FieldPath
 import os
 import json
 import base64
@@ -17,89 +18,56 @@ logger = logging.getLogger(__name__)
 # Initialize Firebase Admin SDK
 firebase_admin.initialize_app()
 
-# Initialize Pub/Sub client
-publisher = pubsub_v1.PublisherClient()
+# Initialize Pub/Sub client, batching chunk messages
+from fanout import PUBLISH_BATCH_MAX_BYTES, PUBLISH_BATCH_MAX_LATENCY, PUBLISH_BATCH_MAX_MESSAGES
+
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=pubsub_v1.types.BatchSettings(
+        max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+        max_bytes=PUBLISH_BATCH_MAX_BYTES,
+        max_latency=PUBLISH_BATCH_MAX_LATENCY,
+    )
+)
 
 # Model configuration
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'extreme_maritime_classifier.joblib')
-model = None
-feature_columns = None
-
-# Expected feature columns based on the training notebook
-EXPECTED_FEATURES = [
-    'lat_mean', 'lon_mean', 'sog_mean', 'cog_mean', 'heading_mean',
-    'lat_std', 'lon_std', 'sog_std', 'cog_std', 'heading_std',
-    'lat_min', 'lon_min', 'sog_min', 'cog_min', 'heading_min',
-    'lat_max', 'lon_max', 'sog_max', 'cog_max', 'heading_max',
-    'lat_range', 'lon_range', 'sog_range', 'cog_range', 'heading_range',
-    'total_distance', 'avg_speed', 'max_speed', 'time_span_hours',
-    'num_points', 'avg_time_between_points', 'speed_changes',
-    'direction_changes', 'stops_count', 'moving_time_ratio',
-    'stationary_time_ratio', 'acceleration_mean', 'acceleration_std',
-    'turn_rate_mean', 'turn_rate_std', 'distance_from_shore_mean',
-    'distance_from_shore_min', 'in_port_ratio', 'night_activity_ratio',
-    'weekend_activity_ratio', 'speed_consistency', 'course_consistency',
-    'zigzag_factor', 'circular_variance', 'linearity_index'
-]
+from model_store import DUMMY_MODEL_VERSION, model_cache, start_eager_warm_up
+
+# get_job_results pagination
+DEFAULT_RESULTS_PAGE_SIZE = 1000
+MAX_RESULTS_PAGE_SIZE = 10000
+RESULTS_DOCS_PER_READ = 4
+
+# Uploads larger than this are featurized chunk by chunk instead of read into one frame
+STREAMING_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+# on_file_upload's limit; covers a rolling drop's lease wait (rolling.LEASE_WAIT_SECONDS)
+# plus reading and featurizing an upload of up to STREAMING_THRESHOLD_BYTES in memory
+UPLOAD_TIMEOUT_SECONDS = 540
+
+# Optionally load the model as soon as a process_chunk instance starts
+if os.environ.get('FUNCTION_TARGET') == 'process_chunk':
+    start_eager_warm_up()
 
 def get_model():
-    """Lazy load the model and feature columns."""
-    global model, feature_columns
-    if model is None:
-        try:
-            # Import heavy dependencies only when needed
-            import joblib
-            import numpy as np
-            from sklearn.dummy import DummyClassifier
-
-            if os.path.exists(MODEL_PATH):
-                logger.info(f"Loading model from {MODEL_PATH}")
-                model_data = joblib.load(MODEL_PATH)
-
-                # Handle different model storage formats
-                if isinstance(model_data, dict):
-                    model = model_data.get('model')
-                    feature_columns = model_data.get('feature_columns', EXPECTED_FEATURES)
-                else:
-                    model = model_data
-                    feature_columns = EXPECTED_FEATURES
-
-                logger.info("Model loaded successfully")
-                logger.info(f"Expected features: {len(feature_columns)}")
-            else:
-                logger.warning(f"Model file not found at {MODEL_PATH}, using dummy classifier")
-                raise FileNotFoundError("Model file not found")
-        except Exception as e:
-            logger.error(f"Could not load model: {e}")
-            # Import here to avoid loading scikit-learn at module level
-            from sklearn.dummy import DummyClassifier
-            import numpy as np
-
-            # Create a dummy model for development/testing
-            model = DummyClassifier(strategy='constant', constant=0)
-            feature_columns = EXPECTED_FEATURES
-            # Fit with dummy data matching expected features
-            X_dummy = np.random.rand(10, len(feature_columns))
-            y_dummy = np.array([0, 1, 2, 3, 0, 1, 2, 3, 0, 1])  # 4 classes: TUG, FISHING, PLEASURE, CARGO
-            model.fit(X_dummy, y_dummy)
-            logger.info("Using dummy classifier for development")
-    return model, feature_columns
-
-def ensure_pubsub_topic():
-    """Ensure the required Pub/Sub topic exists."""
+    """Return the cached model and feature columns, reloading if the artifact changed."""
+    current_model, current_feature_columns, _ = model_cache.get()
+    return current_model, current_feature_columns
+
+def ensure_pubsub_topic(topic='process-chunk'):
+    """Ensure a required Pub/Sub topic exists."""
     try:
         project_id = os.environ.get('GCLOUD_PROJECT', 'demo-project')
-        topic_path = publisher.topic_path(project_id, 'process-chunk')
+        topic_path = publisher.topic_path(project_id, topic)
 
         # Try to get the topic
         try:
             publisher.get_topic(request={"topic": topic_path})
-            logger.info(f"Pub/Sub topic 'process-chunk' already exists")
+            logger.info(f"Pub/Sub topic '{topic}' already exists")
         except Exception:
             # Topic doesn't exist, create it
-            logger.info(f"Creating Pub/Sub topic 'process-chunk'")
+            logger.info(f"Creating Pub/Sub topic '{topic}'")
             publisher.create_topic(request={"name": topic_path})
-            logger.info(f"Successfully created Pub/Sub topic 'process-chunk'")
+            logger.info(f"Successfully created Pub/Sub topic '{topic}'")
 
     except Exception as e:
         logger.error(f"Error ensuring Pub/Sub topic exists: {e}")
@@ -135,138 +103,150 @@ def get_upload_url(req: https_fn.Request) -> https_fn.Response:
 
     return https_fn.Response(url)
 
-def validate_csv_data(df):
-    """Validate that the CSV contains the required AIS data columns."""
-    required_columns = ['mmsi', 'timestamp', 'lat', 'lon', 'sog', 'cog', 'heading']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-
-    if missing_columns:
-        raise ValueError(f"Missing required columns: {missing_columns}")
+def get_job_settings(metadata):
+    """Read per-job settings from the uploaded object's custom metadata.
 
-    # Check for reasonable data ranges
-    if df['lat'].abs().max() > 90:
-        raise ValueError("Invalid latitude values (must be between -90 and 90)")
-    if df['lon'].abs().max() > 180:
-        raise ValueError("Invalid longitude values (must be between -180 and 180)")
-    if df['sog'].max() > 100:  # SOG in knots, 100 is very high but possible
-        logger.warning("Very high speed over ground values detected")
-
-    return True
+    Numeric settings (e.g. ``chunkSize``, ``targetChunkSeconds``) are set with
+    ``x-goog-meta-*`` headers on the upload and arrive as strings.
+    """
+    settings = {}
+    for key, value in (metadata or {}).items():
+        if key.startswith('firebase'):
+            # Download tokens and other Firebase-managed metadata
+            continue
+        try:
+            settings[key] = float(value) if '.' in value else int(value)
+        except (TypeError, ValueError):
+            settings[key] = value
+    return settings
 
-def preprocess_ais_data(df):
-    """Preprocess AIS data to extract features for each vessel."""
+def preprocess_ais_data(df, workers=1):
+    """Preprocess AIS data to extract features for each vessel, on ``workers`` processes."""
     import pandas as pd
-    import numpy as np
-    from datetime import datetime
+    from parallel import parallel_vessel_features
 
     # Convert timestamp to datetime if it's not already
     if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
         df['timestamp'] = pd.to_datetime(df['timestamp'])
 
-    # Group by MMSI (vessel identifier)
-    vessel_features = []
-
-    for mmsi, vessel_data in df.groupby('mmsi'):
-        if len(vessel_data) < 5:  # Skip vessels with too few data points
-            continue
-
-        vessel_data = vessel_data.sort_values('timestamp')
-
-        # Basic statistics
-        features = {
-            'mmsi': mmsi,
-            'lat_mean': vessel_data['lat'].mean(),
-            'lon_mean': vessel_data['lon'].mean(),
-            'sog_mean': vessel_data['sog'].mean(),
-            'cog_mean': vessel_data['cog'].mean(),
-            'heading_mean': vessel_data['heading'].mean(),
-            'lat_std': vessel_data['lat'].std(),
-            'lon_std': vessel_data['lon'].std(),
-            'sog_std': vessel_data['sog'].std(),
-            'cog_std': vessel_data['cog'].std(),
-            'heading_std': vessel_data['heading'].std(),
-            'lat_min': vessel_data['lat'].min(),
-            'lon_min': vessel_data['lon'].min(),
-            'sog_min': vessel_data['sog'].min(),
-            'cog_min': vessel_data['cog'].min(),
-            'heading_min': vessel_data['heading'].min(),
-            'lat_max': vessel_data['lat'].max(),
-            'lon_max': vessel_data['lon'].max(),
-            'sog_max': vessel_data['sog'].max(),
-            'cog_max': vessel_data['cog'].max(),
-            'heading_max': vessel_data['heading'].max(),
+    return parallel_vessel_features(df, workers)
+
+def chunk_message_fields(settings, feature_version=None):
+    """Job-wide fields of the process-chunk messages."""
+    from instrumentation import profile_modes
+    from vessel_index import index_enabled
+
+    message_fields = {}
+    if feature_version:
+        message_fields['featureVersion'] = feature_version
+    if profile_modes(settings):
+        message_fields['profile'] = settings['profile']
+    if not index_enabled(settings):
+        message_fields['vesselIndex'] = False
+    return message_fields
+
+def publish_feature_chunks(bucket, job_id, vessel_features, chunk_slices, settings, message_fields, timer):
+    """Upload feature chunks and publish their process-chunk messages.
+
+    ``chunk_slices`` lists ``(chunk_id, start, end, chunk_fields)`` row slices
+    of ``vessel_features``. Chunks upload concurrently while later ones are
+    encoded; a message is published once all of its chunks are uploaded.
+    Returns once every message is confirmed.
+    """
+    from chunk_io import CHUNK_CONTENT_TYPES, CHUNK_EXTENSIONS, CHUNK_FORMAT, encode_chunk
+    from fanout import publish_json, wait_for_publishes
+    from inference import batch_chunk_messages, inference_batch_vessels
+    from storage_io import ChunkUploader
+
+    project_id = os.environ.get('GCLOUD_PROJECT', 'demo-project')
+    topic_path = publisher.topic_path(project_id, 'process-chunk')
+    publish_futures = []
+    uploads = {}
+
+    def uploaded_chunks(uploader):
+        # Serialize chunks straight from the feature frame, uploading each in the background
+        for chunk_id, start, end, chunk_fields in chunk_slices:
+            chunk = vessel_features.iloc[start:end]
+            chunk_blob = bucket.blob(f'chunks/{job_id}/{chunk_id}{CHUNK_EXTENSIONS[CHUNK_FORMAT]}')
+            with timer.stage('encodeChunk', rows=len(chunk)):
+                payload = encode_chunk(chunk, CHUNK_FORMAT)
+            future = uploader.submit(chunk_blob, payload, content_type=CHUNK_CONTENT_TYPES[CHUNK_FORMAT])
+            uploads[chunk_id] = (future, len(chunk), len(payload))
+            yield {'chunkId': chunk_id, 'chunkPath': chunk_blob.name, **chunk_fields}, len(chunk)
+
+    # Consecutive chunks share a message so process_chunk classifies them in one batch;
+    # each message is published as soon as it is full, while later chunks encode and upload
+    chunk_size = max((end - start for _, start, end, _ in chunk_slices), default=1)
+    batch_vessels = inference_batch_vessels(chunk_size, settings)
+    with ChunkUploader() as uploader:
+        for message in batch_chunk_messages(job_id, uploaded_chunks(uploader), batch_vessels, message_fields):
+            # A worker must never receive a message before its chunks exist
+            pending = [uploads.pop(descriptor['chunkId']) for descriptor in message['chunks']]
+            with timer.stage('chunkUpload', rows=sum(rows for _, rows, _ in pending),
+                             nbytes=sum(nbytes for _, _, nbytes in pending)):
+                for future, _, _ in pending:
+                    future.result()
+            publish_futures.append(publish_json(publisher, topic_path, message))
+
+    with timer.stage('publish', rows=len(publish_futures)):
+        wait_for_publishes(publish_futures)
+
+
+def start_map_reduce(job_ref, bucket, blob, file_size, settings):
+    """Hand an upload to map and reduce workers: publish one map task per byte range."""
+    from fanout import publish_json, wait_for_publishes
+    from mapreduce import MAP_TOPIC, REDUCE_TOPIC, read_header, reduce_shard_count, split_ranges
+    from progress import phase_progress
+    from validation import VALIDATION_RULES
+
+    header = read_header(blob)
+    splits = split_ranges(file_size)
+    shards = reduce_shard_count(file_size, settings)
+    logger.info(f"Map-reduce over {len(splits)} byte ranges into {shards} reduce shards")
+    job_ref.update({
+        'status': 'mapping',
+        'ingestMode': 'map-reduce',
+        'phases': phase_progress({'map': len(splits), 'reduce': shards}),
+        'vesselCount': 0,
+        'validation': {
+            'rows': 0,
+            'rejectedRows': 0,
+            'quarantinedRows': 0,
+            'ruleCounts': dict.fromkeys(VALIDATION_RULES, 0)
         }
+    })
 
-        # Ranges
-        features.update({
-            'lat_range': features['lat_max'] - features['lat_min'],
-            'lon_range': features['lon_max'] - features['lon_min'],
-            'sog_range': features['sog_max'] - features['sog_min'],
-            'cog_range': features['cog_max'] - features['cog_min'],
-            'heading_range': features['heading_max'] - features['heading_min'],
-        })
-
-        # Time-based features
-        time_span = (vessel_data['timestamp'].max() - vessel_data['timestamp'].min()).total_seconds()
-        features.update({
-            'time_span_hours': time_span / 3600,
-            'num_points': len(vessel_data),
-            'avg_time_between_points': time_span / max(len(vessel_data) - 1, 1),
-        })
-
-        # Movement features
-        distances = []
-        for i in range(1, len(vessel_data)):
-            prev_row = vessel_data.iloc[i-1]
-            curr_row = vessel_data.iloc[i]
-            # Simplified distance calculation (Haversine would be more accurate)
-            lat_diff = curr_row['lat'] - prev_row['lat']
-            lon_diff = curr_row['lon'] - prev_row['lon']
-            distance = np.sqrt(lat_diff**2 + lon_diff**2) * 111  # Rough km conversion
-            distances.append(distance)
-
-        total_distance = sum(distances) if distances else 0
-        features.update({
-            'total_distance': total_distance,
-            'avg_speed': total_distance / max(features['time_span_hours'], 0.001),
-            'max_speed': features['sog_max'],
+    ensure_pubsub_topic(MAP_TOPIC)
+    ensure_pubsub_topic(REDUCE_TOPIC)
+    project_id = os.environ.get('GCLOUD_PROJECT', 'demo-project')
+    topic_path = publisher.topic_path(project_id, MAP_TOPIC)
+    wait_for_publishes([
+        publish_json(publisher, topic_path, {
+            'jobId': job_ref.id,
+            'bucket': bucket.name,
+            'fileName': blob.name,
+            'fileSize': file_size,
+            'split': split,
+            'start': start,
+            'end': end,
+            'header': header.decode('utf-8'),
+            'shards': shards,
+            'settings': settings
         })
+        for split, (start, end) in enumerate(splits)
+    ])
 
-        # Add remaining features with default values
-        remaining_features = {
-            'speed_changes': len([d for d in distances if d > 0.1]),
-            'direction_changes': 0,  # Simplified
-            'stops_count': len(vessel_data[vessel_data['sog'] < 0.5]),
-            'moving_time_ratio': len(vessel_data[vessel_data['sog'] >= 0.5]) / len(vessel_data),
-            'stationary_time_ratio': len(vessel_data[vessel_data['sog'] < 0.5]) / len(vessel_data),
-            'acceleration_mean': 0,  # Would need time-series calculation
-            'acceleration_std': 0,
-            'turn_rate_mean': 0,
-            'turn_rate_std': 0,
-            'distance_from_shore_mean': 10,  # Default assumption
-            'distance_from_shore_min': 5,
-            'in_port_ratio': 0.1,  # Default assumption
-            'night_activity_ratio': 0.3,  # Default assumption
-            'weekend_activity_ratio': 0.3,  # Default assumption
-            'speed_consistency': 1 - (features['sog_std'] / max(features['sog_mean'], 0.001)),
-            'course_consistency': 1 - (features['cog_std'] / 360),
-            'zigzag_factor': features['total_distance'] / max(np.sqrt(features['lat_range']**2 + features['lon_range']**2) * 111, 0.001),
-            'circular_variance': 0,  # Simplified
-            'linearity_index': 0.5,  # Default
-        }
-
-        features.update(remaining_features)
-        vessel_features.append(features)
-
-    return pd.DataFrame(vessel_features)
-
-@storage_fn.on_object_finalized()
+@storage_fn.on_object_finalized(
+    memory=options.MemoryOption.GB_4,
+    timeout_sec=UPLOAD_TIMEOUT_SECONDS,
+)
 def on_file_upload(event: storage_fn.CloudEvent) -> None:
     """
     Triggered by a new file upload. Validates, preprocesses, splits the CSV into chunks
     and publishes a Pub/Sub message for each.
     """
     # Import pandas only when needed
+    import numpy as np
     import pandas as pd
 
     bucket_name = event.data.bucket
@@ -283,209 +263,672 @@ def on_file_upload(event: storage_fn.CloudEvent) -> None:
 
     client = firestore.client()
     job_ref = client.collection('jobs').document()
+    settings = get_job_settings(event.data.metadata)
 
     job_ref.set({
         'fileName': file_name,
+        'settings': settings,
         'status': 'validating',
         'createdAt': firestore.SERVER_TIMESTAMP,
         'chunkCount': 0,
         'processedChunks': 0
     })
 
+    from contextlib import ExitStack
+    from instrumentation import StageTimer, profile_modes, profiled, storage_reporter
+
+    # Per-stage timings, plus cProfile/tracemalloc reports when the upload asks for them
+    timer = StageTimer(job_ref.id, 'upload')
+    profiling = ExitStack()
+
     try:
-        # Download the file to a temporary location
-        bucket = storage.bucket(bucket_name)
+        from storage_io import open_ranged, shared_bucket
+
+        bucket = shared_bucket(bucket_name)
+        if profile_modes(settings):
+            profiling.enter_context(profiled(profile_modes(settings), storage_reporter(bucket, job_ref.id, 'upload')))
+
+        from features import MIN_POINTS_PER_VESSEL, feature_version
+        from result_cache import TRACK_KEY_COLUMN, ResultCache, cache_enabled, file_fingerprint, track_hashes, track_keys
+        from rolling import rolling_job_id
+        from downsample import TrackDownsampler, downsample_settings
+        from validation import RowValidator
+
+        # Validated rows are optionally thinned before featurization
+        validator = RowValidator()
+        downsampler = TrackDownsampler(validator, *downsample_settings(settings))
+
+        # Drops into a rolling job extend its stored state instead of starting afresh
+        rolling_id = rolling_job_id(settings['rollingJob']) if settings.get('rollingJob') else None
+
+        # Reuse the results of an identical upload classified by the same model
+        cache = None
+        if rolling_id is None and cache_enabled(settings):
+            cache = ResultCache(client, model_cache.artifact_version(), feature_version() + downsampler.version())
+            fingerprint = file_fingerprint(event.data)
+            job_ref.update({
+                'fileFingerprint': fingerprint,
+                'modelVersion': cache.model_version,
+                'featureVersion': cache.feature_version
+            })
+            with timer.stage('fileCacheLookup'):
+                cached_job = cache.lookup_file(fingerprint)
+            if cached_job:
+                logger.info(f"Upload matches job {cached_job['jobId']}, reusing its results")
+                job_ref.update({
+                    'status': 'completed',
+                    'resultsJobId': cached_job['jobId'],
+                    'vesselCount': cached_job['vesselCount'],
+                    'classifiedVessels': cached_job['vesselCount'],
+                    'classificationSummary': cached_job['classificationSummary'],
+                    'cacheStats': {'fileHits': 1, 'fileMisses': 0},
+                    'completedAt': firestore.SERVER_TIMESTAMP
+                })
+                return
+
         blob = bucket.blob(file_name)
-        tmp_path = f'/tmp/{os.path.basename(file_name)}'
-        blob.download_to_filename(tmp_path)
+        file_size = int(event.data.size or 0)
 
-        logger.info("Validating and preprocessing AIS data...")
-        job_ref.update({'status': 'preprocessing'})
+        # Files beyond one instance's limits are read, validated and featurized by map and reduce workers
+        from mapreduce import map_reduce_enabled
+
+        if rolling_id is None and map_reduce_enabled(settings, file_size):
+            with timer.stage('mapPublish', nbytes=file_size):
+                start_map_reduce(job_ref, bucket, blob, file_size, settings)
+            return
 
-        # Read and validate the CSV
-        raw_data = pd.read_csv(tmp_path)
-        logger.info(f"Loaded {len(raw_data)} raw AIS records")
+        streaming = file_size > STREAMING_THRESHOLD_BYTES
+        generation = int(event.data.generation or 0) or None
 
-        validate_csv_data(raw_data)
+        def open_upload():
+            # Parsers read the upload while it downloads in parallel byte ranges
+            return open_ranged(blob, file_size, generation=generation)
 
-        # Preprocess to extract vessel features
-        vessel_features = preprocess_ais_data(raw_data)
-        logger.info(f"Extracted features for {len(vessel_features)} vessels")
+        predicted = None
+        track_key_by_mmsi = None
 
-        if len(vessel_features) == 0:
+        logger.info("Validating and preprocessing AIS data...")
+        job_ref.update({
+            'status': 'preprocessing',
+            'ingestMode': 'rolling' if rolling_id else 'streaming' if streaming else 'in-memory'
+        })
+
+        drop_sequence = None
+
+        if rolling_id is not None:
+            # Fold the drop into the stored accumulators of the vessels it touches
+            from features import merge_partials
+            from ingest import stream_partials
+            from rolling import LeaseRenewal, RollingState, acquire_lease, drop_key, release_lease, renew_lease
+
+            rolling_ref = client.collection('jobs').document(rolling_id)
+            with timer.stage('lease'):
+                drop_sequence = acquire_lease(client, rolling_ref, job_ref.id, settings['rollingJob'])
+            try:
+                # A redelivered or re-uploaded drop skips the shards it was already folded into
+                state = RollingState(bucket, rolling_id, drop_key(file_fingerprint(event.data), generation))
+                with timer.stage('ingest', nbytes=file_size) as span:
+                    builder = stream_partials(
+                        open_upload, validate=lambda chunk: state.skip_folded(downsampler(chunk)),
+                        history=state.history, on_chunk=LeaseRenewal(client, rolling_ref, job_ref.id)
+                    )
+                    span.rows = builder.rows
+                if builder.partials is not None:
+                    # Never write the state without holding the lease
+                    renew_lease(client, rolling_ref, job_ref.id)
+                    with timer.stage('saveState', rows=len(builder.partials)):
+                        state.save(builder.partials)
+                # Vessels whose shards already held this drop are featurized from the stored state
+                refolded = state.refolded_partials()
+                if refolded is not None:
+                    builder.partials = merge_partials(builder.partials, refolded)
+                touched = builder.partials
+            finally:
+                release_lease(client, rolling_ref, job_ref.id)
+
+            with timer.stage('featurize', rows=0 if touched is None else len(touched)):
+                vessel_features = builder.features()
+            logger.info(f"Drop {drop_sequence} of {rolling_id}: {builder.rows} rows touching "
+                        f"{0 if touched is None else len(touched)} vessels")
+            job_ref.update({
+                'rollingJobId': rolling_id,
+                'resultsJobId': rolling_id,
+                'dropSequence': drop_sequence,
+                'touchedVessels': 0 if touched is None else len(touched),
+                # Rows older than a vessel's stored last point are folded in without re-sorting
+                'outOfOrderVessels': len(builder.out_of_order)
+            })
+            rolling_ref.update({'lastDropJobId': job_ref.id, 'updatedAt': firestore.SERVER_TIMESTAMP})
+        elif streaming:
+            # Validate and featurize chunk by chunk straight from the blob stream
+            from ingest import INGEST_CHUNK_ROWS, stream_vessel_features
+
+            logger.info(f"Streaming {file_size} bytes in chunks of {INGEST_CHUNK_ROWS} rows")
+            with timer.stage('ingest', nbytes=file_size) as span:
+                vessel_features, row_count, track_info = stream_vessel_features(
+                    open_upload, validate=downsampler, hash_tracks=cache is not None
+                )
+                span.rows = row_count
+            logger.info(f"Streamed {row_count} valid AIS records")
+
+            if cache is not None:
+                # Features are already computed, so only cached predictions save work
+                track_key_by_mmsi = track_keys(track_info[track_info['num_points'] >= MIN_POINTS_PER_VESSEL])
+                with timer.stage('trackCacheLookup', rows=len(track_key_by_mmsi)):
+                    predicted, featured = cache.lookup_tracks(track_key_by_mmsi)
+                track_hits = len(predicted[0]) + len(featured)
+        else:
+            # Download and read the CSV into the compact AIS schema, then drop invalid rows
+            from ingest import read_ais_csv
+
+            with timer.stage('readCsv', nbytes=file_size) as span:
+                raw_data = read_ais_csv(open_upload)
+                span.rows = len(raw_data)
+            logger.info(f"Loaded {len(raw_data)} raw AIS records")
+
+            with timer.stage('validate', rows=len(raw_data)):
+                raw_data = validator(raw_data)
+            if downsampler.enabled:
+                with timer.stage('downsample', rows=len(raw_data)):
+                    raw_data = downsampler.simplify(raw_data)
+
+            featured = None
+            if cache is not None:
+                # Only featurize vessels whose tracks are not cached
+                with timer.stage('trackHash', rows=len(raw_data)):
+                    track_info = track_hashes(raw_data)
+                track_key_by_mmsi = track_keys(track_info[track_info['num_points'] >= MIN_POINTS_PER_VESSEL])
+                with timer.stage('trackCacheLookup', rows=len(track_key_by_mmsi)):
+                    predicted, featured = cache.lookup_tracks(track_key_by_mmsi)
+                track_hits = len(predicted[0]) + len(featured)
+                raw_data = raw_data[~raw_data['mmsi'].isin(np.concatenate([predicted[0], featured['mmsi'].to_numpy()]))]
+
+            # Preprocess to extract vessel features
+            from parallel import default_workers
+
+            with timer.stage('featurize', rows=len(raw_data)):
+                vessel_features = preprocess_ais_data(raw_data, default_workers(settings))
+            if featured is not None and len(featured):
+                vessel_features = pd.concat([vessel_features, featured], ignore_index=True)
+
+        # Record rejected rows per rule and keep them for inspection
+        validation_summary = validator.summary()
+        quarantine = validator.quarantine_csv()
+        if quarantine is not None:
+            quarantine_blob = bucket.blob(f'quarantine/{job_ref.id}/rejected.csv')
+            quarantined_rows = validation_summary['quarantinedRows']
+            with timer.stage('quarantineUpload', rows=quarantined_rows, nbytes=len(quarantine)):
+                quarantine_blob.upload_from_string(quarantine, content_type='text/csv')
+            validation_summary['quarantinePath'] = quarantine_blob.name
+            logger.warning(f"Rejected {validator.rejected_rows} of {validator.rows} rows: {validator.rule_counts}")
+        job_update = {'validation': validation_summary}
+        if downsampler.enabled:
+            job_update['downsampling'] = downsampler.summary()
+            logger.info(f"Downsampling dropped {downsampler.rows - downsampler.kept_rows} of {downsampler.rows} "
+                        f"valid rows")
+        job_ref.update(job_update)
+
+        if cache is not None:
+            vessel_features = vessel_features[~vessel_features['mmsi'].isin(predicted[0])]
+            vessel_features = vessel_features.assign(**{
+                TRACK_KEY_COLUMN: vessel_features['mmsi'].map(track_key_by_mmsi)
+            })
+            cache_stats = {
+                'fileHits': 0,
+                'fileMisses': 1,
+                'trackHits': track_hits,
+                'trackPredictionHits': len(predicted[0]),
+                'trackMisses': len(track_key_by_mmsi) - track_hits
+            }
+            logger.info(f"Result cache: {cache_stats}")
+            job_ref.update({'cacheStats': cache_stats})
+
+        cached_count = 0 if predicted is None else len(predicted[0])
+        vessel_count = len(vessel_features) + cached_count
+        logger.info(f"Extracted features for {vessel_count} vessels ({cached_count} already classified)")
+
+        if vessel_count == 0 and rolling_id is None:
             raise ValueError("No valid vessel data found after preprocessing")
 
-        # Save preprocessed data
-        processed_path = f'/tmp/processed_{os.path.basename(file_name)}'
-        vessel_features.to_csv(processed_path, index=False)
+        if cached_count:
+            # Write cached predictions as their own results document
+            from results_store import class_counts, encode_result_docs, write_result_docs
+
+            write_result_docs(client, job_ref.collection('results'), 'cached', encode_result_docs(*predicted), {
+                'chunk_size': cached_count,
+                'modelVersion': cache.model_version,
+                'processed_at': firestore.SERVER_TIMESTAMP
+            })
+            job_ref.update({
+                'classifiedVessels': firestore.Increment(cached_count),
+                **{
+                    f'classificationSummary.{class_name}': firestore.Increment(count)
+                    for class_name, count in class_counts(predicted[1]).items()
+                }
+            })
 
         # Split the processed data into chunks and publish messages
-        job_ref.update({'status': 'splitting'})
-        chunk_size = 100  # Smaller chunks for processed vessel data
-        chunk_count = 0
-
-        for chunk in pd.read_csv(processed_path, chunksize=chunk_size):
-            chunk_path = f'/tmp/chunk_{chunk_count}.csv'
-            chunk.to_csv(chunk_path, index=False)
-
-            # Upload chunk to storage
-            chunk_blob = bucket.blob(f'chunks/{job_ref.id}/{chunk_count}.csv')
-            chunk_blob.upload_from_filename(chunk_path)
-
-            # Publish message
-            project_id = os.environ.get('GCLOUD_PROJECT', 'demo-project')
-            topic_path = publisher.topic_path(project_id, 'process-chunk')
-            message_data = {
-                'jobId': job_ref.id,
-                'chunkId': chunk_count,
-                'chunkPath': chunk_blob.name
-            }
-            message_bytes = json.dumps(message_data).encode('utf-8')
-            publisher.publish(topic_path, message_bytes)
-            chunk_count += 1
-            os.remove(chunk_path)
+        from fanout import choose_chunk_size
+
+        chunk_size = choose_chunk_size(len(vessel_features), settings)
+        job_ref.update({'status': 'splitting', 'chunkSize': chunk_size})
+        logger.info(f"Splitting {len(vessel_features)} vessels into chunks of {chunk_size}")
+
+        if rolling_id is not None:
+            # Chunks never span state shards, so each merges into one shard's results
+            from rolling import shard_chunks, shard_key
+
+            vessel_features, slices = shard_chunks(vessel_features, chunk_size)
+            chunk_slices = [
+                (chunk_id, start, end, {
+                    'rollingJobId': rolling_id,
+                    'resultShard': shard_key(shard),
+                    'dropSequence': drop_sequence
+                })
+                for chunk_id, (shard, start, end) in enumerate(slices)
+            ]
+        else:
+            chunk_slices = [
+                (chunk_id, start, start + chunk_size, {})
+                for chunk_id, start in enumerate(range(0, len(vessel_features), chunk_size))
+            ]
+
+        # Only move to 'processing' once every chunk message is confirmed
+        publish_feature_chunks(
+            bucket, job_ref.id, vessel_features, chunk_slices, settings,
+            chunk_message_fields(settings, cache.feature_version if cache is not None else None), timer
+        )
+        chunk_count = len(chunk_slices)
 
-        job_ref.update({
+        job_update = {
             'chunkCount': chunk_count,
             'status': 'processing',
-            'vesselCount': len(vessel_features)
-        })
-
-        # Clean up temporary files
-        os.remove(tmp_path)
-        os.remove(processed_path)
+            'vesselCount': vessel_count
+        }
+        if chunk_count == 0:
+            # Every vessel came from the track cache, or a drop touched no classifiable vessel
+            job_update.update({'status': 'completed', 'completedAt': firestore.SERVER_TIMESTAMP})
+        job_ref.update(job_update)
         logger.info(f"Successfully split processed data into {chunk_count} chunks")
 
     except Exception as e:
         logger.error(f"Error processing file: {e}")
         job_ref.update({'status': 'error', 'error': str(e)})
 
+    finally:
+        profiling.close()
+        try:
+            job_ref.update({'timings.upload': timer.summary()})
+        except Exception as e:
+            logger.warning(f"Could not record stage timings: {e}")
+
 def prepare_features_for_model(data, feature_columns):
     """Prepare the feature data for model prediction."""
-    import pandas as pd
-    import numpy as np
-
-    # Ensure we have all required features
-    missing_features = [col for col in feature_columns if col not in data.columns and col != 'mmsi']
-    if missing_features:
-        logger.warning(f"Missing features: {missing_features}")
-        # Add missing features with default values
-        for feature in missing_features:
-            data[feature] = 0.0
-
-    # Select only the features the model expects (excluding mmsi)
-    model_features = [col for col in feature_columns if col != 'mmsi' and col in data.columns]
-    X = data[model_features].copy()
-
-    # Handle any remaining NaN values
-    X = X.fillna(0)
-
-    # Ensure all values are numeric
-    for col in X.columns:
-        X[col] = pd.to_numeric(X[col], errors='coerce').fillna(0)
+    from inference import feature_matrix
 
+    # Missing features are filled with 0, NaN and non-numeric values become 0
+    X = feature_matrix(data, feature_columns)
     return X, data['mmsi'].tolist() if 'mmsi' in data.columns else list(range(len(data)))
 
+def store_chunk_results(client, job_ref, chunk, vessel_ids, predictions, probabilities, result_fields):
+    """Write one chunk's predictions; returns the class counts to add to the job's summary."""
+    from results_store import class_counts, encode_result_docs, merge_result_docs, write_result_docs
+
+    rolling_id = chunk.get('rollingJobId')
+    if not rolling_id:
+        result_docs = encode_result_docs(vessel_ids, predictions, probabilities)
+        write_result_docs(client, job_ref.collection('results'), chunk['chunkId'], result_docs, result_fields)
+        return class_counts(predictions)
+
+    # Upsert into the rolling job's results for this shard; newer drops win
+    rolling_ref = client.collection('jobs').document(rolling_id)
+    class_delta, added = merge_result_docs(
+        client, rolling_ref.collection('results'), chunk['resultShard'], vessel_ids,
+        predictions, probabilities, chunk['dropSequence'], result_fields
+    )
+    rolling_ref.update({
+        'vesselCount': firestore.Increment(added),
+        'classifiedVessels': firestore.Increment(added),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+        **{
+            f'classificationSummary.{class_name}': firestore.Increment(count)
+            for class_name, count in class_delta.items() if count
+        }
+    })
+    return {}
+
 @pubsub_fn.on_message_published(
     topic='process-chunk',
-    memory=options.MemoryOption.GiB_1,
+    memory=options.MemoryOption.GB_1,
+    # A full message is sized for fanout.TARGET_CHUNK_SECONDS; the rest covers cold starts and retries
+    timeout_sec=120,
 )
 def process_chunk(event: pubsub_fn.CloudEvent) -> None:
-    """Processes a single data chunk with the maritime classification model."""
+    """Classifies a batch of data chunks with the maritime classification model."""
+    from storage_io import shared_bucket
+
+    try:
+        # Decode the message data; one message carries one or more chunks
+        message_data = json.loads(base64.b64decode(event.data.message.data).decode('utf-8'))
+    except Exception as e:
+        logger.error(f"Could not decode chunk message: {e}")
+        return
+
+    bucket_name = os.environ.get('GCLOUD_PROJECT', 'demo-project') + '.appspot.com'
+    process_chunk_message(firestore.client(), shared_bucket(bucket_name), message_data)
+
+def process_chunk_message(client, bucket, message_data):
+    """Classify the chunks of one decoded process-chunk message with ``client`` and ``bucket``."""
     # Import pandas only when needed
     import pandas as pd
     import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from contextlib import ExitStack
+    from inference import CHUNK_DOWNLOAD_THREADS, chunk_bounds, classify, message_chunks
+    from instrumentation import StageTimer, profile_modes, profiled, storage_reporter
+
+    profiling = ExitStack()
 
     try:
-        # Decode the message data
-        message_data_str = base64.b64decode(event.data.message.data).decode('utf-8')
-        message_data = json.loads(message_data_str)
         job_id = message_data['jobId']
-        chunk_id = message_data['chunkId']
-        chunk_path = message_data['chunkPath']
+        chunks = message_chunks(message_data)
+        chunk_ids = [chunk['chunkId'] for chunk in chunks]
 
-        logger.info(f"Processing chunk {chunk_id} for job {job_id}")
+        # Redelivered chunks that already completed are acknowledged without any work
+        from progress import complete_chunks, pending_chunks, update_job_progress
 
-        bucket_name = os.environ.get('GCLOUD_PROJECT', 'demo-project') + '.appspot.com'
-        bucket = storage.bucket(bucket_name)
-
-        # Download chunk
-        blob = bucket.blob(chunk_path)
-        tmp_chunk_path = f'/tmp/chunk_{job_id}_{chunk_id}.csv'
-        blob.download_to_filename(tmp_chunk_path)
-
-        # Load the data
-        data = pd.read_csv(tmp_chunk_path)
-        logger.info(f"Loaded chunk with {len(data)} vessels")
-
-        # Get the model and feature columns
-        current_model, feature_columns = get_model()
+        job_ref = client.collection('jobs').document(job_id)
+        pending = set(pending_chunks(client, job_ref, chunk_ids))
+        if len(pending) < len(chunks):
+            chunks = [chunk for chunk in chunks if chunk['chunkId'] in pending]
+            logger.info(f"Skipping already completed chunks {sorted(set(chunk_ids) - pending)} of job {job_id}")
+            chunk_ids = [chunk['chunkId'] for chunk in chunks]
+            if not chunks:
+                # The delivery that completed them may have stopped before checking for completion
+                update_job_progress(client, job_ref)
+                return
+
+        logger.info(f"Processing chunks {chunk_ids} for job {job_id}")
+
+        timer = StageTimer(job_id, 'chunk')
+        modes = profile_modes(message_data)
+        if modes:
+            profiling.enter_context(profiled(modes, storage_reporter(bucket, job_id, f'chunk-{chunk_ids[0]}')))
+
+        # Download the chunks concurrently and load each in the format given by its extension
+        from chunk_io import decode_chunk
+
+        with timer.stage('download') as span:
+            with ThreadPoolExecutor(min(CHUNK_DOWNLOAD_THREADS, len(chunks))) as pool:
+                payloads = list(pool.map(lambda chunk: bucket.blob(chunk['chunkPath']).download_as_bytes(), chunks))
+            span.bytes = sum(len(payload) for payload in payloads)
+        with timer.stage('decode', nbytes=span.bytes) as span:
+            frames = [decode_chunk(payload, chunk['chunkPath']) for payload, chunk in zip(payloads, chunks)]
+            bounds = chunk_bounds([len(frame) for frame in frames])
+            data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+            span.rows = len(data)
+        del payloads, frames
+        logger.info(f"Loaded {len(chunks)} chunks with {len(data)} vessels")
+
+        # Get the model, feature columns and model version
+        with timer.stage('modelLoad'):
+            current_model, feature_columns, model_version = model_cache.get()
 
         # Prepare features for the model
-        X, vessel_ids = prepare_features_for_model(data, feature_columns)
+        with timer.stage('prepare', rows=len(data)):
+            X, vessel_ids = prepare_features_for_model(data, feature_columns)
+            vessel_ids = np.asarray(vessel_ids)
 
-        # Make predictions
+        # One predict_proba over the whole batch; classes are its argmax
         try:
-            predictions = current_model.predict(X)
-            probabilities = None
-
-            # Try to get prediction probabilities if available
-            if hasattr(current_model, 'predict_proba'):
-                try:
-                    probabilities = current_model.predict_proba(X)
-                except Exception:
-                    logger.warning("Could not get prediction probabilities")
+            with timer.stage('predict', rows=len(X)):
+                predictions, probabilities = classify(current_model, X)
 
             logger.info(f"Successfully predicted {len(predictions)} vessel classifications")
 
+            # The dummy classifier stands in for an artifact that failed to load
+            predicted_by_model = model_version != DUMMY_MODEL_VERSION
+
         except Exception as model_error:
             logger.error(f"Model prediction error: {model_error}")
             # Fallback to dummy predictions
             predictions = np.zeros(len(data), dtype=int)
             probabilities = None
+            predicted_by_model = False
+
+        # Fallback predictions never carry the version of a real model
+        if not predicted_by_model:
+            model_version = DUMMY_MODEL_VERSION
+
+        # Store results in Firestore as packed columnar documents, chunk by chunk
+        chunk_results = {}
+        for chunk, (start, end) in zip(chunks, bounds):
+            with timer.stage('resultWrite', rows=end - start):
+                chunk_counts = store_chunk_results(
+                    client, job_ref, chunk, vessel_ids[start:end], predictions[start:end],
+                    None if probabilities is None else probabilities[start:end],
+                    {
+                        'chunk_size': end - start,
+                        'modelVersion': model_version,
+                        'processed_at': firestore.SERVER_TIMESTAMP
+                    }
+                )
+            chunk_results[chunk['chunkId']] = (end - start, chunk_counts)
+
+        # Index each vessel's class under its MMSI for cross-job history queries;
+        # drops of a rolling job share the rolling job's entry
+        if predicted_by_model and message_data.get('vesselIndex', True):
+            from vessel_index import index_predictions
+
+            try:
+                with timer.stage('vesselIndexWrite', rows=len(predictions)):
+                    index_predictions(
+                        client, chunks[0].get('rollingJobId') or job_id, vessel_ids, predictions, probabilities,
+                        model_version
+                    )
+            except Exception as index_error:
+                logger.warning(f"Could not index vessels of chunks {chunk_ids}: {index_error}")
+
+        # Count progress and the per-class summary once per chunk in a sharded counter, even
+        # if a concurrent redelivery of the same chunks got here first; the job document is
+        # only written at progress milestones and by the chunk that completes the job
+        counter_update = timer.increments('timings.chunks', firestore.Increment)
+        if not predicted_by_model:
+            counter_update['fallbackChunks'] = firestore.Increment(len(chunks))
+        if complete_chunks(client, job_ref, chunk_results, counter_update):
+            update_job_progress(client, job_ref)
+
+        # Cache features and model predictions for tracks seen again in later uploads
+        from result_cache import TRACK_KEY_COLUMN, ResultCache
+
+        if predicted_by_model and message_data.get('featureVersion') and TRACK_KEY_COLUMN in data.columns:
+            from features import FEATURE_COLUMNS
+
+            try:
+                with timer.stage('trackCacheWrite', rows=len(predictions)):
+                    ResultCache(client, model_version, message_data['featureVersion']).remember_tracks(
+                        data[TRACK_KEY_COLUMN], vessel_ids, data[FEATURE_COLUMNS[1:]].to_numpy(dtype=float),
+                        predictions, probabilities
+                    )
+            except Exception as cache_error:
+                logger.warning(f"Could not cache tracks of chunks {chunk_ids}: {cache_error}")
+
+        logger.info(f"Successfully processed chunks {chunk_ids} with {len(predictions)} predictions")
 
-        # Map predictions to class names
-        class_names = {0: 'TUG', 1: 'FISHING', 2: 'PLEASURE', 3: 'CARGO'}
-        prediction_results = []
+    except Exception as e:
+        logger.error(f"Error processing chunk: {e}")
+        # Update job with error status
+        try:
+            job_ref = client.collection('jobs').document(job_id)
+            job_ref.update({'status': 'error', 'error': str(e)})
+        except Exception as firestore_error:
+            logger.error(f"Failed to update job status: {firestore_error}")
 
-        for i, (vessel_id, pred) in enumerate(zip(vessel_ids, predictions)):
-            result = {
-                'mmsi': vessel_id,
-                'prediction': int(pred),
-                'class_name': class_names.get(int(pred), 'UNKNOWN'),
-                'confidence': float(probabilities[i].max()) if probabilities is not None else 0.0
-            }
+    finally:
+        profiling.close()
 
-            if probabilities is not None:
-                result['class_probabilities'] = {
-                    class_names[j]: float(prob) for j, prob in enumerate(probabilities[i])
-                }
+@pubsub_fn.on_message_published(
+    topic='map-split',
+    memory=options.MemoryOption.GB_2,
+    timeout_sec=540,
+)
+def map_split(event: pubsub_fn.CloudEvent) -> None:
+    """Validates one byte range of a map-reduce upload and partitions its rows into reduce shards."""
+    from instrumentation import StageTimer
+    from mapreduce import REDUCE_TOPIC, partition_rows, read_split, split_rows, validation_increments, write_shard_files
+    from progress import complete_phase_task, task_pending
+    from storage_io import shared_bucket
+    from validation import RowValidator
 
-            prediction_results.append(result)
+    try:
+        message_data = json.loads(base64.b64decode(event.data.message.data).decode('utf-8'))
+        job_id = message_data['jobId']
+        split = message_data['split']
 
-        # Store results in Firestore
         client = firestore.client()
-        result_ref = client.collection('jobs').document(job_id).collection('results').document(str(chunk_id))
-        result_ref.set({
-            'predictions': prediction_results,
-            'chunk_size': len(data),
-            'processed_at': firestore.SERVER_TIMESTAMP
-        })
-
-        # Update job progress
         job_ref = client.collection('jobs').document(job_id)
-        job_ref.update({'processedChunks': firestore.Increment(1)})
+        if not task_pending(job_ref, 'map', split):
+            logger.info(f"Skipping already completed map task {split} of job {job_id}")
+            return
+
+        bucket = shared_bucket(message_data['bucket'])
+        timer = StageTimer(job_id, 'map')
 
-        os.remove(tmp_chunk_path)
-        logger.info(f"Successfully processed chunk {chunk_id} with {len(predictions)} predictions")
+        with timer.stage('download') as span:
+            data = read_split(
+                bucket.blob(message_data['fileName']), message_data['start'], message_data['end'],
+                message_data['fileSize']
+            )
+            span.bytes = len(data)
+
+        # Validate the range's rows like a whole upload, then partition them by MMSI
+        validator = RowValidator()
+        with timer.stage('readCsv', nbytes=len(data)) as span:
+            rows = split_rows(data, message_data['header'].encode('utf-8'), validator, split == 0)
+            span.rows = validator.rows
+        del data
+        with timer.stage('partition', rows=0 if rows is None else len(rows)):
+            parts = partition_rows(rows, message_data['shards'])
+        with timer.stage('shardUpload', rows=0 if rows is None else len(rows)) as span:
+            span.bytes = write_shard_files(bucket, job_id, split, parts)
+        logger.info(f"Map task {split} of job {job_id}: {validator.rows} rows into {len(parts)} shards")
+
+        job_update = validation_increments(validator.summary(), firestore.Increment)
+        quarantine = validator.quarantine_csv()
+        if quarantine is not None:
+            bucket.blob(f'quarantine/{job_id}/rejected-{split:05d}.csv').upload_from_string(
+                quarantine, content_type='text/csv'
+            )
+            job_update['validation.quarantinePath'] = f'quarantine/{job_id}/'
+        job_update.update(timer.increments('timings.map', firestore.Increment))
+
+        # The task that completes the map phase starts the reduce phase
+        _, last = complete_phase_task(client, job_ref, 'map', split, job_update, {'status': 'reducing'})
+        if last:
+            from fanout import publish_json, wait_for_publishes
+
+            topic_path = publisher.topic_path(os.environ.get('GCLOUD_PROJECT', 'demo-project'), REDUCE_TOPIC)
+            wait_for_publishes([
+                publish_json(publisher, topic_path, {
+                    'jobId': job_id,
+                    'bucket': message_data['bucket'],
+                    'shard': shard,
+                    'settings': message_data.get('settings') or {}
+                })
+                for shard in range(message_data['shards'])
+            ])
+            logger.info(f"Map phase of job {job_id} done, published {message_data['shards']} reduce tasks")
 
     except Exception as e:
-        logger.error(f"Error processing chunk: {e}")
-        # Update job with error status
+        logger.error(f"Error in map task: {e}")
         try:
-            client = firestore.client()
-            job_ref = client.collection('jobs').document(job_id)
-            job_ref.update({'status': 'error', 'error': str(e)})
+            firestore.client().collection('jobs').document(job_id).update({'status': 'error', 'error': str(e)})
+        except Exception as firestore_error:
+            logger.error(f"Failed to update job status: {firestore_error}")
+
+@pubsub_fn.on_message_published(
+    topic='reduce-shard',
+    memory=options.MemoryOption.GB_4,
+    timeout_sec=540,
+)
+def reduce_shard(event: pubsub_fn.CloudEvent) -> None:
+    """Featurizes the vessels of one reduce shard and publishes their feature chunks for classification."""
+    from downsample import TrackDownsampler, downsample_settings
+    from fanout import choose_chunk_size
+    from instrumentation import StageTimer
+    from mapreduce import delete_shard_files, load_shard_rows
+    from parallel import default_workers
+    from progress import complete_phase_task, task_pending
+    from storage_io import shared_bucket
+
+    try:
+        message_data = json.loads(base64.b64decode(event.data.message.data).decode('utf-8'))
+        job_id = message_data['jobId']
+        shard = message_data['shard']
+        settings = message_data.get('settings') or {}
+
+        client = firestore.client()
+        job_ref = client.collection('jobs').document(job_id)
+        if not task_pending(job_ref, 'reduce', shard):
+            logger.info(f"Skipping already completed reduce task {shard} of job {job_id}")
+            return
+
+        bucket = shared_bucket(message_data['bucket'])
+        timer = StageTimer(job_id, 'reduce')
+
+        # Every row of a vessel was partitioned into this shard, so its features are final
+        with timer.stage('shardDownload') as span:
+            rows = load_shard_rows(bucket, job_id, shard)
+            span.rows = 0 if rows is None else len(rows)
+
+        job_update = {}
+        chunk_slices = []
+        vessel_count = 0
+        if rows is not None:
+            downsampler = TrackDownsampler(None, *downsample_settings(settings))
+            if downsampler.enabled:
+                with timer.stage('downsample', rows=len(rows)):
+                    rows = downsampler.simplify(rows)
+                job_update.update({
+                    f'downsampling.{key}': firestore.Increment(value) if key in ('rows', 'keptRows', 'droppedRows')
+                    else value
+                    for key, value in downsampler.summary().items()
+                })
+
+            with timer.stage('featurize', rows=len(rows)):
+                vessel_features = preprocess_ais_data(rows, default_workers(settings))
+            del rows
+            vessel_count = len(vessel_features)
+
+            # Chunk IDs are unique across shards and the same on a redelivery
+            chunk_size = choose_chunk_size(vessel_count, settings)
+            chunk_slices = [
+                (f'{shard}-{number}', start, start + chunk_size, {})
+                for number, start in enumerate(range(0, vessel_count, chunk_size))
+            ]
+            publish_feature_chunks(bucket, job_id, vessel_features, chunk_slices, settings,
+                                   chunk_message_fields(settings), timer)
+        logger.info(f"Reduce task {shard} of job {job_id}: {vessel_count} vessels in {len(chunk_slices)} chunks")
+
+        job_update.update({
+            'chunkCount': firestore.Increment(len(chunk_slices)),
+            'vesselCount': firestore.Increment(vessel_count),
+            **timer.increments('timings.reduce', firestore.Increment)
+        })
+        # The task that completes the reduce phase lets on_job_update finish the job
+        new, last = complete_phase_task(client, job_ref, 'reduce', shard, job_update, {'status': 'processing'})
+        if new:
+            try:
+                delete_shard_files(bucket, job_id, shard)
+            except Exception as cleanup_error:
+                logger.warning(f"Could not delete map output of shard {shard}: {cleanup_error}")
+        if last and not job_ref.get().to_dict().get('chunkCount'):
+            raise ValueError("No valid vessel data found after preprocessing")
+
+    except Exception as e:
+        logger.error(f"Error in reduce task: {e}")
+        try:
+            firestore.client().collection('jobs').document(job_id).update({'status': 'error', 'error': str(e)})
         except Exception as firestore_error:
             logger.error(f"Failed to update job status: {firestore_error}")
 
@@ -494,7 +937,16 @@ def process_chunk(event: pubsub_fn.CloudEvent) -> None:
     cors_methods=["GET", "POST", "OPTIONS"]
 ))
 def get_job_results(req: https_fn.Request) -> https_fn.Response:
-    """Get the results of a completed job."""
+    """Get one page of the results of a job.
+
+    Optional arguments:
+        pageSize   predictions per page (default DEFAULT_RESULTS_PAGE_SIZE)
+        pageToken  nextPageToken from the previous page
+        classes    only return predictions with these class names
+        fields     only return these prediction keys
+    """
+    from results_store import PREDICTION_FIELDS, decode_result_doc, decode_result_page
+
     try:
         job_id = req.data.get('jobId')
         if not job_id:
@@ -503,6 +955,16 @@ def get_job_results(req: https_fn.Request) -> https_fn.Response:
                 message='jobId is required'
             )
 
+        page_size = int(req.data.get('pageSize') or DEFAULT_RESULTS_PAGE_SIZE)
+        page_size = max(1, min(page_size, MAX_RESULTS_PAGE_SIZE))
+        classes = set(req.data['classes']) if req.data.get('classes') else None
+        fields = set(req.data['fields']) if req.data.get('fields') else None
+        if fields is not None and not fields <= set(PREDICTION_FIELDS):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f'fields must be a subset of {PREDICTION_FIELDS}'
+            )
+
         client = firestore.client()
 
         # Get job info
@@ -517,31 +979,67 @@ def get_job_results(req: https_fn.Request) -> https_fn.Response:
 
         job_data = job_doc.to_dict()
 
-        # Get all results
-        results_ref = job_ref.collection('results')
-        results_docs = results_ref.stream()
-
-        all_predictions = []
-        for doc in results_docs:
-            chunk_results = doc.to_dict()
-            if 'predictions' in chunk_results:
-                all_predictions.extend(chunk_results['predictions'])
-
-        # Aggregate statistics
-        class_counts = {}
-        total_vessels = len(all_predictions)
-
-        for pred in all_predictions:
-            class_name = pred.get('class_name', 'UNKNOWN')
-            class_counts[class_name] = class_counts.get(class_name, 0) + 1
+        # Jobs answered from the result cache read the original job's results,
+        # and drops of a rolling job read the rolling job's current results
+        results_job_id = job_data.get('resultsJobId', job_id)
+        results_job_ref = client.collection('jobs').document(results_job_id)
+        results_ref = results_job_ref.collection('results')
+
+        # Summary maintained by process_chunk; older jobs fall back to a scan
+        class_counts = job_data.get('classificationSummary')
+        if class_counts is None and results_job_id != job_id:
+            class_counts = (results_job_ref.get().to_dict() or {}).get('classificationSummary')
+        if class_counts is None:
+            class_counts = {}
+            for doc in results_ref.stream():
+                for pred in decode_result_doc(doc.to_dict()):
+                    class_name = pred.get('class_name', 'UNKNOWN')
+                    class_counts[class_name] = class_counts.get(class_name, 0) + 1
+
+        # Page through result documents in document ID order from the cursor
+        cursor_doc, cursor_row = None, 0
+        page_token = req.data.get('pageToken')
+        if page_token:
+            cursor_doc, _, row = page_token.rpartition(':')
+            cursor_row = int(row)
+
+        predictions = []
+        next_page_token = None
+        query = results_ref.order_by(FieldPath.document_id())
+        if cursor_doc:
+            query = query.start_at({FieldPath.document_id(): results_ref.document(cursor_doc)})
+
+        last_doc = None
+        while next_page_token is None:
+            batch_query = query if last_doc is None else query.start_after(last_doc)
+            docs = list(batch_query.limit(RESULTS_DOCS_PER_READ).stream())
+            if not docs:
+                break
+            for doc in docs:
+                start_row = cursor_row if doc.id == cursor_doc else 0
+                chunk_results = doc.to_dict()
+                if classes is not None and 'classCounts' in chunk_results \
+                        and not any(chunk_results['classCounts'].get(name) for name in classes):
+                    continue
+                page, next_row = decode_result_page(
+                    chunk_results, start_row, page_size - len(predictions), classes, fields
+                )
+                predictions.extend(page)
+                if next_row is not None:
+                    next_page_token = f'{doc.id}:{next_row}'
+                    break
+            last_doc = docs[-1]
+            if len(docs) < RESULTS_DOCS_PER_READ:
+                break
 
         response_data = {
             'jobId': job_id,
             'status': job_data.get('status'),
             'fileName': job_data.get('fileName'),
-            'vesselCount': total_vessels,
+            'vesselCount': sum(class_counts.values()),
             'classificationSummary': class_counts,
-            'predictions': all_predictions,
+            'predictions': predictions,
+            'nextPageToken': next_page_token,
             'createdAt': job_data.get('createdAt'),
             'completedAt': job_data.get('completedAt')
         }
@@ -557,20 +1055,102 @@ def get_job_results(req: https_fn.Request) -> https_fn.Response:
             message=f'Error retrieving results: {str(e)}'
         )
 
-@firestore_fn.on_document_updated('jobs/{jobId}')
+@https_fn.on_call(cors=options.CorsOptions(
+    cors_origins=["http://localhost:3000", "https://localhost:3000"],
+    cors_methods=["GET", "POST", "OPTIONS"]
+))
+def get_vessel_history(req: https_fn.Request) -> https_fn.Response:
+    """Get the classification history of one or more vessels across jobs.
+
+    Arguments:
+        mmsi   one MMSI or a list of up to MAX_HISTORY_VESSELS
+        since  optional ISO 8601 start of the time range (inclusive)
+        until  optional ISO 8601 end of the time range (exclusive)
+        limit  entries per vessel, newest first (default DEFAULT_HISTORY_LIMIT)
+    """
+    from datetime import datetime, timezone
+    from vessel_index import DEFAULT_HISTORY_LIMIT, MAX_HISTORY_LIMIT, MAX_HISTORY_VESSELS, vessel_history
+
+    def parse_time(value):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    try:
+        mmsi = req.data.get('mmsi')
+        mmsi_list = mmsi if isinstance(mmsi, list) else [mmsi] if mmsi is not None else []
+        try:
+            mmsi_list = [int(value) for value in mmsi_list]
+            since = parse_time(req.data['since']) if req.data.get('since') else None
+            until = parse_time(req.data['until']) if req.data.get('until') else None
+        except (TypeError, ValueError) as e:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f'Invalid argument: {e}'
+            )
+        if not mmsi_list or len(mmsi_list) > MAX_HISTORY_VESSELS:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f'mmsi must be one MMSI or a list of 1 to {MAX_HISTORY_VESSELS}'
+            )
+
+        limit = int(req.data.get('limit') or DEFAULT_HISTORY_LIMIT)
+        limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+
+        history = vessel_history(firestore.client(), mmsi_list, since, until, limit)
+        return https_fn.Response({'vessels': {str(key): entries for key, entries in history.items()}})
+
+    except https_fn.HttpsError:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting vessel history: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INTERNAL,
+            message=f'Error retrieving vessel history: {str(e)}'
+        )
+
+@firestore_fn.on_document_updated(document='jobs/{jobId}')
 def on_job_update(event: firestore_fn.Change) -> None:
     """Finalizes the job when all chunks are processed."""
     job_data_after = event.after.to_dict()
+    job_data_before = event.before.to_dict() if event.before else {}
 
     processed_chunks = job_data_after.get('processedChunks', 0)
     chunk_count = job_data_after.get('chunkCount', -1)
 
     logger.info(f"Job update: {processed_chunks}/{chunk_count} chunks processed")
 
-    if chunk_count > 0 and processed_chunks == chunk_count:
-        job_ref = event.after.reference
-        job_ref.update({
-            'status': 'completed',
-            'completedAt': firestore.SERVER_TIMESTAMP
-        })
-        logger.info(f"Job {job_ref.id} completed successfully")
\ No newline at end of file
+    # The chunk that finishes last completes the job; chunks that all finished before
+    # the job entered 'processing' with its final chunk count are caught here
+    if job_data_after.get('status') == 'processing' and chunk_count > 0 \
+            and (job_data_before.get('status') != 'processing' or job_data_before.get('chunkCount') != chunk_count):
+        from progress import update_job_progress
+
+        update_job_progress(firestore.client(), event.after.reference)
+
+    # Remember the results of a freshly completed upload for identical re-uploads
+    fingerprint = job_data_after.get('fileFingerprint')
+    if job_data_after.get('status') == 'completed' and job_data_before.get('status') != 'completed' \
+            and fingerprint and not job_data_after.get('resultsJobId'):
+        from result_cache import ResultCache
+
+        try:
+            ResultCache(
+                firestore.client(), job_data_after.get('modelVersion'), job_data_after.get('featureVersion')
+            ).remember_file(fingerprint, event.after.reference.id)
+        except Exception as e:
+            logger.warning(f"Could not cache results of job {event.after.reference.id}: {e}")
+
+@scheduler_fn.on_schedule(schedule='every 24 hours')
+def evict_result_cache(event: scheduler_fn.ScheduledEvent) -> None:
+    """Drops expired and least recently used result cache entries."""
+    from result_cache import (
+        FILE_CACHE_COLLECTION,
+        MAX_FILE_CACHE_ENTRIES,
+        MAX_TRACK_CACHE_ENTRIES,
+        TRACK_CACHE_COLLECTION,
+        evict_lru,
+    )
+
+    client = firestore.client()
+    evict_lru(client, FILE_CACHE_COLLECTION, MAX_FILE_CACHE_ENTRIES)
+    evict_lru(client, TRACK_CACHE_COLLECTION, MAX_TRACK_CACHE_ENTRIES)
\ No newline at end of file
@@ -0,0 +1,197 @@
+# mapreduce.py
+
+"""Map-reduce ingestion of uploads too large for one function instance.
+
+In map-reduce mode on_file_upload only reads the CSV header and cuts the
+file into byte ranges of ``MAP_SPLIT_BYTES``. Each range becomes a message
+on ``MAP_TOPIC``:
+
+  map     download the range (plus the tail of its last line) in parallel
+          byte ranges, validate the rows and hash-partition them by MMSI
+          into one Parquet file per reduce shard,
+          ``mapreduce/{jobId}/shards/{shard}/{split}.parquet``
+  reduce  once every map task is done, one message per shard on
+          ``REDUCE_TOPIC``: load the shard's files, featurize its vessels
+          (every row of a vessel is in the same shard) and publish feature
+          chunks to ``process-chunk`` like the upload trigger does
+
+A line belongs to the range holding its first byte, so ranges can be cut
+anywhere without splitting rows. Both phases count their tasks under the
+job's ``phases`` field with exactly-once completion markers (see
+``progress.complete_phase_task``); the last map task publishes the reduce
+tasks and the last reduce task moves the job on to 'processing'. File size
+is then bounded by the number of instances, not by one function's memory
+and timeout.
+"""
+
+import io
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ingest import INGEST_CHUNK_ROWS, read_ais_chunks, strict_read_errors
+from storage_io import open_ranged
+from validation import VALIDATION_RULES, check_required_columns
+
+logger = logging.getLogger(__name__)
+
+MAP_TOPIC = 'map-split'
+REDUCE_TOPIC = 'reduce-shard'
+
+# Uploads larger than this use map-reduce unless the ``mapReduce`` setting says otherwise
+MAP_REDUCE_THRESHOLD_BYTES = 2 * 1024 ** 3
+
+# CSV bytes per map task
+MAP_SPLIT_BYTES = 128 * 1024 ** 2
+
+# CSV bytes per reduce shard, and the shard count limit
+REDUCE_SHARD_BYTES = 512 * 1024 ** 2
+MAX_REDUCE_SHARDS = 512
+
+# Longest CSV line a map task reads past the end of its range
+MAX_LINE_BYTES = 64 * 1024
+
+# Concurrent shard file uploads and downloads
+SHARD_IO_THREADS = 16
+
+# MMSIs are salted before hashing into reduce shards, so the hash differs from the one
+# of ``parallel.shard_assignments`` and a reduce shard still spreads over all pool workers
+REDUCE_HASH_SALT = 0x5EED_F00D_0BAD_CAFE
+
+
+def map_reduce_enabled(settings, file_size):
+    """Whether an upload is ingested by map-reduce (``mapReduce`` on/off, by size otherwise)."""
+    mode = str((settings or {}).get('mapReduce', 'auto')).lower()
+    if mode in ('on', 'true', 'yes', '1'):
+        return True
+    if mode in ('off', 'false', 'no', '0'):
+        return False
+    return file_size > MAP_REDUCE_THRESHOLD_BYTES
+
+
+def split_ranges(file_size, split_bytes=MAP_SPLIT_BYTES):
+    """``(start, end)`` byte ranges covering a file of ``file_size`` bytes."""
+    return [(start, min(start + split_bytes, file_size)) for start in range(0, file_size, split_bytes)]
+
+
+def reduce_shard_count(file_size, settings=None):
+    """Reduce shards for a file, from the ``reduceShards`` setting or ``REDUCE_SHARD_BYTES``."""
+    shards = (settings or {}).get('reduceShards') or math.ceil(file_size / REDUCE_SHARD_BYTES)
+    return max(1, min(int(shards), MAX_REDUCE_SHARDS))
+
+
+def read_header(blob):
+    """Header line of the CSV in ``blob``; raises ValueError if a required column is missing."""
+    head = blob.download_as_bytes(start=0, end=MAX_LINE_BYTES - 1)
+    header = head.split(b'\n', 1)[0].rstrip(b'\r')
+    check_required_columns([col.strip() for col in header.decode('utf-8-sig').split(',')])
+    return header
+
+
+def read_split(blob, start, end, file_size):
+    """Bytes of the whole lines starting in ``[start, end)`` of the CSV in ``blob``."""
+    low = max(start - 1, 0)
+    high = min(end + MAX_LINE_BYTES, file_size)
+    with open_ranged(blob, high, start=low) as f:
+        data = f.read()
+
+    # The first line owned by the range starts after the first newline at or after start - 1
+    first = 0 if start == 0 else data.find(b'\n') + 1
+    if start > 0 and (first == 0 or low + first >= end):
+        return b''
+    if end >= file_size:
+        return data[first:]
+    # The last one ends at the first newline at or after end - 1
+    last = data.find(b'\n', end - 1 - low)
+    if last < 0:
+        if high < file_size:
+            raise ValueError(f"Line at byte {end} is longer than {MAX_LINE_BYTES} bytes")
+        return data[first:]
+    return data[first:last + 1]
+
+
+def split_rows(data, header, validate, first_split):
+    """Validated rows of one range's lines, read tolerantly only if their CSV structure is malformed."""
+    body = data if first_split else header + b'\n' + data
+
+    def read(strict):
+        frames = list(read_ais_chunks(lambda: io.BytesIO(body), INGEST_CHUNK_ROWS, validate, strict))
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0] if frames else None
+
+    try:
+        return read(strict=True)
+    except strict_read_errors() as e:
+        logger.warning(f"Malformed CSV in split, reading it again with the tolerant reader: {e}")
+        if hasattr(validate, 'reset'):
+            validate.reset()
+        return read(strict=False)
+
+
+def reduce_shards(mmsi, shards):
+    """Reduce shard of each MMSI."""
+    hashes = pd.util.hash_array(np.asarray(mmsi, dtype=np.int64) ^ np.int64(REDUCE_HASH_SALT))
+    return (hashes % np.uint64(shards)).astype(np.int64)
+
+
+def partition_rows(rows, shards):
+    """Split ``rows`` by the reduce shard of their MMSI into ``{shard: rows}``."""
+    if rows is None or rows.empty:
+        return {}
+    shard = reduce_shards(rows['mmsi'].to_numpy(), shards)
+    order = np.argsort(shard, kind='stable')
+    shard = shard[order]
+    bounds = np.flatnonzero(np.r_[True, shard[1:] != shard[:-1], True])
+    return {
+        int(shard[begin]): rows.iloc[order[begin:end]]
+        for begin, end in zip(bounds[:-1], bounds[1:])
+    }
+
+
+def shard_prefix(job_id, shard):
+    """Storage prefix of one reduce shard's files."""
+    return f'mapreduce/{job_id}/shards/{shard:04d}/'
+
+
+def write_shard_files(bucket, job_id, split, parts):
+    """Upload each shard's rows of one map task as Parquet; returns the bytes written."""
+    def upload(item):
+        shard, rows = item
+        payload = rows.to_parquet(index=False)
+        bucket.blob(f'{shard_prefix(job_id, shard)}{split:05d}.parquet').upload_from_string(
+            payload, content_type='application/vnd.apache.parquet'
+        )
+        return len(payload)
+
+    with ThreadPoolExecutor(SHARD_IO_THREADS) as pool:
+        return sum(pool.map(upload, parts.items()))
+
+
+def load_shard_rows(bucket, job_id, shard):
+    """All rows the map tasks wrote for one shard, or None if there are none."""
+    blobs = list(bucket.list_blobs(prefix=shard_prefix(job_id, shard)))
+    if not blobs:
+        return None
+    with ThreadPoolExecutor(min(SHARD_IO_THREADS, len(blobs))) as pool:
+        frames = list(pool.map(lambda blob: pd.read_parquet(io.BytesIO(blob.download_as_bytes())), blobs))
+    return pd.concat(frames, ignore_index=True)
+
+
+def delete_shard_files(bucket, job_id, shard):
+    """Remove one shard's map output once the shard is reduced."""
+    for blob in bucket.list_blobs(prefix=shard_prefix(job_id, shard)):
+        blob.delete()
+
+
+def validation_increments(summary, increment):
+    """Job document increments adding one map task's validation summary."""
+    update = {
+        'validation.rows': increment(summary['rows']),
+        'validation.rejectedRows': increment(summary['rejectedRows']),
+        'validation.quarantinedRows': increment(summary['quarantinedRows']),
+    }
+    for rule in VALIDATION_RULES:
+        update[f'validation.ruleCounts.{rule}'] = increment(summary['ruleCounts'].get(rule, 0))
+    return update
@@ -0,0 +1,185 @@
+# model_store.py
+
+"""Loading and caching of the vessel classification model.
+
+The model artifact is loaded once per instance. The cache is keyed by the
+artifact's SHA-256, so a redeployed or replaced model invalidates the cached
+one, and the hash doubles as the model version recorded with results.
+
+Loading is not memory-mapped by default: a scikit-learn forest copies its
+node arrays into its trees while unpickling, so ``mmap_mode='r'`` gives no
+faster cold start (benchmarks/bench_model_load.py). An uncompressed artifact
+(``convert_model``) does load about twice as fast as a compressed one.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'extreme_maritime_classifier.joblib')
+
+# Set to load and warm the model when a process_chunk instance starts
+EAGER_LOAD_ENV = 'VESLINT_EAGER_MODEL_LOAD'
+
+# Expected feature columns based on the training notebook
+EXPECTED_FEATURES = [
+    'lat_mean', 'lon_mean', 'sog_mean', 'cog_mean', 'heading_mean',
+    'lat_std', 'lon_std', 'sog_std', 'cog_std', 'heading_std',
+    'lat_min', 'lon_min', 'sog_min', 'cog_min', 'heading_min',
+    'lat_max', 'lon_max', 'sog_max', 'cog_max', 'heading_max',
+    'lat_range', 'lon_range', 'sog_range', 'cog_range', 'heading_range',
+    'total_distance', 'avg_speed', 'max_speed', 'time_span_hours',
+    'num_points', 'avg_time_between_points', 'speed_changes',
+    'direction_changes', 'stops_count', 'moving_time_ratio',
+    'stationary_time_ratio', 'acceleration_mean', 'acceleration_std',
+    'turn_rate_mean', 'turn_rate_std', 'distance_from_shore_mean',
+    'distance_from_shore_min', 'in_port_ratio', 'night_activity_ratio',
+    'weekend_activity_ratio', 'speed_consistency', 'course_consistency',
+    'zigzag_factor', 'circular_variance', 'linearity_index'
+]
+
+# Model version reported when the dummy classifier is in use
+DUMMY_MODEL_VERSION = 'dummy'
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Return the hex SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert_model(src_path, dst_path):
+    """Re-save a model artifact uncompressed, which skips decompression on load.
+
+    Compressed joblib files are always decompressed into memory, so
+    ``mmap_mode`` has no effect on them either.
+    """
+    import joblib
+
+    joblib.dump(joblib.load(src_path), dst_path, compress=0)
+    return file_sha256(dst_path)
+
+
+def _make_dummy_model(n_features):
+    """Constant TUG classifier used when no model artifact can be loaded."""
+    import numpy as np
+    from sklearn.dummy import DummyClassifier
+
+    dummy = DummyClassifier(strategy='constant', constant=0)
+    # 4 classes: TUG, FISHING, PLEASURE, CARGO
+    dummy.fit(np.zeros((4, n_features)), np.array([0, 1, 2, 3]))
+    return dummy
+
+
+class ModelCache:
+    """Process-wide cache of the loaded model, invalidated by content hash."""
+
+    def __init__(self, path=MODEL_PATH, default_features=EXPECTED_FEATURES, mmap_mode=None):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.default_features = default_features
+        self.model = None
+        self.feature_columns = None
+        self.version = None
+        self._stat = None
+        self._hashed = (None, None)
+        self._lock = threading.Lock()
+
+    def _current_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def get(self):
+        """Return ``(model, feature_columns, version)``, reloading if the artifact changed."""
+        stat = self._current_stat()
+        if self.model is not None and stat == self._stat:
+            return self.model, self.feature_columns, self.version
+
+        with self._lock:
+            stat = self._current_stat()
+            if self.model is None or stat != self._stat:
+                self._load(stat)
+        return self.model, self.feature_columns, self.version
+
+    def artifact_version(self):
+        """Return the version of the artifact on disk without loading it."""
+        stat = self._current_stat()
+        if stat is None:
+            return DUMMY_MODEL_VERSION
+        if self.version is not None and stat == self._stat:
+            return self.version
+        if self._hashed[0] != stat:
+            self._hashed = (stat, file_sha256(self.path))
+        return self._hashed[1]
+
+    def _load(self, stat):
+        if stat is None:
+            if self.version != DUMMY_MODEL_VERSION:
+                logger.warning(f"Model file not found at {self.path}, using dummy classifier")
+                self.model = _make_dummy_model(len(self.default_features))
+                self.feature_columns = self.default_features
+                self.version = DUMMY_MODEL_VERSION
+            self._stat = stat
+            return
+
+        version = file_sha256(self.path)
+        if version == self.version:
+            # Touched but unchanged artifact
+            self._stat = stat
+            return
+
+        try:
+            import joblib
+
+            logger.info(f"Loading model {version[:12]} from {self.path}")
+            model_data = joblib.load(self.path, mmap_mode=self.mmap_mode)
+
+            # Handle different model storage formats
+            if isinstance(model_data, dict):
+                self.model = model_data.get('model')
+                self.feature_columns = model_data.get('feature_columns', self.default_features)
+            else:
+                self.model = model_data
+                self.feature_columns = self.default_features
+            self.version = version
+            logger.info(f"Model loaded successfully, expected features: {len(self.feature_columns)}")
+        except Exception as e:
+            logger.error(f"Could not load model: {e}")
+            self.model = _make_dummy_model(len(self.default_features))
+            self.feature_columns = self.default_features
+            self.version = DUMMY_MODEL_VERSION
+        self._stat = stat
+
+    def warm_up(self):
+        """Load the model and run one prediction so the first chunk pays neither."""
+        import numpy as np
+
+        start = time.perf_counter()
+        try:
+            current_model, feature_columns, version = self.get()
+            current_model.predict_proba(np.zeros((1, len(feature_columns))))
+            logger.info(f"Model {version[:12]} warmed up in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {e}")
+
+
+model_cache = ModelCache()
+
+
+def start_eager_warm_up():
+    """Warm the model in a background thread if ``EAGER_LOAD_ENV`` is set."""
+    if os.environ.get(EAGER_LOAD_ENV, '').lower() not in ('1', 'true', 'yes'):
+        return None
+    thread = threading.Thread(target=model_cache.warm_up, name='model-warm-up', daemon=True)
+    thread.start()
+    return thread
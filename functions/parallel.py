@@ -0,0 +1,149 @@
+# parallel.py
+
+"""Multi-core feature extraction on a process pool.
+
+Rows are hash-partitioned by MMSI into one shard per worker, so every
+vessel's track lands whole in a single shard. The parent copies the columns
+the feature engine needs into one shared-memory block, laid out shard by
+shard; each worker maps its slice of that block as NumPy arrays (no pickled
+DataFrames), runs ``compute_vessel_features`` on it and returns only the
+per-vessel feature rows. Results are concatenated in shard order and sorted
+by MMSI, so the output is identical to a single-process run.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from features import KINEMATIC_COLUMNS, MIN_POINTS_PER_VESSEL, column_values, compute_vessel_features, timestamps_to_ns
+
+logger = logging.getLogger(__name__)
+
+# Below this many rows the pool overhead outweighs the speedup
+PARALLEL_MIN_ROWS = 200_000
+
+# Workers start from a clean server process rather than forking a parent
+# that holds gRPC/Pub/Sub threads
+POOL_START_METHOD = 'forkserver'
+
+# Fresh pools tried after a worker dies, before featurizing in-process
+POOL_RETRIES = 1
+
+_pool = None
+_pool_workers = 0
+
+
+def available_cpus():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(settings=None):
+    """Worker count from the ``featureWorkers`` job setting, else the available CPUs."""
+    workers = (settings or {}).get('featureWorkers')
+    return max(1, int(workers)) if workers else available_cpus()
+
+
+def _get_pool(workers):
+    """Process pool reused across invocations of a warm instance."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        context = get_context(POOL_START_METHOD)
+        if POOL_START_METHOD == 'forkserver':
+            context.set_forkserver_preload(['features'])
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _pool_workers = workers
+    return _pool
+
+
+def _discard_pool():
+    """Drop the cached pool, e.g. after a worker died and broke it."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool, _pool_workers = None, 0
+
+
+def shard_assignments(mmsi, shards):
+    """Shard number of each row, a stable hash of its MMSI."""
+    return (pd.util.hash_array(np.asarray(mmsi)) % np.uint64(shards)).astype(np.int64)
+
+
+def _shard_features(shm_name, layout, start, end, min_points):
+    """Worker: featurize rows ``start:end`` of the shared column block."""
+    shm = SharedMemory(name=shm_name)
+    try:
+        columns = {
+            col: np.ndarray((end - start,), dtype=dtype, buffer=shm.buf, offset=offset + start * np.dtype(dtype).itemsize)
+            for col, (offset, dtype) in layout.items()
+        }
+        columns['timestamp'] = columns['timestamp'].view('datetime64[ns]')
+        features = compute_vessel_features(pd.DataFrame(columns, copy=False), min_points)
+        del columns
+        return features
+    finally:
+        shm.close()
+
+
+def parallel_vessel_features(df, workers=None, min_points=MIN_POINTS_PER_VESSEL):
+    """``compute_vessel_features`` on ``workers`` processes (default: available CPUs)."""
+    workers = workers or available_cpus()
+    if workers <= 1 or len(df) < PARALLEL_MIN_ROWS:
+        return compute_vessel_features(df, min_points)
+
+    mmsi = df['mmsi'].to_numpy()
+    shard = shard_assignments(mmsi, workers)
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(workers + 1))
+
+    arrays = {'mmsi': mmsi, 'timestamp': timestamps_to_ns(df['timestamp'])}
+    for col in KINEMATIC_COLUMNS:
+        arrays[col] = column_values(df[col])
+
+    layout, offset = {}, 0
+    for col, values in arrays.items():
+        layout[col] = (offset, values.dtype.str)
+        offset += values.nbytes
+
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for col, values in arrays.items():
+            start, dtype = layout[col]
+            np.ndarray(values.shape, dtype=dtype, buffer=shm.buf, offset=start)[:] = values[order]
+        del arrays
+
+        shard_features = None
+        for attempt in range(POOL_RETRIES + 1):
+            try:
+                pool = _get_pool(workers)
+                futures = [
+                    pool.submit(_shard_features, shm.name, layout, int(bounds[i]), int(bounds[i + 1]), min_points)
+                    for i in range(workers) if bounds[i + 1] > bounds[i]
+                ]
+                shard_features = [future.result() for future in futures]
+                break
+            except BrokenProcessPool as e:
+                # A dead worker breaks the pool for good; never hand it to a later upload
+                logger.warning(f"Feature worker pool broke on attempt {attempt + 1}: {e}")
+                _discard_pool()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if shard_features is None:
+        logger.warning(f"Featurizing {len(df)} rows in-process after the worker pool broke")
+        return compute_vessel_features(df, min_points)
+
+    logger.info(f"Featurized {len(df)} rows in {len(shard_features)} shards on {workers} workers")
+    features = pd.concat(shard_features, ignore_index=True)
+    return features.sort_values('mmsi', kind='stable').reset_index(drop=True)
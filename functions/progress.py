@@ -0,0 +1,263 @@
+# progress.py
+
+"""Exactly-once chunk progress accounting for at-least-once Pub/Sub delivery.
+
+Every chunk gets a completion marker ``jobs/{jobId}/chunkStatus/{chunkId}``.
+The marker is created in the same Firestore transaction that adds the
+chunk's progress and class counts to one of ``PROGRESS_SHARDS`` counter
+documents ``jobs/{jobId}/progressShards/{shard}``, and only if it did not
+exist yet. A redelivered or concurrently retried message therefore never
+counts a chunk twice. process_chunk also reads the markers before any work
+(``pending_chunks``), so a redelivery of finished chunks is acknowledged
+without downloading or classifying anything.
+
+Chunks never write the job document itself, which would cap a job at about
+one chunk per second and fire on_job_update for every chunk. After each
+completion ``update_job_progress`` counts the markers: the chunk that
+finds all of them present sums the shards into the job and completes it,
+and otherwise the job's ``processedChunks`` is only advanced at every
+``1 / PROGRESS_MILESTONES`` of the chunks. on_job_update runs the same
+check when a job enters 'processing', for jobs whose chunks all finished
+before their chunk count was known.
+
+Result documents have deterministic IDs, so rewriting them on a retry that
+raced the first delivery is harmless.
+
+Map and reduce tasks of a map-reduce upload are counted the same way, with
+markers in ``jobs/{jobId}/mapStatus`` and ``jobs/{jobId}/reduceStatus`` and
+their progress under the job's ``phases.{phase}``.
+"""
+
+import logging
+import math
+import random
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STATUS_COLLECTION = 'chunkStatus'
+PROGRESS_COLLECTION = 'progressShards'
+
+# Counter documents a job's chunk progress is spread over
+PROGRESS_SHARDS = 16
+
+# Times the job document's processedChunks is advanced while chunks are processed
+PROGRESS_MILESTONES = 20
+
+# Statuses after which chunk progress no longer changes the job
+FINAL_STATUSES = ('completed', 'error')
+
+
+def chunk_status_ref(job_ref, chunk_id):
+    """Completion marker document of a chunk."""
+    return job_ref.collection(CHUNK_STATUS_COLLECTION).document(str(chunk_id))
+
+
+def progress_shard_ref(job_ref, shard):
+    """Counter document of one progress shard."""
+    return job_ref.collection(PROGRESS_COLLECTION).document(str(shard))
+
+
+def _nested(update):
+    """``{'a.b': v}`` field paths as the nested maps ``set(merge=True)`` takes."""
+    nested = {}
+    for path, value in update.items():
+        *parents, key = path.split('.')
+        node = nested
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return nested
+
+
+def _add(total, values):
+    """Add the numbers of nested map ``values`` into ``total``."""
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def _increments(prefix, values, increment):
+    """Field path increments adding the numbers of nested map ``values`` under ``prefix``."""
+    update = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            update.update(_increments(f'{prefix}.{key}', value, increment))
+        else:
+            update[f'{prefix}.{key}'] = increment(value)
+    return update
+
+
+def pending_chunks(client, job_ref, chunk_ids):
+    """The IDs in ``chunk_ids`` whose chunks are not marked complete yet."""
+    refs = [chunk_status_ref(job_ref, chunk_id) for chunk_id in chunk_ids]
+    done = {snapshot.id for snapshot in client.get_all(refs) if snapshot.exists}
+    return [chunk_id for chunk_id in chunk_ids if str(chunk_id) not in done]
+
+
+def complete_chunks(client, job_ref, chunk_results, counter_update=None):
+    """Mark chunks complete and count them in a progress shard, exactly once each.
+
+    ``chunk_results`` maps chunk ID to ``(classified_vessels, class_counts)``.
+    Chunks already marked are skipped; ``counter_update`` (field path
+    increments, e.g. timings) is added to the shard only if at least one
+    chunk was new. Returns the list of newly completed chunk IDs.
+    """
+    from firebase_admin import firestore
+    from google.cloud import firestore as cloud_firestore
+
+    shard_ref = progress_shard_ref(job_ref, random.randrange(PROGRESS_SHARDS))
+
+    @cloud_firestore.transactional
+    def complete(transaction):
+        refs = {chunk_id: chunk_status_ref(job_ref, chunk_id) for chunk_id in chunk_results}
+        done = {snapshot.id for snapshot in client.get_all(list(refs.values()), transaction=transaction)
+                if snapshot.exists}
+        new = [chunk_id for chunk_id in chunk_results if str(chunk_id) not in done]
+        if not new:
+            return new
+
+        classified, summary = 0, {}
+        for chunk_id in new:
+            vessels, class_counts = chunk_results[chunk_id]
+            classified += vessels
+            for class_name, count in class_counts.items():
+                summary[class_name] = summary.get(class_name, 0) + count
+            transaction.set(refs[chunk_id], {
+                'chunkId': chunk_id,
+                'classifiedVessels': vessels,
+                'completedAt': firestore.SERVER_TIMESTAMP
+            })
+
+        transaction.set(shard_ref, _nested({
+            'processedChunks': firestore.Increment(len(new)),
+            'classifiedVessels': firestore.Increment(classified),
+            **{
+                f'classificationSummary.{class_name}': firestore.Increment(count)
+                for class_name, count in summary.items()
+            },
+            **(counter_update or {})
+        }), merge=True)
+        return new
+
+    new = complete(client.transaction())
+    if len(new) < len(chunk_results):
+        logger.info(f"Chunks {sorted(set(chunk_results) - set(new))} of job {job_ref.id} were already complete")
+    return new
+
+
+def completed_chunk_count(job_ref):
+    """Number of chunks with a completion marker, by aggregation query."""
+    return job_ref.collection(CHUNK_STATUS_COLLECTION).count().get()[0][0].value
+
+
+def progress_totals(job_ref):
+    """Sum of all progress shards of a job, as one nested map."""
+    totals = {}
+    for snapshot in job_ref.collection(PROGRESS_COLLECTION).stream():
+        _add(totals, snapshot.to_dict() or {})
+    return totals
+
+
+def update_job_progress(client, job_ref):
+    """Complete the job once every chunk is marked, else advance processedChunks at milestones.
+
+    Completing adds the progress shards' totals to the job document in the
+    transaction that sets its status, so they are added exactly once.
+    Returns whether this call completed the job.
+    """
+    from firebase_admin import firestore
+    from google.cloud import firestore as cloud_firestore
+    from model_store import DUMMY_MODEL_VERSION
+
+    job = job_ref.get().to_dict() or {}
+    chunk_count = job.get('chunkCount') or 0
+    if chunk_count <= 0 or job.get('status') in FINAL_STATUSES:
+        return False
+    done = completed_chunk_count(job_ref)
+
+    # Map-reduce jobs still add chunks until the reduce phase is done
+    finished = done >= chunk_count and job.get('status') == 'processing'
+    step = math.ceil(chunk_count / PROGRESS_MILESTONES)
+    if not finished and done // step <= job.get('processedChunks', 0) // step:
+        return False
+    totals = progress_totals(job_ref) if finished else {}
+
+    # A job with any chunk classified by the dummy fallback is not a result of its model
+    # version, so the result cache never serves it for that version
+    fallback_update = {'modelVersion': DUMMY_MODEL_VERSION} if totals.get('fallbackChunks') else {}
+
+    @cloud_firestore.transactional
+    def advance(transaction):
+        current = job_ref.get(transaction=transaction).to_dict() or {}
+        if current.get('status') in FINAL_STATUSES:
+            return False
+        if not (finished and current.get('status') == 'processing' and done >= current.get('chunkCount', 0)):
+            # Never move processedChunks back for a milestone that raced a later one
+            if current.get('processedChunks', 0) < done:
+                transaction.update(job_ref, {'processedChunks': done})
+            return False
+        transaction.update(job_ref, {
+            **fallback_update,
+            'status': 'completed',
+            'completedAt': firestore.SERVER_TIMESTAMP,
+            'processedChunks': done,
+            'classifiedVessels': firestore.Increment(totals.get('classifiedVessels', 0)),
+            **_increments('classificationSummary', totals.get('classificationSummary', {}), firestore.Increment),
+            **_increments('timings', totals.get('timings', {}), firestore.Increment),
+        })
+        return True
+
+    completed = advance(client.transaction())
+    if completed:
+        logger.info(f"Job {job_ref.id} completed with all {done} chunks")
+    return completed
+
+
+def phase_status_ref(job_ref, phase, task_id):
+    """Completion marker document of a map or reduce task."""
+    return job_ref.collection(f'{phase}Status').document(str(task_id))
+
+
+def phase_progress(tasks):
+    """Initial ``phases`` field of a map-reduce job with ``{phase: task_count}``."""
+    return {phase: {'tasks': count, 'done': 0} for phase, count in tasks.items()}
+
+
+def task_pending(job_ref, phase, task_id):
+    """Whether a map or reduce task is not marked complete yet."""
+    return not phase_status_ref(job_ref, phase, task_id).get().exists
+
+
+def complete_phase_task(client, job_ref, phase, task_id, job_update=None, phase_update=None):
+    """Mark a map or reduce task complete and count it in ``phases.{phase}``, exactly once.
+
+    ``job_update`` is applied together with the marker, ``phase_update`` as
+    well when this task was the phase's last. Returns ``(new, last)``.
+    """
+    from firebase_admin import firestore
+    from google.cloud import firestore as cloud_firestore
+
+    @cloud_firestore.transactional
+    def complete(transaction):
+        marker = phase_status_ref(job_ref, phase, task_id)
+        if marker.get(transaction=transaction).exists:
+            return False, False
+        progress = job_ref.get(transaction=transaction).to_dict()['phases'][phase]
+        done = progress['done'] + 1
+        last = done >= progress['tasks']
+
+        transaction.set(marker, {'taskId': task_id, 'completedAt': firestore.SERVER_TIMESTAMP})
+        update = {f'phases.{phase}.done': done, **(job_update or {})}
+        if last:
+            update[f'phases.{phase}.completedAt'] = firestore.SERVER_TIMESTAMP
+            update.update(phase_update or {})
+        transaction.update(job_ref, update)
+        return True, last
+
+    new, last = complete(client.transaction())
+    if not new:
+        logger.info(f"{phase.capitalize()} task {task_id} of job {job_ref.id} was already complete")
+    return new, last
@@ -0,0 +1,292 @@
+# result_cache.py
+
+"""Content-addressed cache of classification results for repeat uploads.
+
+Two levels, both stored in Firestore:
+
+- ``resultCache/{fingerprint}``: the content fingerprint of an upload (the
+  object's MD5, or CRC32C and size for composite objects) points at the job
+  that already classified it. A repeat upload with the same model and
+  feature versions becomes a completed job that reads those results, without
+  the file being downloaded.
+- ``trackCache/{mmsi}-{hash}``: a per-vessel track hash maps to the track's
+  features and its prediction under one model version. The hash is the
+  wrapping sum of the track's row hashes, so it does not depend on row order
+  and can be accumulated chunk by chunk while streaming. Overlapping uploads
+  then only featurize and classify the vessels whose tracks changed.
+
+Entries expire ``CACHE_TTL`` after their last use (``expiresAt`` is also the
+field for a Firestore TTL policy) and ``evict_lru`` trims each collection to
+a maximum size by ``lastUsedAt``.
+"""
+
+import base64
+import logging
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS, KINEMATIC_COLUMNS, timestamps_to_ns
+from model_store import DUMMY_MODEL_VERSION
+
+logger = logging.getLogger(__name__)
+
+FILE_CACHE_COLLECTION = 'resultCache'
+TRACK_CACHE_COLLECTION = 'trackCache'
+
+# Entries are dropped this long after they were last used
+CACHE_TTL = timedelta(days=30)
+
+# lastUsedAt is refreshed at most this often, so most hits cost no write
+TOUCH_INTERVAL = timedelta(days=1)
+
+# Size limits enforced by evict_lru
+MAX_FILE_CACHE_ENTRIES = 10_000
+MAX_TRACK_CACHE_ENTRIES = 2_000_000
+
+# Documents per get_all call, batched write or eviction page
+CACHE_IO_BATCH = 500
+
+# Chunk column carrying each vessel's track cache key to process_chunk
+TRACK_KEY_COLUMN = 'track_key'
+
+FEATURE_DTYPE = '<f8'
+PROBABILITY_DTYPE = '<f4'
+
+
+def cache_enabled(settings):
+    """Whether the job settings allow the result cache (``cache=off`` disables it)."""
+    return str(settings.get('cache', 'on')).lower() not in ('off', 'false', 'no', '0')
+
+
+def file_fingerprint(object_data):
+    """Content fingerprint of a Storage object from its finalize event data."""
+    if getattr(object_data, 'md5_hash', None):
+        return 'md5-' + base64.b64decode(object_data.md5_hash).hex()
+    if getattr(object_data, 'crc32c', None):
+        return f'crc32c-{base64.b64decode(object_data.crc32c).hex()}-{int(object_data.size or 0)}'
+    return None
+
+
+def track_hashes(df):
+    """Per-vessel hashes of AIS rows with parsed timestamps.
+
+    Returns a frame indexed by mmsi with ``track_hash`` (uint64, the wrapping
+    sum of the row hashes) and ``num_points``. Values are normalized to int64
+    timestamps and float64 kinematics first, so the hash does not depend on
+    the dtypes a particular CSV chunk was read with.
+    """
+    mmsi = df['mmsi'].to_numpy(dtype=np.int64)
+    rows = pd.DataFrame({'mmsi': mmsi, 'timestamp': timestamps_to_ns(df['timestamp'])})
+    for col in KINEMATIC_COLUMNS:
+        rows[col] = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    row_hash = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    order = np.argsort(mmsi, kind='stable')
+    mmsi = mmsi[order]
+    starts = np.flatnonzero(np.r_[True, mmsi[1:] != mmsi[:-1]]) if len(mmsi) else np.zeros(0, dtype=np.int64)
+    sums = np.add.reduceat(row_hash[order], starts) if len(starts) else np.zeros(0, dtype=np.uint64)
+    return pd.DataFrame(
+        {'track_hash': sums.astype(np.uint64), 'num_points': np.diff(np.r_[starts, len(mmsi)])},
+        index=pd.Index(mmsi[starts], name='mmsi'),
+    )
+
+
+def merge_track_hashes(earlier, later):
+    """Combine ``track_hashes`` of two slices of the same rows."""
+    if earlier is None:
+        return later
+    index = earlier.index.union(later.index)
+    earlier = earlier.reindex(index, fill_value=0)
+    later = later.reindex(index, fill_value=0)
+    return pd.DataFrame({
+        'track_hash': earlier['track_hash'].to_numpy(dtype=np.uint64) + later['track_hash'].to_numpy(dtype=np.uint64),
+        'num_points': earlier['num_points'].to_numpy() + later['num_points'].to_numpy(),
+    }, index=index)
+
+
+def track_keys(hashes):
+    """Track cache document IDs, a Series indexed by mmsi."""
+    keys = [f'{mmsi}-{track_hash:016x}' for mmsi, track_hash in
+            zip(hashes.index.tolist(), hashes['track_hash'].tolist())]
+    return pd.Series(keys, index=hashes.index, dtype=object)
+
+
+class ResultCache:
+    """File and track caches for one model version and feature version."""
+
+    def __init__(self, client, model_version, feature_version, ttl=CACHE_TTL):
+        self.client = client
+        self.model_version = model_version
+        self.feature_version = feature_version
+        self.ttl = ttl
+
+    def _touch_fields(self, now):
+        return {'lastUsedAt': now, 'expiresAt': now + self.ttl}
+
+    @staticmethod
+    def _usable(entry, now):
+        expires_at = entry.get('expiresAt')
+        return expires_at is None or expires_at > now
+
+    @staticmethod
+    def _stale(entry, now):
+        last_used = entry.get('lastUsedAt')
+        return last_used is None or now - last_used > TOUCH_INTERVAL
+
+    def lookup_file(self, fingerprint):
+        """Return ``{'jobId', 'classificationSummary', 'vesselCount'}`` of an identical upload, or None."""
+        from firebase_admin import firestore
+
+        if not fingerprint or self.model_version == DUMMY_MODEL_VERSION:
+            return None
+        ref = self.client.collection(FILE_CACHE_COLLECTION).document(fingerprint)
+        snapshot = ref.get()
+        if not snapshot.exists:
+            return None
+
+        entry = snapshot.to_dict()
+        now = datetime.now(timezone.utc)
+        if not self._usable(entry, now) or entry.get('modelVersion') != self.model_version \
+                or entry.get('featureVersion') != self.feature_version:
+            return None
+
+        source = self.client.collection('jobs').document(entry['jobId']).get()
+        if not source.exists or source.get('status') != 'completed':
+            return None
+
+        ref.update({'hits': firestore.Increment(1), **self._touch_fields(now)})
+        source_data = source.to_dict()
+        summary = source_data.get('classificationSummary', {})
+        return {
+            'jobId': entry['jobId'],
+            'classificationSummary': summary,
+            'vesselCount': source_data.get('vesselCount', sum(summary.values())),
+        }
+
+    def remember_file(self, fingerprint, job_id):
+        """Record that ``job_id`` holds the finished results of the upload ``fingerprint``."""
+        if self.model_version == DUMMY_MODEL_VERSION:
+            return
+        now = datetime.now(timezone.utc)
+        self.client.collection(FILE_CACHE_COLLECTION).document(fingerprint).set({
+            'jobId': job_id,
+            'modelVersion': self.model_version,
+            'featureVersion': self.feature_version,
+            'createdAt': now,
+            'hits': 0,
+            **self._touch_fields(now),
+        })
+
+    def lookup_tracks(self, keys):
+        """Fetch cached tracks for ``keys`` (track keys indexed by mmsi).
+
+        Returns ``(predicted, featured)``. ``predicted`` is a tuple of
+        ``(mmsi, class_index, probabilities)`` arrays for tracks that have a
+        prediction from the current model (probabilities is None unless every
+        hit has them). ``featured`` is a frame with ``FEATURE_COLUMNS`` for the
+        remaining hits, whose features are valid but need classifying.
+        """
+        collection = self.client.collection(TRACK_CACHE_COLLECTION)
+        mmsi_by_key = dict(zip(keys.tolist(), keys.index.tolist()))
+        now = datetime.now(timezone.utc)
+
+        predicted_mmsi, class_index, probabilities = [], [], []
+        featured_mmsi, feature_rows, touched = [], [], []
+        key_list = list(mmsi_by_key)
+        for start in range(0, len(key_list), CACHE_IO_BATCH):
+            refs = [collection.document(key) for key in key_list[start:start + CACHE_IO_BATCH]]
+            for snapshot in self.client.get_all(refs):
+                if not snapshot.exists:
+                    continue
+                entry = snapshot.to_dict()
+                if entry.get('featureVersion') != self.feature_version or not self._usable(entry, now):
+                    continue
+                mmsi = mmsi_by_key[snapshot.id]
+                if entry.get('modelVersion') == self.model_version:
+                    predicted_mmsi.append(mmsi)
+                    class_index.append(entry['classIndex'])
+                    probabilities.append(np.frombuffer(entry.get('probabilities') or b'', dtype=PROBABILITY_DTYPE))
+                else:
+                    featured_mmsi.append(mmsi)
+                    feature_rows.append(np.frombuffer(entry['features'], dtype=FEATURE_DTYPE))
+                if self._stale(entry, now):
+                    touched.append(snapshot.reference)
+        self._touch(touched, now)
+
+        width = len(probabilities[0]) if probabilities else 0
+        stacked = np.vstack(probabilities) if width and all(len(p) == width for p in probabilities) else None
+        predicted = (np.array(predicted_mmsi, dtype=np.int64), np.array(class_index, dtype=np.int64), stacked)
+
+        featured = pd.DataFrame(
+            np.vstack(feature_rows) if feature_rows else np.zeros((0, len(FEATURE_COLUMNS) - 1)),
+            columns=FEATURE_COLUMNS[1:],
+        )
+        featured.insert(0, 'mmsi', np.array(featured_mmsi, dtype=np.int64))
+        return predicted, featured
+
+    def remember_tracks(self, keys, mmsi, features, predictions, probabilities=None):
+        """Store the features (``FEATURE_COLUMNS`` order, without mmsi) and predictions of classified tracks."""
+        if self.model_version == DUMMY_MODEL_VERSION:
+            return
+        collection = self.client.collection(TRACK_CACHE_COLLECTION)
+        now = datetime.now(timezone.utc)
+        features = np.asarray(features, dtype=FEATURE_DTYPE)
+        rows = list(zip(list(keys), np.asarray(mmsi).tolist(), np.asarray(predictions).tolist()))
+        for start in range(0, len(rows), CACHE_IO_BATCH):
+            batch = self.client.batch()
+            for row, (key, vessel, prediction) in enumerate(rows[start:start + CACHE_IO_BATCH], start):
+                if not isinstance(key, str):
+                    continue
+                batch.set(collection.document(key), {
+                    'mmsi': vessel,
+                    'featureVersion': self.feature_version,
+                    'features': features[row].tobytes(),
+                    'modelVersion': self.model_version,
+                    'classIndex': int(prediction),
+                    'probabilities': b'' if probabilities is None
+                    else np.asarray(probabilities[row], dtype=PROBABILITY_DTYPE).tobytes(),
+                    **self._touch_fields(now),
+                })
+            batch.commit()
+
+    def _touch(self, refs, now):
+        for start in range(0, len(refs), CACHE_IO_BATCH):
+            batch = self.client.batch()
+            for ref in refs[start:start + CACHE_IO_BATCH]:
+                batch.update(ref, self._touch_fields(now))
+            batch.commit()
+
+
+def _delete_matching(client, query, limit=None):
+    deleted = 0
+    while limit is None or deleted < limit:
+        size = CACHE_IO_BATCH if limit is None else min(CACHE_IO_BATCH, limit - deleted)
+        docs = list(query.limit(size).stream())
+        if not docs:
+            break
+        batch = client.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(docs)
+        if len(docs) < size:
+            break
+    return deleted
+
+
+def evict_lru(client, collection_name, max_entries):
+    """Delete expired entries, then the least recently used ones beyond ``max_entries``."""
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    collection = client.collection(collection_name)
+    now = datetime.now(timezone.utc)
+    deleted = _delete_matching(client, collection.where(filter=FieldFilter('expiresAt', '<', now)))
+
+    excess = collection.count().get()[0][0].value - max_entries
+    if excess > 0:
+        deleted += _delete_matching(client, collection.order_by('lastUsedAt'), limit=excess)
+
+    logger.info(f"Evicted {deleted} entries from {collection_name}")
+    return deleted
@@ -0,0 +1,326 @@
+# results_store.py
+
+"""Compact columnar storage of chunk predictions in Firestore.
+
+Instead of one dict per vessel, each results document holds packed arrays:
+MMSIs, class indices and a row-major float32 probability matrix, stored as
+Firestore bytes fields. A chunk whose arrays would exceed the document size
+limit is split into several documents that are written in one WriteBatch.
+``decode_result_doc`` turns either this format or the older per-vessel
+``predictions`` list back into the API's prediction dicts.
+
+Rolling jobs keep one set of documents per MMSI shard and upsert each new
+drop's predictions into it with ``merge_result_docs``; a per-row version
+(the drop sequence number) makes sure a late, older drop never overwrites
+a newer prediction. Each of a shard's documents owns an MMSI range and is
+merged in its own transaction, so a transaction writes one document, or a
+few when a full document splits its range.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Class index -> class name used by the classifier
+CLASS_NAMES = ['TUG', 'FISHING', 'PLEASURE', 'CARGO']
+
+RESULTS_FORMAT = 'columnar-v1'
+
+# Keep packed arrays well below Firestore's 1 MiB document limit
+MAX_RESULT_DOC_BYTES = 900 * 1024
+
+# Firestore limit on writes per batch
+MAX_BATCH_WRITES = 500
+
+# Payload per batch, below Firestore's 10 MiB limit on a commit request
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+# Allowance for a result document's field names and scalar fields
+RESULT_DOC_OVERHEAD_BYTES = 1024
+
+# Keys of a prediction dict returned by the API
+PREDICTION_FIELDS = ['mmsi', 'prediction', 'class_name', 'confidence', 'class_probabilities']
+
+# MMSI range owned by the first result document of a rolling shard
+MIN_MMSI = -2**63
+
+CLASS_INDEX_DTYPE = '<i2'
+PROBABILITY_DTYPE = '<f4'
+VERSION_DTYPE = '<u4'
+
+
+def _mmsi_dtype(mmsi):
+    if len(mmsi) == 0 or (mmsi.min() >= 0 and mmsi.max() < 2**32):
+        return '<u4'
+    return '<i8'
+
+
+def class_counts(predictions, class_names=CLASS_NAMES):
+    """Count predictions per class name (out-of-range indices count as UNKNOWN)."""
+    predictions = np.asarray(predictions, dtype=np.int64)
+    known = (predictions >= 0) & (predictions < len(class_names))
+    counts = np.bincount(predictions[known], minlength=len(class_names))
+    result = {name: int(count) for name, count in zip(class_names, counts) if count}
+    if (~known).any():
+        result['UNKNOWN'] = int((~known).sum())
+    return result
+
+
+def result_doc_id(chunk_id, part):
+    """Document ID of part ``part`` of a chunk's results."""
+    return str(chunk_id) if part == 0 else f'{chunk_id}-{part}'
+
+
+def encode_result_docs(mmsi, predictions, probabilities=None, class_names=CLASS_NAMES, versions=None):
+    """Pack predictions into one or more columnar result documents.
+
+    ``probabilities`` is an (n, n_classes) array or None and ``versions`` an
+    optional per-row version array. Returns a list of dicts sized to stay
+    under ``MAX_RESULT_DOC_BYTES`` each.
+    """
+    mmsi = np.asarray(mmsi, dtype=np.int64)
+    predictions = np.asarray(predictions, dtype=np.int64)
+    n_classes = 0 if probabilities is None else probabilities.shape[1]
+    mmsi_dtype = _mmsi_dtype(mmsi)
+
+    row_bytes = np.dtype(mmsi_dtype).itemsize + np.dtype(CLASS_INDEX_DTYPE).itemsize \
+        + n_classes * np.dtype(PROBABILITY_DTYPE).itemsize \
+        + (0 if versions is None else np.dtype(VERSION_DTYPE).itemsize)
+    rows_per_doc = max(1, MAX_RESULT_DOC_BYTES // row_bytes)
+
+    docs = []
+    for part, start in enumerate(range(0, max(len(mmsi), 1), rows_per_doc)):
+        end = start + rows_per_doc
+        doc = {
+            'format': RESULTS_FORMAT,
+            'part': part,
+            'count': len(mmsi[start:end]),
+            'classNames': list(class_names),
+            'classCounts': class_counts(predictions[start:end], class_names),
+            'mmsiDtype': mmsi_dtype,
+            'mmsi': mmsi[start:end].astype(mmsi_dtype).tobytes(),
+            'classIndex': predictions[start:end].astype(CLASS_INDEX_DTYPE).tobytes(),
+            'numClasses': n_classes,
+            'probabilities': b'' if probabilities is None
+            else np.ascontiguousarray(probabilities[start:end], dtype=PROBABILITY_DTYPE).tobytes(),
+        }
+        if versions is not None:
+            doc['version'] = np.asarray(versions[start:end]).astype(VERSION_DTYPE).tobytes()
+        docs.append(doc)
+    return docs
+
+
+def result_doc_bytes(doc):
+    """Approximate stored size of a result document: its packed arrays plus a fixed allowance."""
+    return RESULT_DOC_OVERHEAD_BYTES + sum(len(value) for value in doc.values() if isinstance(value, bytes))
+
+
+def write_result_docs(client, results_ref, chunk_id, docs, extra_fields=None):
+    """Write a chunk's result documents with batched writes, bounded by count and payload bytes."""
+    batch, writes, nbytes = client.batch(), 0, 0
+    for doc in docs:
+        size = result_doc_bytes(doc)
+        if writes and (writes >= MAX_BATCH_WRITES or nbytes + size > MAX_BATCH_BYTES):
+            batch.commit()
+            batch, writes, nbytes = client.batch(), 0, 0
+        batch.set(results_ref.document(result_doc_id(chunk_id, doc['part'])),
+                  {**doc, 'chunkId': chunk_id, **(extra_fields or {})})
+        writes += 1
+        nbytes += size
+    if writes:
+        batch.commit()
+
+
+def _stack_probabilities(kept, kept_rows, added, added_rows):
+    """Stack two probability blocks, filling a missing or differently sized block with NaN."""
+    if kept is None and added is None:
+        return None
+    width = (added if added is not None else kept).shape[1]
+    blocks = []
+    for block, rows in ((kept, kept_rows), (added, added_rows)):
+        if block is None or block.shape[1] != width:
+            block = np.full((rows, width), np.nan, dtype=np.float32)
+        blocks.append(block)
+    return np.vstack(blocks)
+
+
+def _range_doc_id(chunk_id, mmsi_from):
+    """ID of the rolling result document of ``chunk_id`` whose MMSI range starts at ``mmsi_from``."""
+    return result_doc_id(chunk_id, 0) if mmsi_from == MIN_MMSI else f'{chunk_id}-m{mmsi_from}'
+
+
+def _stored_rows(stored):
+    """``(mmsi, class, probabilities, version)`` arrays of a rolling result document, or empty ones."""
+    if stored is None or not stored.get('count'):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), None, np.zeros(0, dtype=VERSION_DTYPE)
+    mmsi, class_index, probabilities = decode_result_arrays(stored)
+    versions = np.frombuffer(stored['version'], dtype=VERSION_DTYPE) if stored.get('version') \
+        else np.zeros(len(mmsi), dtype=VERSION_DTYPE)
+    return mmsi, class_index, probabilities, versions
+
+
+def merge_result_docs(client, results_ref, chunk_id, mmsi, predictions, probabilities=None, version=0,
+                      extra_fields=None):
+    """Upsert predictions into the result documents of ``chunk_id``, one transaction per document.
+
+    Every document owns the MMSIs in ``[mmsiFrom, mmsiTo)``. Stored rows for
+    the same MMSI are replaced unless they carry a newer version, and a
+    document that outgrows ``MAX_RESULT_DOC_BYTES`` splits its range into new
+    documents in the same transaction. Returns ``(class_delta, added)``: the
+    per-class change in counts and the number of vessels not stored before.
+    """
+    from google.cloud import firestore as cloud_firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    mmsi = np.asarray(mmsi, dtype=np.int64)
+    predictions = np.asarray(predictions, dtype=np.int64)
+    probabilities = None if probabilities is None else np.asarray(probabilities)
+    ranges_query = results_ref.where(filter=FieldFilter('chunkId', '==', chunk_id)).select(['mmsiFrom'])
+
+    @cloud_firestore.transactional
+    def merge(transaction, doc_ref, rows):
+        snapshot = doc_ref.get(transaction=transaction)
+        stored = snapshot.to_dict() if snapshot.exists else None
+        mmsi_from = MIN_MMSI if stored is None else stored['mmsiFrom']
+        mmsi_to = None if stored is None else stored.get('mmsiTo')
+
+        # Rows a concurrent split moved to another document go back for routing
+        inside = mmsi[rows] >= mmsi_from
+        if mmsi_to is not None:
+            inside &= mmsi[rows] < mmsi_to
+        rows, moved = rows[inside], rows[~inside]
+
+        old_mmsi, old_class, old_probabilities, old_version = _stored_rows(stored)
+        match = pd.Index(old_mmsi).get_indexer(mmsi[rows])
+        take = match < 0
+        if len(old_mmsi):
+            take |= version >= old_version[np.maximum(match, 0)]
+        replaced = np.zeros(len(old_mmsi), dtype=bool)
+        replaced[match[take & (match >= 0)]] = True
+        keep = ~replaced
+        taken = rows[take]
+
+        merged_mmsi = np.concatenate([old_mmsi[keep], mmsi[taken]])
+        order = np.argsort(merged_mmsi, kind='stable')
+        merged_probabilities = _stack_probabilities(
+            None if old_probabilities is None else old_probabilities[keep], int(keep.sum()),
+            None if probabilities is None else probabilities[taken], len(taken),
+        )
+        docs = encode_result_docs(
+            merged_mmsi[order],
+            np.concatenate([old_class[keep], predictions[taken]])[order],
+            None if merged_probabilities is None else merged_probabilities[order],
+            versions=np.concatenate([old_version[keep], np.full(len(taken), version)])[order],
+        )
+
+        # The first document keeps the range start; each further one starts at its first MMSI
+        starts = [mmsi_from]
+        for doc in docs[1:]:
+            starts.append(int(np.frombuffer(doc['mmsi'], dtype=doc['mmsiDtype'])[0]))
+        for doc, start, end in zip(docs, starts, starts[1:] + [mmsi_to]):
+            ref = doc_ref if start == mmsi_from else results_ref.document(_range_doc_id(chunk_id, start))
+            transaction.set(ref, {**doc, 'chunkId': chunk_id, 'mmsiFrom': start, 'mmsiTo': end,
+                                  **(extra_fields or {})})
+
+        delta = class_counts(predictions[taken])
+        for name, count in class_counts(old_class[replaced]).items():
+            delta[name] = delta.get(name, 0) - count
+        return delta, int((take & (match < 0)).sum()), moved
+
+    class_delta, added = {}, 0
+    pending = np.arange(len(mmsi))
+    while len(pending):
+        ranges = sorted((doc.get('mmsiFrom'), doc.id) for doc in ranges_query.stream())
+        if not ranges or ranges[0][0] != MIN_MMSI:
+            ranges.insert(0, (MIN_MMSI, _range_doc_id(chunk_id, MIN_MMSI)))
+        owner = np.searchsorted([start for start, _ in ranges], mmsi[pending], side='right') - 1
+
+        moved = []
+        for index in np.unique(owner).tolist():
+            delta, new_rows, rest = merge(
+                client.transaction(), results_ref.document(ranges[index][1]), pending[owner == index]
+            )
+            for name, count in delta.items():
+                class_delta[name] = class_delta.get(name, 0) + count
+            added += new_rows
+            moved.append(rest)
+        pending = np.concatenate(moved)
+    return class_delta, added
+
+
+def decode_result_arrays(doc):
+    """Return ``(mmsi, class_index, probabilities)`` arrays of a columnar document."""
+    count = doc.get('count', 0)
+    mmsi = np.frombuffer(doc['mmsi'], dtype=doc.get('mmsiDtype', '<u4')).astype(np.int64)
+    class_index = np.frombuffer(doc['classIndex'], dtype=CLASS_INDEX_DTYPE).astype(np.int64)
+    n_classes = doc.get('numClasses', 0)
+    probabilities = None
+    if n_classes:
+        probabilities = np.frombuffer(doc['probabilities'], dtype=PROBABILITY_DTYPE).reshape(count, n_classes)
+    return mmsi, class_index, probabilities
+
+
+def _prediction_dicts(mmsi, class_index, probabilities, class_names, fields=None):
+    """Build API prediction dicts from decoded arrays, keeping only ``fields``."""
+    names = [class_names[i] if 0 <= i < len(class_names) else 'UNKNOWN' for i in class_index.tolist()]
+    columns = {
+        'mmsi': mmsi.tolist(),
+        'prediction': class_index.tolist(),
+        'class_name': names,
+    }
+    if probabilities is None:
+        columns['confidence'] = [0.0] * len(mmsi)
+    else:
+        columns['confidence'] = probabilities.max(axis=1).astype(float).tolist() if len(mmsi) else []
+        prob_names = class_names[:probabilities.shape[1]]
+        columns['class_probabilities'] = [dict(zip(prob_names, row)) for row in probabilities.astype(float).tolist()]
+
+    keys = [key for key in columns if fields is None or key in fields]
+    if not keys:
+        return [{} for _ in range(len(mmsi))]
+    return [dict(zip(keys, values)) for values in zip(*(columns[key] for key in keys))]
+
+
+def decode_result_page(doc, start=0, limit=None, classes=None, fields=None):
+    """Decode up to ``limit`` predictions of a results document from row ``start``.
+
+    Rows whose class name is not in ``classes`` are skipped and only the keys
+    in ``fields`` are kept. Returns ``(predictions, next_row)``, where
+    ``next_row`` is None once the document is exhausted.
+    """
+    if doc.get('format') != RESULTS_FORMAT:
+        # Older documents with one dict per vessel
+        rows = [
+            (row, prediction) for row, prediction in enumerate(doc.get('predictions', []))
+            if row >= start and (classes is None or prediction.get('class_name', 'UNKNOWN') in classes)
+        ]
+        if limit is not None:
+            rows = rows[:limit + 1]
+        next_row = rows[limit][0] if limit is not None and len(rows) > limit else None
+        page = [prediction for _, prediction in rows[:limit]]
+        if fields is not None:
+            page = [{key: value for key, value in prediction.items() if key in fields} for prediction in page]
+        return page, next_row
+
+    mmsi, class_index, probabilities = decode_result_arrays(doc)
+    class_names = doc.get('classNames', CLASS_NAMES)
+    mask = np.arange(len(mmsi)) >= start
+    if classes is not None:
+        wanted = [i for i, name in enumerate(class_names) if name in classes]
+        known = (class_index >= 0) & (class_index < len(class_names))
+        mask &= np.isin(class_index, wanted) | (~known & ('UNKNOWN' in classes))
+    rows = np.flatnonzero(mask)
+
+    next_row = None
+    if limit is not None and len(rows) > limit:
+        next_row = int(rows[limit])
+        rows = rows[:limit]
+    page = _prediction_dicts(
+        mmsi[rows], class_index[rows], None if probabilities is None else probabilities[rows],
+        class_names, fields,
+    )
+    return page, next_row
+
+
+def decode_result_doc(doc):
+    """Return the list of prediction dicts stored in a results document."""
+    return decode_result_page(doc)[0]
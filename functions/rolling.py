@@ -0,0 +1,313 @@
+# rolling.py
+
+"""Rolling (append-mode) jobs for continuously arriving AIS data.
+
+An upload with the ``rollingJob`` setting is a drop into the rolling job
+``jobs/rolling-{name}`` instead of a job of its own. The per-MMSI partial
+aggregates of ``features.track_partials`` (moments, extremes and the last
+point that stitches step distances across drops) are kept in Storage as one
+Parquet file per MMSI shard. A drop loads the partials of only the vessels
+it contains, folds its rows into them, writes the touched shards back and
+re-featurizes and re-classifies just those vessels.
+
+Drops of one rolling job are serialized by a lease on the rolling job
+document, so two drops never fold into the same stored state at once. The
+holder renews the lease while it reads (``LeaseRenewal``) and fails if it
+lost it. Each lease also hands out the drop's sequence number, which versions
+its result rows (see ``results_store.merge_result_docs``).
+
+Every state shard records the keys of the drops folded into it (the
+upload's content fingerprint, else its object generation) in its Parquet
+schema metadata. A drop that is
+delivered or uploaded again skips the rows of shards that already hold it,
+and only re-featurizes their vessels from the stored state.
+"""
+
+import io
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from parallel import shard_assignments
+
+logger = logging.getLogger(__name__)
+
+ROLLING_JOB_PREFIX = 'rolling-'
+
+# Storage shards of the per-MMSI state; also the result documents' chunk IDs
+ROLLING_SHARDS = 64
+
+# A crashed drop's lease expires after this long
+LEASE_SECONDS = 15 * 60
+
+# How long a drop waits for the lease, and how often it retries; the wait leaves
+# most of on_file_upload's 540s limit for the drop itself
+LEASE_WAIT_SECONDS = 2 * 60
+LEASE_POLL_SECONDS = 5
+
+# The lease is renewed once this much of it has passed
+LEASE_RENEW_SECONDS = LEASE_SECONDS // 3
+
+# Concurrent shard downloads and uploads
+STATE_IO_THREADS = 8
+
+# Drop keys remembered per state shard, and the Parquet metadata key holding them
+MAX_FOLD_KEYS = 256
+FOLDS_METADATA_KEY = b'veslint.rolling.folds'
+
+
+def rolling_job_id(name):
+    """Job document ID of the rolling job ``name``."""
+    return ROLLING_JOB_PREFIX + re.sub(r'[^A-Za-z0-9_-]', '-', str(name))[:100]
+
+
+def shard_key(shard):
+    """Result chunk ID of a state shard."""
+    return f's{shard:03d}'
+
+
+def mmsi_shards(mmsi, shards=ROLLING_SHARDS):
+    """State shard of each MMSI, independent of the integer dtype it was read with."""
+    return shard_assignments(np.asarray(mmsi, dtype=np.int64), shards)
+
+
+def shard_chunks(features, chunk_size, shards=ROLLING_SHARDS):
+    """Order ``features`` by state shard and cut chunks that never span two shards.
+
+    Returns ``(features, slices)`` with ``(shard, start, end)`` row slices.
+    """
+    shard = mmsi_shards(features['mmsi'].to_numpy(), shards)
+    order = np.argsort(shard, kind='stable')
+    shard = shard[order]
+    bounds = np.flatnonzero(np.r_[True, shard[1:] != shard[:-1], True]) if len(shard) else []
+    slices = [
+        (int(shard[begin]), start, min(start + chunk_size, end))
+        for begin, end in zip(bounds[:-1], bounds[1:])
+        for start in range(begin, end, chunk_size)
+    ]
+    return features.iloc[order], slices
+
+
+def drop_key(fingerprint, generation):
+    """Identity of a drop: its content fingerprint, else its object generation."""
+    return fingerprint or f'generation-{generation}'
+
+
+def encode_state(partials, folds):
+    """Parquet bytes of a state shard, with the drop keys ``folds`` in its schema metadata."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(partials)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        FOLDS_METADATA_KEY: json.dumps(list(folds)).encode('utf-8'),
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
+
+
+def decode_state(data):
+    """Return ``(partials, folds)`` of a state shard written by ``encode_state``."""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(data))
+    partials = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    if FOLDS_METADATA_KEY not in metadata:
+        # Shards written before the keys moved into the schema metadata kept them in attrs
+        return partials, list(partials.attrs.get('folds', []))
+    return partials, json.loads(metadata[FOLDS_METADATA_KEY])
+
+
+class RollingState:
+    """Stored per-MMSI partial aggregates of one rolling job, updated by the drop ``drop_key``."""
+
+    def __init__(self, bucket, rolling_id, drop_key=None, shards=ROLLING_SHARDS):
+        self.bucket = bucket
+        self.rolling_id = rolling_id
+        self.drop_key = drop_key
+        self.shards = shards
+        self.refolded = set()
+        self._loaded = {}
+        self._folds = {}
+
+    def _path(self, shard):
+        return f'rolling/{self.rolling_id}/partials/{shard:03d}.parquet'
+
+    def _load(self, shard):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            data = self.bucket.blob(self._path(shard)).download_as_bytes()
+        except NotFound:
+            return shard, (None, [])
+        return shard, decode_state(data)
+
+    def _load_shards(self, shards):
+        missing = [shard for shard in shards if shard not in self._loaded]
+        with ThreadPoolExecutor(STATE_IO_THREADS) as pool:
+            for shard, (partials, folds) in pool.map(self._load, missing):
+                self._loaded[shard] = partials
+                self._folds[shard] = folds
+
+    def _folded(self, shard):
+        return self.drop_key in self._folds[shard]
+
+    def skip_folded(self, chunk):
+        """Drop the rows of ``chunk`` in shards this drop was already folded into."""
+        if self.drop_key is None or not len(chunk):
+            return chunk
+        shard = mmsi_shards(chunk['mmsi'].to_numpy(), self.shards)
+        present = np.unique(shard).tolist()
+        self._load_shards(present)
+        folded = [s for s in present if self._folded(s)]
+        if not folded:
+            return chunk
+        skip = np.isin(shard, folded)
+        self.refolded.update(np.unique(chunk['mmsi'].to_numpy()[skip]).tolist())
+        return chunk[~skip]
+
+    def refolded_partials(self):
+        """Stored partials of the vessels whose rows ``skip_folded`` dropped, or None."""
+        if not self.refolded:
+            return None
+        logger.info(f"Drop {self.drop_key} was already folded for {len(self.refolded)} vessels")
+        return self.history(np.fromiter(self.refolded, dtype=np.int64))
+
+    def history(self, mmsi):
+        """Stored partials of the vessels in ``mmsi`` that earlier drops contained, or None."""
+        mmsi = np.unique(np.asarray(mmsi))
+        shard = mmsi_shards(mmsi, self.shards)
+        wanted = np.unique(shard).tolist()
+        self._load_shards(wanted)
+
+        frames = []
+        for s in wanted:
+            stored = self._loaded[s]
+            if stored is not None:
+                frames.append(stored[stored.index.isin(mmsi[shard == s])])
+        return pd.concat(frames) if frames else None
+
+    def save(self, partials):
+        """Write back the shards holding the updated ``partials``; returns the shard numbers."""
+        shard = mmsi_shards(partials.index.to_numpy(), self.shards)
+        touched = np.unique(shard).tolist()
+        self._load_shards(touched)
+
+        def save_shard(s):
+            updated = partials[shard == s]
+            stored = self._loaded[s]
+            folds = list(self._folds[s])
+            if stored is not None:
+                updated = pd.concat([stored[~stored.index.isin(updated.index)], updated]).sort_index()
+            if self.drop_key is not None and self.drop_key not in folds:
+                folds.append(self.drop_key)
+            # Written with the shard, so a shard records a drop exactly when it holds its rows
+            folds = folds[-MAX_FOLD_KEYS:]
+            self.bucket.blob(self._path(s)).upload_from_string(
+                encode_state(updated, folds), content_type='application/vnd.apache.parquet'
+            )
+            self._folds[s] = folds
+            self._loaded[s] = updated
+
+        with ThreadPoolExecutor(STATE_IO_THREADS) as pool:
+            list(pool.map(save_shard, touched))
+        return touched
+
+
+def acquire_lease(client, rolling_ref, owner, file_name=None, wait_seconds=LEASE_WAIT_SECONDS):
+    """Take the rolling job's lease for the drop ``owner`` and return the drop's sequence number.
+
+    Creates the rolling job document on its first drop. Raises TimeoutError
+    if another drop holds the lease for longer than ``wait_seconds``.
+    """
+    from google.cloud import firestore as cloud_firestore
+
+    @cloud_firestore.transactional
+    def try_acquire(transaction):
+        snapshot = rolling_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        now = datetime.now(timezone.utc)
+        holder = data.get('leaseOwner')
+        if holder and holder != owner and data.get('leaseExpiresAt') and data['leaseExpiresAt'] > now:
+            return None
+
+        sequence = data.get('drops', 0) + 1
+        update = {
+            'leaseOwner': owner,
+            'leaseExpiresAt': now + timedelta(seconds=LEASE_SECONDS),
+            'drops': sequence,
+        }
+        if not snapshot.exists:
+            update.update({
+                'rolling': True,
+                'fileName': file_name,
+                'status': 'rolling',
+                'createdAt': now,
+                'vesselCount': 0,
+                'classifiedVessels': 0,
+            })
+        transaction.set(rolling_ref, update, merge=True)
+        return sequence
+
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        sequence = try_acquire(client.transaction())
+        if sequence is not None:
+            return sequence
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for the lease of rolling job {rolling_ref.id}")
+        logger.info(f"Rolling job {rolling_ref.id} is busy, waiting for its lease")
+        time.sleep(LEASE_POLL_SECONDS)
+
+
+def renew_lease(client, rolling_ref, owner):
+    """Extend the lease held by ``owner``; raises RuntimeError if another drop took it over."""
+    from google.cloud import firestore as cloud_firestore
+
+    @cloud_firestore.transactional
+    def renew(transaction):
+        snapshot = rolling_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get('leaseOwner') != owner:
+            raise RuntimeError(f"Drop {owner} lost the lease of rolling job {rolling_ref.id}")
+        transaction.update(rolling_ref, {
+            'leaseExpiresAt': datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+        })
+
+    renew(client.transaction())
+
+
+class LeaseRenewal:
+    """Callable renewing a held lease whenever ``LEASE_RENEW_SECONDS`` passed since the last renewal."""
+
+    def __init__(self, client, rolling_ref, owner):
+        self.client = client
+        self.rolling_ref = rolling_ref
+        self.owner = owner
+        self._renewed = time.monotonic()
+
+    def __call__(self, *_):
+        if time.monotonic() - self._renewed >= LEASE_RENEW_SECONDS:
+            renew_lease(self.client, self.rolling_ref, self.owner)
+            self._renewed = time.monotonic()
+
+
+def release_lease(client, rolling_ref, owner):
+    """Release the lease if ``owner`` still holds it."""
+    from google.cloud import firestore as cloud_firestore
+
+    @cloud_firestore.transactional
+    def release(transaction):
+        snapshot = rolling_ref.get(transaction=transaction)
+        if snapshot.exists and snapshot.get('leaseOwner') == owner:
+            transaction.update(rolling_ref, {'leaseOwner': None, 'leaseExpiresAt': None})
+
+    release(client.transaction())
@@ -0,0 +1,265 @@
+# spatial.py
+
+"""Spatial index for distance-from-shore and in-port features.
+
+The index is built once from a coastline dataset (e.g. Natural Earth
+``ne_10m_coastline``) and a port dataset (harbour polygons, or port points
+such as the World Port Index, which are buffered to small circles) and saved
+as an uncompressed joblib artifact next to the model. At runtime it is loaded
+with ``mmap_mode`` and answers batched queries:
+
+- nearest coastline distance through a KD-tree over coastline vertices
+  embedded on the unit sphere (chord distance converted to great-circle km)
+- point-in-port through a lat/lon grid that buckets port polygons by the
+  cells their bounding boxes cover, followed by vectorized ray casting
+
+Build it with:
+    python functions/spatial.py coastline.geojson ports.geojson
+"""
+
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from kinematics import EARTH_RADIUS_KM, haversine_km
+
+logger = logging.getLogger(__name__)
+
+SPATIAL_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'spatial_index.joblib')
+
+# Size of the port grid cells in degrees
+PORT_GRID_DEGREES = 0.25
+
+# Radius of the circle used for ports given as points
+PORT_POINT_RADIUS_KM = 2.0
+
+# Coastline segments longer than this are densified before indexing
+MAX_COASTLINE_SEGMENT_KM = 1.0
+
+# Cell size (degrees) used to order nearest-shore queries
+QUERY_ORDER_DEGREES = 1.0
+
+# KD-tree leaf size for the coastline vertices
+COAST_TREE_LEAF_SIZE = 16
+
+# Upper bound on points x edges evaluated at once in ray casting
+RAY_CAST_BLOCK = 4_000_000
+
+
+def to_unit_xyz(lat, lon):
+    """Embed lat/lon degrees on the unit sphere."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def _grid_cells(lat, lon, grid_degrees):
+    rows = np.floor((np.asarray(lat) + 90) / grid_degrees).astype(np.int64)
+    cols = np.floor((np.asarray(lon) + 180) / grid_degrees).astype(np.int64)
+    return rows, cols
+
+
+def _points_in_ring(lon, lat, ring):
+    """Even-odd ray casting of points against one closed (lon, lat) ring."""
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    inside = np.zeros(len(lon), dtype=bool)
+    block = max(1, RAY_CAST_BLOCK // max(len(ring), 1))
+    for start in range(0, len(lon), block):
+        x = lon[start:start + block, None]
+        y = lat[start:start + block, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+        inside[start:start + block] = crosses.sum(axis=1) % 2 == 1
+    return inside
+
+
+class SpatialIndex:
+    """Batched nearest-coastline and point-in-port queries."""
+
+    def __init__(self, coast_tree, port_vertices, port_offsets, port_cell_keys, port_cell_polygons,
+                 grid_degrees=PORT_GRID_DEGREES):
+        self.coast_tree = coast_tree
+        self.port_vertices = port_vertices
+        self.port_offsets = port_offsets
+        self.port_cell_keys = port_cell_keys
+        self.port_cell_polygons = port_cell_polygons
+        self.grid_degrees = grid_degrees
+        self.grid_cols = int(np.ceil(360 / grid_degrees))
+
+    def distance_to_shore_km(self, lat, lon):
+        """Great-circle distance (km) from each point to the nearest coastline vertex."""
+        lat = np.asarray(lat, dtype=np.float64)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        distance = np.full(len(lat), np.nan)
+        if valid.any():
+            points = np.flatnonzero(valid)
+            # Query in spatially coherent order, which keeps tree traversal cache-friendly
+            rows, cols = _grid_cells(lat[points], np.asarray(lon)[points], QUERY_ORDER_DEGREES)
+            points = points[np.lexsort((cols, rows))]
+            chord, _ = self.coast_tree.query(to_unit_xyz(lat[points], np.asarray(lon)[points]), k=1)
+            distance[points] = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord[:, 0] / 2, 0, 1))
+        return distance
+
+    def in_port(self, lat, lon):
+        """Boolean array: whether each point lies inside any port polygon."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.zeros(len(lat), dtype=bool)
+        if len(self.port_cell_keys) == 0 or len(lat) == 0:
+            return result
+
+        rows, cols = _grid_cells(np.nan_to_num(lat, nan=-999), np.nan_to_num(lon, nan=-999), self.grid_degrees)
+        keys = rows * self.grid_cols + cols
+        left = np.searchsorted(self.port_cell_keys, keys, side='left')
+        counts = np.searchsorted(self.port_cell_keys, keys, side='right') - left
+        if counts.sum() == 0:
+            return result
+
+        # Expand to (point, candidate polygon) pairs
+        pair_points = np.repeat(np.arange(len(lat)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_polygons = np.asarray(self.port_cell_polygons)[np.repeat(left, counts) + offsets]
+
+        order = np.argsort(pair_polygons, kind='stable')
+        pair_points, pair_polygons = pair_points[order], pair_polygons[order]
+        starts = np.flatnonzero(np.r_[True, pair_polygons[1:] != pair_polygons[:-1]])
+        ends = np.r_[starts[1:], len(pair_polygons)]
+        for start, end in zip(starts, ends):
+            polygon = pair_polygons[start]
+            points = pair_points[start:end]
+            points = points[~result[points]]
+            if len(points) == 0:
+                continue
+            ring = np.asarray(self.port_vertices[self.port_offsets[polygon]:self.port_offsets[polygon + 1]])
+            result[points] |= _points_in_ring(lon[points], lat[points], ring)
+        return result
+
+    def save(self, path=SPATIAL_INDEX_PATH):
+        """Write the index uncompressed so it can be loaded memory-mapped."""
+        import joblib
+
+        joblib.dump({
+            'coast_tree': self.coast_tree,
+            'port_vertices': self.port_vertices,
+            'port_offsets': self.port_offsets,
+            'port_cell_keys': self.port_cell_keys,
+            'port_cell_polygons': self.port_cell_polygons,
+            'grid_degrees': self.grid_degrees,
+        }, path, compress=0)
+
+    @classmethod
+    def load(cls, path=SPATIAL_INDEX_PATH, mmap_mode='r'):
+        import joblib
+
+        return cls(**joblib.load(path, mmap_mode=mmap_mode))
+
+
+def _densify(line, max_segment_km=MAX_COASTLINE_SEGMENT_KM):
+    """Interpolate extra (lon, lat) vertices so no segment exceeds ``max_segment_km``."""
+    line = np.asarray(line, dtype=np.float64)[:, :2]
+    if len(line) < 2:
+        return line
+    lengths = haversine_km(line[:-1, 1], line[:-1, 0], line[1:, 1], line[1:, 0])
+    pieces = np.maximum(np.ceil(lengths / max_segment_km).astype(np.int64), 1)
+    fractions = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    fractions = fractions / np.repeat(pieces, pieces)
+    segment = np.repeat(np.arange(len(pieces)), pieces)
+    points = line[segment] + (line[segment + 1] - line[segment]) * fractions[:, None]
+    return np.vstack([points, line[-1:]])
+
+
+def _geometry_lines(geometry):
+    """Yield coordinate sequences (outer rings for polygons) of a GeoJSON geometry."""
+    kind, coords = geometry['type'], geometry.get('coordinates')
+    if kind == 'LineString':
+        yield coords
+    elif kind in ('MultiLineString', 'Polygon'):
+        yield from (coords if kind == 'MultiLineString' else coords[:1])
+    elif kind == 'MultiPolygon':
+        for polygon in coords:
+            yield polygon[0]
+    elif kind == 'GeometryCollection':
+        for part in geometry['geometries']:
+            yield from _geometry_lines(part)
+
+
+def _port_ring(geometry):
+    """Yield (lon, lat) rings for a port feature; points become small circles."""
+    if geometry['type'] == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        angles = np.linspace(0, 2 * np.pi, 17)[:-1]
+        dlat = np.degrees(PORT_POINT_RADIUS_KM / EARTH_RADIUS_KM)
+        dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        yield np.column_stack([lon + dlon * np.cos(angles), lat + dlat * np.sin(angles)])
+    else:
+        for ring in _geometry_lines(geometry):
+            yield np.asarray(ring, dtype=np.float64)[:, :2]
+
+
+def _features(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('type') == 'FeatureCollection':
+        return [feature['geometry'] for feature in data['features'] if feature.get('geometry')]
+    return [data]
+
+
+def build_spatial_index(coastline_path, ports_path, grid_degrees=PORT_GRID_DEGREES):
+    """Build a SpatialIndex from coastline and port GeoJSON files."""
+    from sklearn.neighbors import KDTree
+
+    coast = np.vstack([
+        _densify(line) for geometry in _features(coastline_path) for line in _geometry_lines(geometry)
+        if len(line) > 0
+    ])
+    coast_tree = KDTree(to_unit_xyz(coast[:, 1], coast[:, 0]), leaf_size=COAST_TREE_LEAF_SIZE)
+
+    rings = [ring for geometry in _features(ports_path) for ring in _port_ring(geometry) if len(ring) >= 3]
+    port_vertices = np.vstack(rings) if rings else np.zeros((0, 2))
+    port_offsets = np.r_[0, np.cumsum([len(ring) for ring in rings])].astype(np.int64)
+
+    grid_cols = int(np.ceil(360 / grid_degrees))
+    cell_keys, cell_polygons = [], []
+    for polygon, ring in enumerate(rings):
+        row_min, col_min = _grid_cells(ring[:, 1].min(), ring[:, 0].min(), grid_degrees)
+        row_max, col_max = _grid_cells(ring[:, 1].max(), ring[:, 0].max(), grid_degrees)
+        rows, cols = np.meshgrid(np.arange(row_min, row_max + 1), np.arange(col_min, col_max + 1))
+        keys = (rows * grid_cols + cols).ravel()
+        cell_keys.append(keys)
+        cell_polygons.append(np.full(len(keys), polygon))
+
+    cell_keys = np.concatenate(cell_keys) if cell_keys else np.zeros(0, dtype=np.int64)
+    cell_polygons = np.concatenate(cell_polygons) if cell_polygons else np.zeros(0, dtype=np.int64)
+    order = np.argsort(cell_keys, kind='stable')
+
+    logger.info(f"Indexed {len(coast)} coastline vertices and {len(rings)} port polygons")
+    return SpatialIndex(coast_tree, port_vertices, port_offsets, cell_keys[order], cell_polygons[order], grid_degrees)
+
+
+_spatial_index = None
+_spatial_index_loaded = False
+
+
+def get_spatial_index():
+    """Lazily load the bundled spatial index; None when the artifact is missing."""
+    global _spatial_index, _spatial_index_loaded
+    if not _spatial_index_loaded:
+        _spatial_index_loaded = True
+        if os.path.exists(SPATIAL_INDEX_PATH):
+            logger.info(f"Loading spatial index from {SPATIAL_INDEX_PATH}")
+            _spatial_index = SpatialIndex.load(SPATIAL_INDEX_PATH)
+        else:
+            logger.warning(f"Spatial index not found at {SPATIAL_INDEX_PATH}, using default shore/port features")
+    return _spatial_index
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (3, 4):
+        sys.exit('usage: python spatial.py COASTLINE.geojson PORTS.geojson [OUTPUT]')
+    build_spatial_index(sys.argv[1], sys.argv[2]).save(sys.argv[3] if len(sys.argv) == 4 else SPATIAL_INDEX_PATH)
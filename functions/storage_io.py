@@ -0,0 +1,188 @@
+# storage_io.py
+
+"""Parallel Cloud Storage transfers for large uploads and chunk fan-out.
+
+Downloads go through ``open_ranged``: a read-only file object over a blob
+that fetches fixed-size byte ranges on a thread pool ahead of the reader and
+hands them out in order. CSV parsers read it like any stream, so a multi-GB
+upload is parsed while it downloads, nothing lands in /tmp (which is
+RAM-backed in Cloud Functions) and memory is bounded by the read-ahead.
+Read-ahead ramps up one range at a time, so a short read such as header
+sniffing only fetches the first ranges.
+
+Uploads go through ``ChunkUploader``: a bounded thread pool that lets the
+caller keep encoding chunks while earlier ones upload, and blocks once
+``MAX_PENDING_UPLOADS`` are in flight.
+
+``pooled_client`` builds a Storage client on an ``AuthorizedSession`` whose
+connection pool is sized to the transfer threads. ``shared_bucket`` hands out
+buckets of one such client per instance, so warm invocations reuse its open
+connections instead of reconnecting per request.
+"""
+
+import io
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Byte range fetched per download request, and concurrent range requests
+DOWNLOAD_PART_BYTES = 16 * 1024 * 1024
+DOWNLOAD_THREADS = 8
+
+# Concurrent uploads, and uploads queued or in flight before submit() blocks
+UPLOAD_THREADS = 8
+MAX_PENDING_UPLOADS = 16
+
+# HTTP connections kept per Storage client
+HTTP_POOL_SIZE = 32
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def pooled_client(project=None, credentials=None, size=HTTP_POOL_SIZE):
+    """A Storage client whose HTTP session keeps up to ``size`` open connections.
+
+    Without ``credentials`` it uses the application default credentials, or
+    anonymous ones against a ``STORAGE_EMULATOR_HOST``.
+    """
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    if credentials is None:
+        if os.environ.get('STORAGE_EMULATOR_HOST'):
+            from google.auth.credentials import AnonymousCredentials
+
+            credentials = AnonymousCredentials()
+        else:
+            credentials, default_project = google.auth.default(scopes=storage.Client.SCOPE)
+            project = project or default_project
+
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def shared_bucket(name):
+    """Bucket ``name`` on this instance's pooled Storage client, created on first use."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = pooled_client()
+        return _shared_client.bucket(name)
+
+
+class RangedReader(io.RawIOBase):
+    """Reads bytes ``[start, end)`` of a blob through concurrent ranged downloads.
+
+    ``generation`` pins the object generation, so a blob overwritten while
+    it is read fails instead of mixing two versions.
+    """
+
+    def __init__(self, blob, end, start=0, part_bytes=DOWNLOAD_PART_BYTES, threads=DOWNLOAD_THREADS,
+                 generation=None):
+        super().__init__()
+        self.blob = blob
+        self.end = end
+        self.part_bytes = part_bytes
+        self.threads = threads
+        self.generation = generation
+        self._next_start = start
+        self._parts_read = 0
+        self._pending = deque()
+        self._buffer = memoryview(b'')
+        self._pool = None
+
+    def readable(self):
+        return True
+
+    def _fetch(self, start):
+        options = {'if_generation_match': self.generation} if self.generation else {}
+        return self.blob.download_as_bytes(start=start, end=min(start + self.part_bytes, self.end) - 1, **options)
+
+    def _schedule(self):
+        # One more range ahead per range consumed, up to one per thread
+        ahead = min(self.threads, self._parts_read + 1)
+        while len(self._pending) < ahead and self._next_start < self.end:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.threads)
+            self._pending.append(self._pool.submit(self._fetch, self._next_start))
+            self._next_start += self.part_bytes
+
+    def readinto(self, buffer):
+        if not len(self._buffer):
+            self._schedule()
+            if not self._pending:
+                return 0
+            self._buffer = memoryview(self._pending.popleft().result())
+            self._parts_read += 1
+            self._schedule()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._pending.clear()
+        super().close()
+
+
+def open_ranged(blob, size, start=0, generation=None, part_bytes=DOWNLOAD_PART_BYTES, threads=DOWNLOAD_THREADS):
+    """Buffered binary stream over bytes ``[start, size)`` of ``blob``, downloaded in parallel ranges."""
+    reader = RangedReader(blob, size, start, part_bytes, threads, generation)
+    return io.BufferedReader(reader, buffer_size=min(part_bytes, 1024 * 1024))
+
+
+class ChunkUploader:
+    """Uploads payloads on a bounded thread pool; use as a context manager.
+
+    Leaving the block waits for every upload and raises the first failure.
+    """
+
+    def __init__(self, threads=UPLOAD_THREADS, max_pending=MAX_PENDING_UPLOADS):
+        self._pool = ThreadPoolExecutor(threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.bytes = 0
+
+    def submit(self, blob, payload, content_type=None):
+        """Start uploading ``payload`` to ``blob``; blocks while the pool is full. Returns the future."""
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(blob.upload_from_string, payload, content_type=content_type)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self.futures.append(future)
+        self.bytes += len(payload)
+        return future
+
+    def wait(self):
+        """Block until every upload finished; raise the first failure."""
+        failures = [future.exception() for future in self.futures]
+        failures = [failure for failure in failures if failure is not None]
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {len(self.futures)} uploads failed: {failures[0]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            self._pool.shutdown(wait=exc_type is None, cancel_futures=exc_type is not None)
+        return False
@@ -0,0 +1,190 @@
+# validation.py
+
+"""Row-level validation of AIS data with quarantine of rejected rows.
+
+Each chunk is coerced to the explicit ``AIS_DTYPES`` schema and checked
+against every rule at once: one boolean array per rule, OR-ed into a single
+rejection mask. Bad rows are dropped instead of failing the file; they are
+kept in their original text form (up to ``QUARANTINE_MAX_ROWS``) together
+with the first rule they broke, and counted per rule. Only a missing
+required column still rejects the whole file.
+"""
+
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ['mmsi', 'timestamp', 'lat', 'lon', 'sog', 'cog', 'heading']
+
+# Compact column dtypes after validation (timestamps are datetime64[ns, UTC]).
+# Heading is nullable because AIS reports often omit it.
+AIS_DTYPES = {
+    'mmsi': 'uint32',
+    'lat': 'float32',
+    'lon': 'float32',
+    'sog': 'float32',
+    'cog': 'float32',
+    'heading': 'UInt16',
+}
+
+# Dtypes forced by the tolerant pandas reader. Numeric columns are left to
+# the parser and coerced afterwards, so one unparseable token becomes a
+# quarantined row instead of a read error for the whole file.
+AIS_READ_DTYPES = {'timestamp': 'str'}
+
+# Rule name -> description, in the order rows are attributed to rules
+VALIDATION_RULES = {
+    'mmsi_invalid': 'MMSI missing, not an integer or outside 1..2**32-1',
+    'timestamp_invalid': 'timestamp missing or unparseable',
+    'lat_invalid': 'latitude missing or outside -90..90',
+    'lon_invalid': 'longitude missing or outside -180..180',
+    'sog_invalid': 'speed over ground negative',
+}
+
+# SOG (knots) above which rows are kept but logged as suspicious
+HIGH_SOG_KNOTS = 100
+
+# Rejected rows kept for the quarantine file; beyond this they are only counted
+QUARANTINE_MAX_ROWS = 1_000_000
+
+REJECT_REASON_COLUMN = 'reject_reason'
+
+
+def check_required_columns(columns):
+    """Raise ValueError if any required AIS column is missing from ``columns``."""
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+
+
+def parse_timestamps(values):
+    """Parse timestamps to UTC, NaT where unparseable.
+
+    Columns the strict reader already parsed are only localized. Otherwise
+    the common single-format case is parsed in one vectorized call and only
+    values that format did not match are retried with per-element parsing.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.tz_localize('UTC') if values.dt.tz is None else values.dt.tz_convert('UTC')
+    parsed = pd.to_datetime(values, errors='coerce', utc=True)
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors='coerce', utc=True, format='mixed')
+    return parsed
+
+
+def _numeric(values, dtype='float64'):
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(dtype, copy=False)
+    return pd.to_numeric(values, errors='coerce').astype(dtype)
+
+
+def _heading(values):
+    """Headings as nullable UInt16; values that are not whole degrees in range become NA."""
+    if str(values.dtype) == AIS_DTYPES['heading']:
+        return values
+    heading = _numeric(values)
+    whole = (heading >= 0) & (heading < 2**16) & (heading % 1 == 0)
+    return heading.where(whole).astype(AIS_DTYPES['heading'])
+
+
+def validate_chunk(chunk):
+    """Validate a chunk of raw AIS rows.
+
+    Returns ``(clean, rejected, rule_counts)``: the valid rows coerced to
+    ``AIS_DTYPES`` with parsed timestamps, the invalid rows as read with a
+    ``reject_reason`` column, and the number of rows breaking each rule (a
+    row breaking several rules counts for each).
+    """
+    check_required_columns(chunk.columns)
+
+    mmsi = _numeric(chunk['mmsi'])
+    timestamp = parse_timestamps(chunk['timestamp'])
+    lat = _numeric(chunk['lat'], AIS_DTYPES['lat'])
+    lon = _numeric(chunk['lon'], AIS_DTYPES['lon'])
+    sog = _numeric(chunk['sog'], AIS_DTYPES['sog'])
+
+    rules = {
+        'mmsi_invalid': (mmsi.isna() | (mmsi <= 0) | (mmsi >= 2**32) | (mmsi % 1 != 0)).to_numpy(),
+        'timestamp_invalid': timestamp.isna().to_numpy(),
+        'lat_invalid': ~(lat.abs() <= 90).to_numpy(),
+        'lon_invalid': ~(lon.abs() <= 180).to_numpy(),
+        'sog_invalid': (sog < 0).to_numpy(),
+    }
+    bad = np.zeros(len(chunk), dtype=bool)
+    for broken in rules.values():
+        bad |= broken
+    rule_counts = {rule: int(broken.sum()) for rule, broken in rules.items()}
+
+    high_sog = int((sog[~bad] > HIGH_SOG_KNOTS).sum())
+    if high_sog:
+        # SOG in knots, 100 is very high but possible
+        logger.warning(f"{high_sog} rows with speed over ground above {HIGH_SOG_KNOTS} knots")
+
+    rejected = chunk[bad]
+    if len(rejected):
+        # Attribute each rejected row to the first rule it broke
+        reasons = np.select([broken[bad] for broken in rules.values()], list(rules), default='')
+        rejected = rejected.assign(**{REJECT_REASON_COLUMN: reasons})
+
+    good = ~bad
+    clean = chunk[good].copy()
+    clean['mmsi'] = mmsi[good].astype(AIS_DTYPES['mmsi'])
+    clean['timestamp'] = timestamp[good]
+    clean['lat'] = lat[good]
+    clean['lon'] = lon[good]
+    clean['sog'] = sog[good]
+    clean['cog'] = _numeric(clean['cog'], AIS_DTYPES['cog'])
+    clean['heading'] = _heading(clean['heading'])
+    return clean, rejected, rule_counts
+
+
+class RowValidator:
+    """Validates chunks in turn, collecting rule counts and quarantined rows."""
+
+    def __init__(self, max_quarantine_rows=QUARANTINE_MAX_ROWS):
+        self.max_quarantine_rows = max_quarantine_rows
+        self.rule_counts = dict.fromkeys(VALIDATION_RULES, 0)
+        self.rows = 0
+        self.rejected_rows = 0
+        self._quarantine = []
+        self._quarantined = 0
+
+    def reset(self):
+        """Forget everything seen so far, before validating a file again."""
+        self.__init__(self.max_quarantine_rows)
+
+    def __call__(self, chunk):
+        """Validate ``chunk`` and return its clean rows."""
+        clean, rejected, rule_counts = validate_chunk(chunk)
+        self.rows += len(chunk)
+        self.rejected_rows += len(rejected)
+        for rule, count in rule_counts.items():
+            self.rule_counts[rule] += count
+
+        room = self.max_quarantine_rows - self._quarantined
+        if len(rejected) and room > 0:
+            self._quarantine.append(rejected.iloc[:room])
+            self._quarantined += min(room, len(rejected))
+        return clean
+
+    def quarantine_csv(self):
+        """CSV bytes of the quarantined rows, or None if nothing was rejected."""
+        if not self._quarantine:
+            return None
+        buffer = io.StringIO()
+        pd.concat(self._quarantine, ignore_index=True).to_csv(buffer, index=False)
+        return buffer.getvalue().encode('utf-8')
+
+    def summary(self):
+        """Validation stats recorded on the job document."""
+        return {
+            'rows': self.rows,
+            'rejectedRows': self.rejected_rows,
+            'quarantinedRows': self._quarantined,
+            'ruleCounts': self.rule_counts,
+        }
@@ -0,0 +1,103 @@
+# vessel_index.py
+
+"""Per-MMSI classification history across jobs.
+
+process_chunk writes one small entry per classified vessel to
+``vesselIndex/{mmsi}/history/{jobId}`` holding the job, class, confidence
+and model version. The document ID is the job ID, so a retried chunk or a
+later drop of a rolling job overwrites the vessel's entry for that job
+instead of adding a duplicate. A history query for a vessel reads only its
+own entries in the time range, so it costs O(matches) reads instead of a
+scan over every job's result documents.
+
+Entries expire ``INDEX_TTL`` after they were written (``expiresAt`` is the
+field for a Firestore TTL policy on the ``history`` collection group).
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from results_store import CLASS_NAMES
+
+logger = logging.getLogger(__name__)
+
+VESSEL_INDEX_COLLECTION = 'vesselIndex'
+HISTORY_COLLECTION = 'history'
+
+# Index entries are dropped this long after they were written
+INDEX_TTL = timedelta(days=400)
+
+# Limits of one history query
+MAX_HISTORY_VESSELS = 100
+DEFAULT_HISTORY_LIMIT = 100
+MAX_HISTORY_LIMIT = 1000
+
+# Concurrent per-vessel queries of one history request
+HISTORY_QUERY_THREADS = 16
+
+
+def index_enabled(settings):
+    """Whether the job settings allow the vessel index (``vesselIndex=off`` disables it)."""
+    return str((settings or {}).get('vesselIndex', 'on')).lower() not in ('off', 'false', 'no', '0')
+
+
+def history_ref(client, mmsi):
+    """History collection of one vessel."""
+    return client.collection(VESSEL_INDEX_COLLECTION).document(str(int(mmsi))).collection(HISTORY_COLLECTION)
+
+
+def index_predictions(client, job_id, mmsi, predictions, probabilities=None, model_version=None,
+                      extra_fields=None, class_names=CLASS_NAMES):
+    """Write the history entries of classified vessels with a bulk writer."""
+    now = datetime.now(timezone.utc)
+    mmsi = np.asarray(mmsi, dtype=np.int64)
+    predictions = np.asarray(predictions, dtype=np.int64)
+    confidence = None if probabilities is None else np.asarray(probabilities).max(axis=1)
+
+    writer = client.bulk_writer()
+    for row, (vessel, class_index) in enumerate(zip(mmsi.tolist(), predictions.tolist())):
+        writer.set(history_ref(client, vessel).document(job_id), {
+            'mmsi': vessel,
+            'jobId': job_id,
+            'classIndex': class_index,
+            'className': class_names[class_index] if 0 <= class_index < len(class_names) else 'UNKNOWN',
+            'confidence': None if confidence is None else float(confidence[row]),
+            'modelVersion': model_version,
+            'indexedAt': now,
+            'expiresAt': now + INDEX_TTL,
+            **(extra_fields or {})
+        })
+    writer.close()
+
+
+def _entry(snapshot):
+    entry = snapshot.to_dict()
+    for key in ('indexedAt', 'expiresAt'):
+        if entry.get(key) is not None:
+            entry[key] = entry[key].isoformat()
+    return entry
+
+
+def vessel_history(client, mmsi_list, since=None, until=None, limit=DEFAULT_HISTORY_LIMIT):
+    """Classification history of each vessel in ``mmsi_list``, newest first.
+
+    Returns ``{mmsi: [entry, ...]}`` with at most ``limit`` entries per vessel
+    indexed in ``[since, until)``.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    def query(mmsi):
+        q = history_ref(client, mmsi)
+        if since is not None:
+            q = q.where(filter=FieldFilter('indexedAt', '>=', since))
+        if until is not None:
+            q = q.where(filter=FieldFilter('indexedAt', '<', until))
+        q = q.order_by('indexedAt', direction='DESCENDING').limit(limit)
+        return mmsi, [_entry(snapshot) for snapshot in q.stream()]
+
+    mmsi_list = list(dict.fromkeys(int(mmsi) for mmsi in mmsi_list))
+    with ThreadPoolExecutor(min(HISTORY_QUERY_THREADS, max(len(mmsi_list), 1))) as pool:
+        return dict(pool.map(query, mmsi_list))
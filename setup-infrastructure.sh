@@ -64,14 +64,16 @@ gcloud services enable cloudbuild.googleapis.com
 
 print_success "APIs enabled successfully"
 
-# Create Pub/Sub topic
-print_status "Creating Pub/Sub topic 'process-chunk'..."
-if gcloud pubsub topics describe process-chunk &>/dev/null; then
-    print_warning "Pub/Sub topic 'process-chunk' already exists"
-else
-    gcloud pubsub topics create process-chunk
-    print_success "Pub/Sub topic 'process-chunk' created"
-fi
+# Create Pub/Sub topics (chunk classification, and the map and reduce tasks of large uploads)
+for topic in process-chunk map-split reduce-shard; do
+    print_status "Creating Pub/Sub topic '$topic'..."
+    if gcloud pubsub topics describe "$topic" &>/dev/null; then
+        print_warning "Pub/Sub topic '$topic' already exists"
+    else
+        gcloud pubsub topics create "$topic"
+        print_success "Pub/Sub topic '$topic' created"
+    fi
+done
 
 # Initialize Firestore (if not already done)
 print_status "Checking Firestore database..."
@@ -83,6 +85,18 @@ else
     print_success "Firestore database created"
 fi
 
+# Expire result cache entries through Firestore TTL policies
+print_status "Configuring result cache TTL policies..."
+for COLLECTION in resultCache trackCache; do
+    gcloud firestore fields ttls update expiresAt --collection-group=$COLLECTION --enable-ttl --async \
+        || print_warning "Could not set TTL policy on $COLLECTION"
+done
+
+# Expire per-vessel history entries the same way
+print_status "Configuring vessel index TTL policy..."
+gcloud firestore fields ttls update expiresAt --collection-group=history --enable-ttl --async \
+    || print_warning "Could not set TTL policy on history"
+
 # Create storage bucket (if not already exists)
 print_status "Checking Cloud Storage bucket..."
 BUCKET_NAME="${PROJECT_ID}.appspot.com"
@@ -0,0 +1,6 @@
+# conftest.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
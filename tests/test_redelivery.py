@@ -0,0 +1,122 @@
+# test_redelivery.py
+
+"""Exactly-once chunk accounting when process-chunk messages are redelivered.
+
+Every chunk message of a job is delivered several times, shuffled, on
+concurrent threads, through ``main.process_chunk_message``: the body of the
+process_chunk handler. Chunks are served from an in-memory bucket; progress,
+results and the job document live in the Firestore emulator:
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m pytest -q tests/test_redelivery.py
+"""
+
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('FIRESTORE_EMULATOR_HOST'), reason='needs the Firestore emulator (FIRESTORE_EMULATOR_HOST)'
+)
+
+PROJECT = 'demo-project'
+CHUNKS = 40
+COPIES = 3
+CHUNKS_PER_MESSAGE = 2
+THREADS = 16
+
+
+class MemoryBucket:
+    """Storage stand-in serving chunk payloads from a dict."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def blob(self, name):
+        return MemoryBlob(self.blobs, name)
+
+
+class MemoryBlob:
+    def __init__(self, blobs, name):
+        self.blobs = blobs
+        self.name = name
+
+    def download_as_bytes(self):
+        return self.blobs[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        self.blobs[self.name] = data
+
+
+@pytest.fixture(scope='module')
+def main():
+    os.environ.setdefault('GCLOUD_PROJECT', PROJECT)
+    os.environ.setdefault('PUBSUB_EMULATOR_HOST', 'localhost:8085')
+    os.environ.setdefault('FIREBASE_CONFIG', json.dumps({
+        'projectId': PROJECT, 'storageBucket': f'{PROJECT}.appspot.com'
+    }))
+    import main
+
+    return main
+
+
+def feature_chunks(job_id, rng):
+    """Encoded feature chunks of ``CHUNKS`` chunks with 50 to 150 vessels each, and their vessel counts."""
+    from chunk_io import CHUNK_EXTENSIONS, CHUNK_FORMAT, encode_chunk
+    from model_store import EXPECTED_FEATURES
+
+    blobs, vessels, first_mmsi = {}, {}, 200000000
+    for chunk_id in range(CHUNKS):
+        count = int(rng.integers(50, 151))
+        chunk = pd.DataFrame(rng.random((count, len(EXPECTED_FEATURES))), columns=EXPECTED_FEATURES)
+        chunk.insert(0, 'mmsi', np.arange(first_mmsi, first_mmsi + count))
+        first_mmsi += count
+        blobs[f'chunks/{job_id}/{chunk_id}{CHUNK_EXTENSIONS[CHUNK_FORMAT]}'] = encode_chunk(chunk, CHUNK_FORMAT)
+        vessels[chunk_id] = count
+    return blobs, vessels
+
+
+def test_redelivered_chunks_are_counted_once(main):
+    from chunk_io import CHUNK_EXTENSIONS, CHUNK_FORMAT
+    from firebase_admin import firestore
+    from progress import completed_chunk_count, progress_totals
+    from results_store import CLASS_NAMES, decode_result_arrays
+
+    client = firestore.client()
+    job_ref = client.collection('jobs').document()
+    job_ref.set({'status': 'processing', 'chunkCount': CHUNKS, 'processedChunks': 0, 'classifiedVessels': 0})
+
+    blobs, vessels = feature_chunks(job_ref.id, np.random.default_rng(0))
+    messages = [
+        {'jobId': job_ref.id, 'vesselIndex': False, 'chunks': [
+            {'chunkId': chunk_id, 'chunkPath': f'chunks/{job_ref.id}/{chunk_id}{CHUNK_EXTENSIONS[CHUNK_FORMAT]}'}
+            for chunk_id in range(start, min(start + CHUNKS_PER_MESSAGE, CHUNKS))
+        ]}
+        for start in range(0, CHUNKS, CHUNKS_PER_MESSAGE)
+    ] * COPIES
+    random.Random(0).shuffle(messages)
+
+    bucket = MemoryBucket(blobs)
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(lambda message: main.process_chunk_message(client, bucket, message), messages))
+
+    job = job_ref.get().to_dict()
+    results = [doc.to_dict() for doc in job_ref.collection('results').stream()]
+    stored_mmsi = np.concatenate([decode_result_arrays(doc)[0] for doc in results])
+    stored_class = np.concatenate([decode_result_arrays(doc)[1] for doc in results])
+    stored_summary = pd.Series(np.asarray(CLASS_NAMES)[stored_class]).value_counts().to_dict()
+    totals = progress_totals(job_ref)
+
+    assert job['status'] == 'completed', job.get('error')
+    assert job['processedChunks'] == CHUNKS
+    assert completed_chunk_count(job_ref) == CHUNKS
+    assert len(results) == CHUNKS
+    assert len(stored_mmsi) == len(np.unique(stored_mmsi)) == sum(vessels.values())
+    assert job['classifiedVessels'] == sum(vessels.values())
+    assert job['classificationSummary'] == stored_summary
+    assert totals.get('fallbackChunks', 0) == (CHUNKS if job.get('modelVersion') == 'dummy' else 0)
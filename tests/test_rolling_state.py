@@ -0,0 +1,92 @@
+# test_rolling_state.py
+
+import io
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from features import track_partials
+from ingest import read_ais_csv
+from rolling import FOLDS_METADATA_KEY, MAX_FOLD_KEYS, RollingState, decode_state, encode_state
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), '..', 'sample-ais-data.csv')
+
+
+class MemoryBucket:
+    """Storage stand-in keeping blobs in a dict."""
+
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name):
+        return MemoryBlob(self.blobs, name)
+
+
+class MemoryBlob:
+    def __init__(self, blobs, name):
+        self.blobs = blobs
+        self.name = name
+
+    def download_as_bytes(self):
+        from google.api_core.exceptions import NotFound
+
+        if self.name not in self.blobs:
+            raise NotFound(self.name)
+        return self.blobs[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        self.blobs[self.name] = data
+
+
+@pytest.fixture
+def partials():
+    partials = track_partials(read_ais_csv(SAMPLE_CSV))
+    partials.attrs.clear()
+    return partials
+
+
+def test_fold_keys_survive_a_parquet_round_trip(partials):
+    decoded, folds = decode_state(encode_state(partials, ['fingerprint-a', 'generation-7']))
+
+    assert folds == ['fingerprint-a', 'generation-7']
+    pd.testing.assert_frame_equal(decoded, partials)
+
+
+def test_fold_keys_are_schema_metadata(partials):
+    data = encode_state(partials, ['fingerprint-a'])
+
+    assert pq.read_schema(io.BytesIO(data)).metadata[FOLDS_METADATA_KEY] == b'["fingerprint-a"]'
+
+
+def test_shards_written_with_attrs_keep_their_fold_keys(partials):
+    partials.attrs['folds'] = ['fingerprint-a']
+    buffer = io.BytesIO()
+    partials.to_parquet(buffer)
+
+    assert decode_state(buffer.getvalue())[1] == ['fingerprint-a']
+
+
+def test_a_saved_drop_is_skipped_after_reload(partials):
+    pytest.importorskip('google.api_core')
+    bucket = MemoryBucket()
+    chunk = pd.DataFrame({'mmsi': partials.index.to_numpy()})
+
+    RollingState(bucket, 'r', 'fingerprint-a', shards=4).save(partials)
+    reloaded = RollingState(bucket, 'r', 'fingerprint-a', shards=4)
+
+    assert len(reloaded.skip_folded(chunk)) == 0
+    assert reloaded.refolded == set(partials.index.tolist())
+    assert len(RollingState(bucket, 'r', 'fingerprint-b', shards=4).skip_folded(chunk)) == len(chunk)
+
+
+def test_fold_keys_are_bounded(partials):
+    pytest.importorskip('google.api_core')
+    keys = [f'generation-{i}' for i in range(MAX_FOLD_KEYS + 10)]
+    bucket = MemoryBucket()
+    bucket.blobs['rolling/r/partials/000.parquet'] = encode_state(partials.iloc[:0], keys[:-1])
+
+    RollingState(bucket, 'r', keys[-1], shards=1).save(partials)
+
+    assert decode_state(bucket.blobs['rolling/r/partials/000.parquet'])[1] == keys[-MAX_FOLD_KEYS:]